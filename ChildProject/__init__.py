@@ -1,5 +1,5 @@
 __all__= [
-    'table',
+    'tables',
     'projects',
     'annotations'
 ]
\ No newline at end of file
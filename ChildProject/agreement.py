@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+
+from . import profiling
+from .parallel import Executor
+from .raster import Rasterizer
+
+def confusion_matrix(a, b):
+    """confusion matrix between two rasters of shape (categories, frames).
+
+    An extra 'none' category stands for frames where no category is active.
+    Frames where several categories are active count once for each
+    pair of active categories.
+    """
+    a = np.vstack([a, a.sum(axis = 0) == 0]).astype(np.float64)
+    b = np.vstack([b, b.sum(axis = 0) == 0]).astype(np.float64)
+    return np.rint(a @ b.T).astype(np.int64)
+
+def agreement_metrics(confusion):
+    """precision, recall and f-score of each category (rows: reference,
+    columns: hypothesis), along with Cohen's kappa across all categories"""
+    matrix = confusion.values.astype(np.float64)
+    total = matrix.sum()
+    true_positives = np.diag(matrix)
+    reference = matrix.sum(axis = 1)
+    hypothesis = matrix.sum(axis = 0)
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        precision = true_positives/hypothesis
+        recall = true_positives/reference
+        fscore = 2*precision*recall/(precision + recall)
+
+        observed = true_positives.sum()/total
+        expected = (reference*hypothesis).sum()/(total**2)
+        kappa = (observed - expected)/(1 - expected)
+
+    metrics = pd.DataFrame({
+        'precision': precision,
+        'recall': recall,
+        'fscore': fscore,
+        'reference_frames': reference.astype(np.int64),
+        'hypothesis_frames': hypothesis.astype(np.int64)
+    }, index = confusion.index)
+
+    return metrics, kappa
+
+class Agreement:
+    """frame-level agreement between two annotation sets on the portions
+    of recordings they both cover (as returned by AnnotationManager.intersection).
+
+    :param am: AnnotationManager
+    :param column: segments column to compare (e.g. speaker_type, vcm_type, addresseee)
+    :param categories: labels to compare (by default, the permitted values of the column)
+    :param resolution: frame duration in seconds
+    """
+
+    def __init__(self, am, column = 'speaker_type', categories = None, resolution = 0.01):
+        self.am = am
+        self.rasterizer = Rasterizer(am, resolution = resolution, column = column, categories = categories)
+        self.labels = self.rasterizer.categories + ['none']
+
+    @profiling.timed('agreement.recording')
+    def recording_confusion(self, pairs):
+        confusion = np.zeros((len(self.labels), len(self.labels)), dtype = np.int64)
+
+        for a, b in pairs:
+            start = a['time_seek'] + a['range_onset']
+            stop = a['time_seek'] + a['range_offset']
+
+            a_frames, covered = self.rasterizer.rasterize(pd.DataFrame([a]), start, stop)
+            b_frames, _ = self.rasterizer.rasterize(pd.DataFrame([b]), start, stop)
+
+            confusion += confusion_matrix(a_frames[:, covered], b_frames[:, covered])
+
+        return confusion
+
+    def compare(self, left, right, executor = None):
+        """compare left (reference) and right (hypothesis) annotations.
+
+        returns a dictionary of confusion matrices indexed by recording,
+        and the confusion matrix pooled across all recordings."""
+        if executor is None:
+            executor = Executor('process')
+
+        a, b = self.am.intersection(left, right)
+        a, b = a.reset_index(drop = True), b.reset_index(drop = True)
+
+        imported = a['annotation_filename'].notnull() & b['annotation_filename'].notnull()
+        a, b = a[imported], b[imported]
+
+        pairs = {}
+        for a_row, b_row in zip(a.to_dict(orient = 'records'), b.to_dict(orient = 'records')):
+            pairs.setdefault(a_row['recording_filename'], []).append((a_row, b_row))
+
+        recordings = list(pairs.keys())
+        matrices = executor.map(self.recording_confusion, [pairs[r] for r in recordings])
+
+        confusion = {
+            recording: pd.DataFrame(matrix, index = self.labels, columns = self.labels)
+            for recording, matrix in zip(recordings, matrices)
+        }
+
+        pooled = pd.DataFrame(
+            np.sum(matrices, axis = 0) if matrices else np.zeros((len(self.labels), len(self.labels)), dtype = np.int64),
+            index = self.labels,
+            columns = self.labels
+        )
+
+        return confusion, pooled
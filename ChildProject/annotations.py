@@ -1,8 +1,9 @@
 from collections import defaultdict
 import datetime
-import multiprocessing as mp
+from functools import partial
 from numbers import Number
 import numpy as np
+import operator
 import os
 import pandas as pd
 import pympi
@@ -10,9 +11,13 @@ import shutil
 import sys
 import traceback
 
+from . import profiling
+from .cache import SegmentsCache
+from .diagnostics import Diagnostics
+from .parallel import Executor
 from .projects import ChildProject
-from .tables import IndexTable, IndexColumn
-from .utils import Segment, intersect_ranges
+from .tables import IndexTable, IndexColumn, ForeignKey, RangeConstraint
+from .utils import Segment, intersect_ranges, lock_file, lock_path, write_dataframe
 
 class AnnotationManager:
     INDEX_COLUMNS = [
@@ -90,273 +95,272 @@ class AnnotationManager:
         'SPEECH': 'SPEECH'
     })
 
+    INDEX_RECORDING = ForeignKey('recording_filename', 'recordings', 'filename')
+    INDEX_RANGE = RangeConstraint('range_onset', 'range_offset', 'recordings', 'recording_filename', 'filename', 'duration', shift = 'time_seek')
+    SEGMENTS_RANGE = RangeConstraint('segment_onset', 'segment_offset', 'recordings', 'recording_filename', 'filename', 'duration', shift = 'time_seek')
 
-    def __init__(self, project):
+
+    def __init__(self, project, cache_size = 256*1024*1024):
         self.project = project
         self.annotations = None
         self.errors = []
+        self.segments_cache = SegmentsCache(cache_size)
 
         if not isinstance(project, ChildProject):
             raise ValueError('project should derive from ChildProject')
 
         project.read()
 
-        index_path = os.path.join(self.project.path, 'metadata/annotations.csv')
-        if not os.path.exists(index_path):
-            open(index_path, 'w+').write(','.join([c.name for c in self.INDEX_COLUMNS]))
+        self.index_path = os.path.join(self.project.path, 'metadata/annotations.csv')
+        self.lock_path = lock_path(self.project.path, 'annotations.lock', 'metadata/.annotations.lock')
+
+        with lock_file(self.lock_path):
+            if not os.path.exists(self.index_path):
+                write_dataframe(pd.DataFrame(columns = [c.name for c in self.INDEX_COLUMNS]), self.index_path, index = False)
 
         errors, warnings = self.read()
 
+    @profiling.timed('annotations.read')
     def read(self):
-        table = IndexTable('input', path = os.path.join(self.project.path, 'metadata/annotations.csv'), columns = self.INDEX_COLUMNS)
+        table = IndexTable('input', path = self.index_path, columns = self.INDEX_COLUMNS)
         self.annotations = table.read()
         errors, warnings = table.validate()
         return errors, warnings
 
-    def validate(self):
-        errors, warnings = [], []
+    def recording_durations(self, annotations):
+        """duration of the recording of each annotation (None if it is unknown)"""
+        if 'duration' not in self.project.recordings.columns:
+            return [None]*len(annotations)
 
-        for annotation in self.annotations.to_dict(orient = 'records'):
-            segments = IndexTable(
-                'segments',
-                path = os.path.join(self.project.path, 'annotations', annotation['annotation_filename']),
-                columns = self.SEGMENTS_COLUMNS
-            )
+        durations = self.project.recordings.drop_duplicates('filename').set_index('filename')['duration']
+        durations = pd.to_numeric(durations, errors = 'coerce')
+        return [None if pd.isnull(d) else float(d) for d in annotations['recording_filename'].map(durations)]
 
-            segments.read()
-            res = segments.validate()
-            errors += res[0]
-            warnings += res[1]
+    def validate_annotation(self, annotation, max_per_rule = None, cache = None):
+        duration = self.recording_durations(pd.DataFrame([annotation]))[0]
+        return validate_annotation(self.project.path, (annotation, duration), max_per_rule = max_per_rule, cache = cache)
 
-        return errors, warnings
-        
+    def check_segments(self, annotation, segments):
+        """errors for the segments of an annotation which exceed the range of its recording"""
+        return check_segments(annotation, segments, self.project.recordings)
 
-    def load_textgrid(self, filename):
-        path = os.path.join(self.project.path, 'raw_annotations', filename)
-        textgrid = pympi.Praat.TextGrid(path)
-
-        def ling_type(s):
-            s = str(s)
-
-            a, b = ('0' in s, '1' in s)
-            if a^b:
-                return '0' if a else '1' 
-            else:
-                return 'NA'
-
-        segments = []
-        for tier in textgrid.tiers:
-            for interval in tier.intervals:
-                tier_name = tier.name.strip()
-
-                if tier_name == 'Autre':
-                    continue
-
-                if interval[2] == "":
-                    continue
-
-                segment = {
-                    'segment_onset': float(interval[0]),
-                    'segment_offset': float(interval[1]),
-                    'speaker_id': tier_name,
-                    'ling_type': ling_type(interval[2]),
-                    'speaker_type': self.SPEAKER_ID_TO_TYPE[tier_name] if tier_name in self.SPEAKER_ID_TO_TYPE else 'NA',
-                    'vcm_type': 'NA',
-                    'lex_type': 'NA',
-                    'mwu_type': 'NA',
-                    'addresseee': 'NA',
-                    'transcription': 'NA'
-                }
-
-                segments.append(segment)
-
-        return pd.DataFrame(segments)
+    @profiling.timed('annotations.validate')
+    def validate(self, annotations = None, executor = None, max_per_rule = None, cache = None):
+        """validate converted segment files, in parallel across files.
 
-    def load_eaf(self, filename):
-        path = os.path.join(self.project.path, 'raw_annotations', filename)
-        eaf = pympi.Elan.Eaf(path)
+        :param annotations: annotations to validate (all annotations by default),
+        e.g. the annotations returned by import_annotations
+        :param executor: Executor running the validation (processes by default)
+        :param max_per_rule: maximum amount of messages per rule and per file (unlimited by default)
+        :param cache: ValidationCache, to skip the files which did not change since they were found valid
+        """
+        if annotations is None:
+            annotations = self.annotations
 
-        segments = {}
-        
-        for tier_name in eaf.tiers:
-            annotations = eaf.tiers[tier_name][0]
+        if executor is None:
+            executor = Executor('process')
 
-            if tier_name not in self.SPEAKER_ID_TO_TYPE and len(annotations) > 0:
-                print("warning: unknown tier '{}' will be ignored in '{}'".format(tier_name, filename))
-                continue
+        if 'annotation_filename' not in annotations.columns:
+            return [], []
 
-            for aid in annotations:
-                (start_ts, end_ts, value, svg_ref) = annotations[aid]
-                (start_t, end_t) = (eaf.timeslots[start_ts], eaf.timeslots[end_ts])
-
-                segment = {
-                    'segment_onset': start_t/1000,
-                    'segment_offset': end_t/1000,
-                    'speaker_id': tier_name,
-                    'ling_type': 'NA',
-                    'speaker_type': self.SPEAKER_ID_TO_TYPE[tier_name] if tier_name in self.SPEAKER_ID_TO_TYPE else 'NA',
-                    'vcm_type': 'NA',
-                    'lex_type': 'NA',
-                    'mwu_type': 'NA',
-                    'addresseee': 'NA',
-                    'transcription': value if value != '0' else '0.'
-                }
-
-                segments[aid] = segment
-
-        for tier_name in eaf.tiers:
-            if '@' in tier_name:
-                label, ref = tier_name.split('@')
-            else:
-                label, ref = tier_name, None
-
-            reference_annotations = eaf.tiers[tier_name][1]
-
-            if ref not in self.SPEAKER_ID_TO_TYPE:
-                continue
+        annotations = annotations.dropna(subset = ['annotation_filename'])
+        tasks = list(zip(annotations.to_dict(orient = 'records'), self.recording_durations(annotations)))
+        results = executor.map(partial(validate_annotation, self.project.path, max_per_rule = max_per_rule, cache = cache), tasks)
 
-            for aid in reference_annotations:
-                (ann, value, prev, svg) = reference_annotations[aid]
+        errors = [error for res in results for error in res[0]]
+        warnings = [warning for res in results for warning in res[1]]
 
-                ann = aid
-                parentTier = eaf.tiers[eaf.annotations[ann]]
-                while 'PARENT_REF' in parentTier[2] and parentTier[2]['PARENT_REF'] and len(parentTier[2]) > 0:
-                    ann = parentTier[1][ann][0]
-                    parentTier = eaf.tiers[eaf.annotations[ann]]
-
-                if ann not in segments:
-                    print("warning: annotation '{}' not found in segments for '{}'".format(ann, filename))
-                    continue
-                
-                segment = segments[ann]
-
-                if label == 'lex':
-                    segment['lex_type'] = value
-                elif label == 'mwu':
-                    segment['mwu_type'] = value
-                elif label == 'xds':
-                    segment['addresseee'] = value
-                elif label == 'vcm':
-                    segment['vcm_type'] = value
-
-        return pd.DataFrame(segments.values())
+        integrity_errors, integrity_warnings = self.check_integrity(annotations)
+        return errors + integrity_errors, warnings + integrity_warnings
 
-    def load_vtc_rttm(self, filename, source_file = None):
-        path = os.path.join(self.project.path, 'raw_annotations', filename)
-        rttm = pd.read_csv(
-            path,
-            sep = " ",
-            names = ['type', 'file', 'chnl', 'tbeg', 'tdur', 'ortho', 'stype', 'name', 'conf', 'unk']
-        )
+    @profiling.timed('annotations.integrity')
+    def check_integrity(self, annotations = None):
+        """check that annotations refer to existing recordings, and that their
+        ranges fit within the duration of the recordings, when it is known
+        (see compute-durations). Checks are run over the whole index rather than
+        row by row; the segments are checked by validate_annotation.
+        """
+        if annotations is None:
+            annotations = self.annotations
+
+        errors, warnings = [], []
+        tables = self.project.tables()
+
+        for index, recording in self.INDEX_RECORDING.check(annotations, tables)['recording_filename'].items():
+            errors.append("recording_filename '{}' in annotations on line {} cannot be found in the recordings table.".format(recording, index))
+
+        for index, row in self.INDEX_RANGE.check(annotations, tables).iterrows():
+            errors.append("annotation on line {} covers [{:.3f}, {:.3f}] which exceeds the range of recording '{}' [0, {:.3f}]".format(
+                index, row['onset'], row['offset'], row['recording_filename'], row['upper']
+            ))
 
-        df = rttm
-        df['segment_onset'] = df['tbeg'].astype(float)
-        df['segment_offset'] = (df['tbeg']+df['tdur']).astype(float)
-        df['speaker_id'] = 'NA'
-        df['ling_type'] = 'NA'
-        df['speaker_type'] = df['name'].map(self.VTC_SPEAKER_TYPE_TRANSLATION)
-        df['vcm_type'] = 'NA'
-        df['lex_type'] = 'NA'
-        df['mwu_type'] = 'NA'
-        df['addresseee'] = 'NA'
-        df['transcription'] = 'NA'  
+        return errors, warnings
 
-        if source_file:
-            df = df[df['file'] == source_file]
+    def load_textgrid(self, filename):
+        return load_textgrid(self.project.path, filename)
 
-        df.drop(['type', 'file', 'chnl', 'tbeg', 'tdur', 'ortho', 'stype', 'name', 'conf', 'unk'], axis = 1, inplace = True)
+    def load_eaf(self, filename):
+        return load_eaf(self.project.path, filename)
 
-        return df
+    def load_vtc_rttm(self, filename, source_file = None):
+        return load_vtc_rttm(self.project.path, filename, source_file = source_file)
 
     def import_annotation(self, annotation):
-        source_recording = os.path.splitext(annotation['recording_filename'])[0]
-        output_filename = "{}/{}_{}_{}.csv".format(annotation['set'], source_recording, annotation['time_seek'], annotation['range_onset'])
-
-        raw_filename = annotation['raw_filename']
-        annotation_format = annotation['format']
-
-        df = None
-        try:
-            if annotation_format == 'TextGrid':
-                df = self.load_textgrid(raw_filename)
-            elif annotation_format == 'eaf':
-                df = self.load_eaf(raw_filename)
-            elif annotation_format == 'vtc_rttm':
-                filter = annotation['filter'] if 'filter' in annotation and not pd.isnull(annotation['filter']) else None
-                df = self.load_vtc_rttm(raw_filename, source_file = filter)
-            else:
-                raise ValueError("file format '{}' unknown for '{}'".format(annotation_format, raw_filename))
-        except:
-            annotation['error'] = traceback.format_exc()
-            print("an error occured while processing '{}'".format(raw_filename), file = sys.stderr)
-            print(traceback.format_exc(), file = sys.stderr)
-
-        if df is None or not isinstance(df, pd.DataFrame):
-            return annotation
-
-        if not df.shape[1]:
-            df = pd.DataFrame(columns = [c.name for c in self.SEGMENTS_COLUMNS])
-        
-        df['annotation_file'] = raw_filename
-        df['segment_onset'] = df['segment_onset'].astype(float)
-        df['segment_offset'] = df['segment_offset'].astype(float)
-
-        if isinstance(annotation['range_onset'], Number)\
-            and isinstance(annotation['range_offset'], Number)\
-            and (annotation['range_offset'] - annotation['range_onset']) > 0.001:
-
-            df = self.clip_segments(df, annotation['range_onset'], annotation['range_offset'])
-
-        df.sort_values(['segment_onset', 'segment_offset', 'speaker_id', 'speaker_type'], inplace = True)
-
-        os.makedirs(os.path.dirname(os.path.join(self.project.path, 'annotations', output_filename)), exist_ok = True)
-        df.to_csv(os.path.join(self.project.path, 'annotations', output_filename), index = False)
-
-        annotation['annotation_filename'] = output_filename
-        annotation['imported_at'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        return import_annotation(self.project.path, annotation)
 
-        return annotation
+    @profiling.timed('import')
+    def import_annotations(self, input, executor = None, prefetcher = None, shard = None):
+        """import annotations and add them to the index.
 
-    def import_annotations(self, input):
-        missing_recordings = input[~input['recording_filename'].isin(self.project.recordings['filename'].tolist())]
-        missing_recordings = missing_recordings['recording_filename'].tolist()
+        :param input: annotations to import, as a dataframe with the columns of the index
+        :param executor: Executor running the importation (processes by default)
+        :param prefetcher: Prefetcher retrieving annexed raw annotations while the previous ones are imported
+        :param shard: Shard, to only import a share of the annotations. Each shard adds
+        the annotations it imported to the index
+        """
+        missing_recordings = self.INDEX_RECORDING.check(input, self.project.tables())['recording_filename'].tolist()
 
         if len(missing_recordings) > 0:
             raise ValueError("cannot import annotations. the following recordings are incorrect:\n{}".format("\n".join(missing_recordings)))
 
-        pool = mp.Pool(processes = mp.cpu_count())
-        imported = pool.map(
-            self.import_annotation,
-            input.to_dict(orient = 'records')
-        )
+        if executor is None:
+            executor = Executor('process')
+
+        task = partial(import_annotation, self.project.path)
+        annotations = input.to_dict(orient = 'records')
+
+        if shard is not None:
+            # annotations are identified by their output file
+            key = operator.itemgetter('set', 'recording_filename', 'time_seek', 'range_onset')
+            annotations = shard.tasks(annotations, key = key)
+            task = partial(shard.run, key, task)
+
+        if prefetcher is None:
+            imported = executor.map(task, annotations)
+        else:
+            imported = prefetcher.map(executor, task, annotations,
+                inputs = lambda annotation: [os.path.join(self.project.path, 'raw_annotations', annotation['raw_filename'])],
+                succeeded = lambda annotation: 'annotation_filename' in annotation
+            )
 
-        imported = pd.DataFrame(imported)
+        # annotations claimed by other shards are None
+        imported = pd.DataFrame([annotation for annotation in imported if annotation is not None])
         imported.drop(list(set(imported.columns)-set([c.name for c in self.INDEX_COLUMNS])), axis = 1, inplace = True)
 
-        self.read()
-        self.annotations = pd.concat([self.annotations, imported], sort = False)
-        self.annotations.to_csv(os.path.join(self.project.path, 'metadata/annotations.csv'), index = False)
+        if 'annotation_filename' in imported.columns:
+            self.segments_cache.invalidate(keys = imported['annotation_filename'].dropna().tolist())
+
+        # the index is re-read under the lock so that rows written
+        # by concurrent importers in the meantime are preserved
+        with profiling.span('import.write_index'), lock_file(self.lock_path):
+            self.read()
+            self.annotations = pd.concat([self.annotations, imported], sort = False)
+            write_dataframe(self.annotations, self.index_path, index = False)
+
+        return imported
 
     def remove_set(self, annotation_set):
-        self.read()
+        with lock_file(self.lock_path):
+            self.read()
 
-        try:
-            shutil.rmtree(os.path.join(self.project.path, 'annotations', annotation_set))
-        except:
-            pass
+            try:
+                shutil.rmtree(os.path.join(self.project.path, 'annotations', annotation_set))
+            except:
+                pass
 
-        self.annotations = self.annotations[self.annotations['set'] != annotation_set]
-        self.annotations.to_csv(os.path.join(self.project.path, 'metadata/annotations.csv'), index = False)
+            self.segments_cache.invalidate(prefix = annotation_set + '/')
 
-    def get_segments(self, annotations):
-        annotations = annotations.dropna(subset = ['annotation_filename'])
+            self.annotations = self.annotations[self.annotations['set'] != annotation_set]
+            write_dataframe(self.annotations, self.index_path, index = False)
+
+    @profiling.timed('segments.file')
+    def load_segments(self, filename, columns = None, speaker_types = None, onset = None, offset = None):
+        filters = []
+        if speaker_types is not None:
+            filters.append('speaker_type')
+        if onset is not None or offset is not None:
+            filters += ['segment_onset', 'segment_offset']
+
+        usecols = None
+        if columns is not None:
+            usecols = tuple(sorted(set(columns) | set(filters)))
+
+        read = partial(pd.read_csv, usecols = None if usecols is None else (lambda c, usecols = usecols: c in usecols))
+
+        path = os.path.join(self.project.path, 'annotations', filename)
+        if self.segments_cache.max_size > 0:
+            # files are cached per set of columns read
+            cached = segments = self.segments_cache.get((filename, usecols), path, read)
+        else:
+            cached = None
+            segments = read(path)
+
+        if speaker_types is not None:
+            segments = segments[segments['speaker_type'].isin(speaker_types)]
+        if onset is not None:
+            segments = segments[segments['segment_offset'] > onset]
+        if offset is not None:
+            segments = segments[segments['segment_onset'] < offset]
 
-        segments = pd.concat([
-            pd.read_csv(os.path.join(self.project.path, 'annotations', f)).assign(annotation_filename = f)
-            for f in annotations['annotation_filename'].tolist()
-        ])
+        if columns is not None:
+            segments = segments[[c for c in segments.columns if c in columns]]
 
-        return segments.merge(annotations, how = 'left', left_on = 'annotation_filename', right_on = 'annotation_filename')
+        if segments is cached:
+            segments = segments.copy()
+
+        profiling.count('segments.rows', segments.shape[0])
+
+        return segments
+
+    @profiling.timed('segments')
+    def get_segments(self, annotations, columns = None, speaker_types = None, onset = None, offset = None,
+                     index_columns = None, executor = None):
+        """read the segments of the given annotations.
+
+        :param columns: segment columns to read (all by default)
+        :param speaker_types: keep only segments with one of these speaker types
+        :param onset: keep only segments ending after onset (seconds, relative to time_seek)
+        :param offset: keep only segments starting before offset (seconds, relative to time_seek)
+        :param index_columns: annotations columns to attach to each segment (all by default).
+        When given, each segment is also given the 'annotation_filename' of its annotation,
+        as a categorical whose codes are the positions of the annotations.
+        :param executor: Executor reading the files (threads by default)
+        """
+        annotations = annotations.dropna(subset = ['annotation_filename']).reset_index(drop = True)
+
+        # the compact categorical key is only used when the columns are chosen
+        compact = index_columns is not None
+        if compact:
+            index_columns = [c for c in index_columns if c != 'annotation_filename']
+        else:
+            index_columns = annotations.columns.tolist()
+
+        filenames = annotations['annotation_filename'].tolist()
+
+        if executor is None:
+            executor = Executor('thread')
+
+        segments = executor.map(
+            partial(self.load_segments, columns = columns, speaker_types = speaker_types, onset = onset, offset = offset),
+            filenames
+        )
+
+        if not segments:
+            return pd.DataFrame(columns = (columns or [c.name for c in self.SEGMENTS_COLUMNS]) + (['annotation_filename'] if compact else []) + index_columns)
+
+        # index metadata is attached by position rather than through a merge
+        # on annotation_filename
+        rows = np.repeat(np.arange(len(segments)), [len(df) for df in segments])
+        segments = pd.concat(segments, ignore_index = True, sort = False)
+
+        if compact:
+            codes, uniques = pd.factorize(annotations['annotation_filename'])
+            segments['annotation_filename'] = pd.Categorical.from_codes(codes[rows], uniques)
+
+        for column in index_columns:
+            segments[column] = annotations[column].values[rows]
+
+        return segments
 
     def intersection(self, left, right):
         recordings = set(left['recording_filename'].unique()) & set(right['recording_filename'].unique())
@@ -376,14 +380,13 @@ class AnnotationManager:
             a_ranges = a[['abs_range_onset', 'abs_range_offset']].sort_values(['abs_range_onset', 'abs_range_offset']).values.tolist()
             b_ranges = b[['abs_range_onset', 'abs_range_offset']].sort_values(['abs_range_onset', 'abs_range_offset']).values.tolist()
 
-            print(a_ranges, b_ranges)
-
             segments = list(intersect_ranges(
                 (Segment(onset, offset) for (onset, offset) in a_ranges),
                 (Segment(onset, offset) for (onset, offset) in b_ranges)
             ))
 
-            print(segments)
+            if not segments:
+                continue
 
             a_out = []
             b_out = []
@@ -412,14 +415,13 @@ class AnnotationManager:
             a_stack.append(a_out)
             b_stack.append(b_out)
 
+        if not a_stack:
+            return left.iloc[0:0], right.iloc[0:0]
+
         return pd.concat(a_stack), pd.concat(b_stack)
 
     def clip_segments(self, segments, start, stop):
-        segments['segment_onset'].clip(lower = start, upper = stop, inplace = True)
-        segments['segment_offset'].clip(lower = start, upper = stop, inplace = True)
-
-        segments = segments[~np.isclose(segments['segment_offset']-segments['segment_onset'], 0)]
-        return segments
+        return clip_segments(segments, start, stop)
 
     def get_vc_stats(self, segments, turntakingthresh = 1):
         segments = segments.sort_values(['segment_onset', 'segment_offset'])
@@ -453,4 +455,255 @@ class AnnotationManager:
             voc_count = ('duration', 'count'),
             turns = ('turn', 'sum'),
             cds_dur = ('cds', 'sum')
-        )
\ No newline at end of file
+        )
+
+@profiling.timed('annotations.validate.file')
+def validate_annotation(project_path, task, max_per_rule = None, cache = None):
+    """validate the segments of an annotation, where task is the annotation
+    along with the duration of its recording (None if it is unknown).
+    Workers only receive the path of the project and the task, rather
+    than the whole AnnotationManager."""
+    annotation, duration = task
+    path = os.path.join(project_path, 'annotations', annotation['annotation_filename'])
+    segments = IndexTable('segments', path = path, columns = AnnotationManager.SEGMENTS_COLUMNS)
+
+    # segments are checked against the duration of the recordings if it is known
+    recordings = None
+    if duration is not None:
+        recordings = pd.DataFrame({'filename': [annotation['recording_filename']], 'duration': [duration]})
+
+    try:
+        if cache is not None and cache.is_valid(segments):
+            # warnings are replayed from the cache
+            warnings = ["{}: {}".format(annotation['annotation_filename'], warning) for warning in cache.warnings(segments)]
+            if recordings is None:
+                return [], warnings
+
+            return check_segments(annotation, pd.read_csv(path, usecols = ['segment_onset', 'segment_offset']), recordings), warnings
+
+        segments.read()
+    except Exception as e:
+        return ["{}: {}".format(annotation['annotation_filename'], str(e))], []
+
+    errors, warnings = segments.validate(Diagnostics(max_per_rule = max_per_rule), cache = cache)
+    errors = ["{}: {}".format(annotation['annotation_filename'], error) for error in errors]
+    warnings = ["{}: {}".format(annotation['annotation_filename'], warning) for warning in warnings]
+
+    if recordings is not None:
+        errors += check_segments(annotation, segments.df, recordings)
+
+    return errors, warnings
+
+def check_segments(annotation, segments, recordings):
+    """errors for the segments of an annotation which exceed the range of its recording"""
+    segments = segments.assign(recording_filename = annotation['recording_filename'], time_seek = annotation['time_seek'])
+    violations = AnnotationManager.SEGMENTS_RANGE.check(segments, {'recordings': recordings})
+
+    if not len(violations):
+        return []
+
+    return ["{}: {} segment(s) exceed the range of recording '{}' [0, {:.3f}], e.g. [{:.3f}, {:.3f}]".format(
+        annotation['annotation_filename'], len(violations), annotation['recording_filename'], violations['upper'].iloc[0],
+        violations['onset'].iloc[0], violations['offset'].iloc[0]
+    )]
+
+@profiling.timed('import.parse')
+def load_textgrid(project_path, filename):
+    path = os.path.join(project_path, 'raw_annotations', filename)
+    textgrid = pympi.Praat.TextGrid(path)
+
+    def ling_type(s):
+        s = str(s)
+
+        a, b = ('0' in s, '1' in s)
+        if a^b:
+            return '0' if a else '1' 
+        else:
+            return 'NA'
+
+    segments = []
+    for tier in textgrid.tiers:
+        for interval in tier.intervals:
+            tier_name = tier.name.strip()
+
+            if tier_name == 'Autre':
+                continue
+
+            if interval[2] == "":
+                continue
+
+            segment = {
+                'segment_onset': float(interval[0]),
+                'segment_offset': float(interval[1]),
+                'speaker_id': tier_name,
+                'ling_type': ling_type(interval[2]),
+                'speaker_type': AnnotationManager.SPEAKER_ID_TO_TYPE[tier_name] if tier_name in AnnotationManager.SPEAKER_ID_TO_TYPE else 'NA',
+                'vcm_type': 'NA',
+                'lex_type': 'NA',
+                'mwu_type': 'NA',
+                'addresseee': 'NA',
+                'transcription': 'NA'
+            }
+
+            segments.append(segment)
+
+    return pd.DataFrame(segments)
+
+@profiling.timed('import.parse')
+def load_eaf(project_path, filename):
+    path = os.path.join(project_path, 'raw_annotations', filename)
+    eaf = pympi.Elan.Eaf(path)
+
+    segments = {}
+    
+    for tier_name in eaf.tiers:
+        annotations = eaf.tiers[tier_name][0]
+
+        if tier_name not in AnnotationManager.SPEAKER_ID_TO_TYPE and len(annotations) > 0:
+            print("warning: unknown tier '{}' will be ignored in '{}'".format(tier_name, filename))
+            continue
+
+        for aid in annotations:
+            (start_ts, end_ts, value, svg_ref) = annotations[aid]
+            (start_t, end_t) = (eaf.timeslots[start_ts], eaf.timeslots[end_ts])
+
+            segment = {
+                'segment_onset': start_t/1000,
+                'segment_offset': end_t/1000,
+                'speaker_id': tier_name,
+                'ling_type': 'NA',
+                'speaker_type': AnnotationManager.SPEAKER_ID_TO_TYPE[tier_name] if tier_name in AnnotationManager.SPEAKER_ID_TO_TYPE else 'NA',
+                'vcm_type': 'NA',
+                'lex_type': 'NA',
+                'mwu_type': 'NA',
+                'addresseee': 'NA',
+                'transcription': value if value != '0' else '0.'
+            }
+
+            segments[aid] = segment
+
+    for tier_name in eaf.tiers:
+        if '@' in tier_name:
+            label, ref = tier_name.split('@')
+        else:
+            label, ref = tier_name, None
+
+        reference_annotations = eaf.tiers[tier_name][1]
+
+        if ref not in AnnotationManager.SPEAKER_ID_TO_TYPE:
+            continue
+
+        for aid in reference_annotations:
+            (ann, value, prev, svg) = reference_annotations[aid]
+
+            ann = aid
+            parentTier = eaf.tiers[eaf.annotations[ann]]
+            while 'PARENT_REF' in parentTier[2] and parentTier[2]['PARENT_REF'] and len(parentTier[2]) > 0:
+                ann = parentTier[1][ann][0]
+                parentTier = eaf.tiers[eaf.annotations[ann]]
+
+            if ann not in segments:
+                print("warning: annotation '{}' not found in segments for '{}'".format(ann, filename))
+                continue
+            
+            segment = segments[ann]
+
+            if label == 'lex':
+                segment['lex_type'] = value
+            elif label == 'mwu':
+                segment['mwu_type'] = value
+            elif label == 'xds':
+                segment['addresseee'] = value
+            elif label == 'vcm':
+                segment['vcm_type'] = value
+
+    return pd.DataFrame(segments.values())
+
+@profiling.timed('import.parse')
+def load_vtc_rttm(project_path, filename, source_file = None):
+    path = os.path.join(project_path, 'raw_annotations', filename)
+    rttm = pd.read_csv(
+        path,
+        sep = " ",
+        names = ['type', 'file', 'chnl', 'tbeg', 'tdur', 'ortho', 'stype', 'name', 'conf', 'unk']
+    )
+
+    df = rttm
+    df['segment_onset'] = df['tbeg'].astype(float)
+    df['segment_offset'] = (df['tbeg']+df['tdur']).astype(float)
+    df['speaker_id'] = 'NA'
+    df['ling_type'] = 'NA'
+    df['speaker_type'] = df['name'].map(AnnotationManager.VTC_SPEAKER_TYPE_TRANSLATION)
+    df['vcm_type'] = 'NA'
+    df['lex_type'] = 'NA'
+    df['mwu_type'] = 'NA'
+    df['addresseee'] = 'NA'
+    df['transcription'] = 'NA'  
+
+    if source_file:
+        df = df[df['file'] == source_file]
+
+    df.drop(['type', 'file', 'chnl', 'tbeg', 'tdur', 'ortho', 'stype', 'name', 'conf', 'unk'], axis = 1, inplace = True)
+
+    return df
+
+@profiling.timed('import.file')
+def import_annotation(project_path, annotation):
+    source_recording = os.path.splitext(annotation['recording_filename'])[0]
+    output_filename = "{}/{}_{}_{}.csv".format(annotation['set'], source_recording, annotation['time_seek'], annotation['range_onset'])
+
+    raw_filename = annotation['raw_filename']
+    annotation_format = annotation['format']
+
+    df = None
+    try:
+        if annotation_format == 'TextGrid':
+            df = load_textgrid(project_path, raw_filename)
+        elif annotation_format == 'eaf':
+            df = load_eaf(project_path, raw_filename)
+        elif annotation_format == 'vtc_rttm':
+            filter = annotation['filter'] if 'filter' in annotation and not pd.isnull(annotation['filter']) else None
+            df = load_vtc_rttm(project_path, raw_filename, source_file = filter)
+        else:
+            raise ValueError("file format '{}' unknown for '{}'".format(annotation_format, raw_filename))
+    except:
+        annotation['error'] = traceback.format_exc()
+        print("an error occured while processing '{}'".format(raw_filename), file = sys.stderr)
+        print(traceback.format_exc(), file = sys.stderr)
+
+    if df is None or not isinstance(df, pd.DataFrame):
+        return annotation
+
+    if not df.shape[1]:
+        df = pd.DataFrame(columns = [c.name for c in AnnotationManager.SEGMENTS_COLUMNS])
+    
+    df['annotation_file'] = raw_filename
+    df['segment_onset'] = df['segment_onset'].astype(float)
+    df['segment_offset'] = df['segment_offset'].astype(float)
+
+    if isinstance(annotation['range_onset'], Number)\
+        and isinstance(annotation['range_offset'], Number)\
+        and (annotation['range_offset'] - annotation['range_onset']) > 0.001:
+
+        df = clip_segments(df, annotation['range_onset'], annotation['range_offset'])
+
+    df.sort_values(['segment_onset', 'segment_offset', 'speaker_id', 'speaker_type'], inplace = True)
+
+    with profiling.span('import.write'):
+        os.makedirs(os.path.dirname(os.path.join(project_path, 'annotations', output_filename)), exist_ok = True)
+        df.to_csv(os.path.join(project_path, 'annotations', output_filename), index = False)
+
+    profiling.count('import.files')
+    profiling.count('import.segments', df.shape[0])
+
+    annotation['annotation_filename'] = output_filename
+    annotation['imported_at'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    return annotation
+
+def clip_segments(segments, start, stop):
+    segments['segment_onset'].clip(lower = start, upper = stop, inplace = True)
+    segments['segment_offset'].clip(lower = start, upper = stop, inplace = True)
+
+    segments = segments[~np.isclose(segments['segment_offset']-segments['segment_onset'], 0)]
+    return segments
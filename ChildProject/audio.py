@@ -0,0 +1,461 @@
+from functools import partial
+from math import gcd
+import numpy as np
+import os
+import pandas as pd
+import struct
+
+from . import profiling
+from .parallel import Executor
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+def wav_dtype(format_tag, bits):
+    if format_tag == WAVE_FORMAT_PCM and bits in [8, 16, 32]:
+        return np.dtype({8: 'u1', 16: '<i2', 32: '<i4'}[bits])
+    elif format_tag == WAVE_FORMAT_IEEE_FLOAT and bits in [32, 64]:
+        return np.dtype({32: '<f4', 64: '<f8'}[bits])
+
+    raise ValueError("unsupported WAV encoding (format {}, {} bits)".format(format_tag, bits))
+
+class WavFile:
+    """memory-mapped WAV file (8/16/32 bits PCM or 32/64 bits float).
+
+    samples are exposed as an array of shape (frames, channels) which is
+    backed by the file itself: slicing it reads only the requested range,
+    without any decoding.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, 'rb') as f:
+            riff, size, wave = struct.unpack('<4sI4s', f.read(12))
+            if riff != b'RIFF' or wave != b'WAVE':
+                raise ValueError("'{}' is not a WAV file".format(path))
+
+            fmt = None
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    raise ValueError("'{}' has no data chunk".format(path))
+
+                chunk, chunk_size = struct.unpack('<4sI', header)
+                if chunk == b'data':
+                    data_offset = f.tell()
+                    break
+                elif chunk == b'fmt ':
+                    fmt = f.read(chunk_size)
+                    f.seek(chunk_size & 1, 1)
+                else:
+                    f.seek(chunk_size + (chunk_size & 1), 1)
+
+        if fmt is None:
+            raise ValueError("'{}' has no fmt chunk".format(path))
+
+        format_tag, self.channels, self.sample_rate, byte_rate, block_align, bits = struct.unpack('<HHIIHH', fmt[:16])
+        if format_tag == WAVE_FORMAT_EXTENSIBLE:
+            format_tag = struct.unpack('<H', fmt[24:26])[0]
+
+        self.dtype = wav_dtype(format_tag, bits)
+
+        # the size in the header cannot be trusted for files written to a pipe
+        data_size = min(chunk_size, os.path.getsize(path) - data_offset)
+        self.frames = data_size // block_align
+
+        if self.frames > 0:
+            self.samples = np.memmap(path, dtype = self.dtype, mode = 'r', offset = data_offset, shape = (self.frames, self.channels))
+        else:
+            self.samples = np.zeros((0, self.channels), dtype = self.dtype)
+
+    @property
+    def duration(self):
+        return self.frames/self.sample_rate
+
+    def read(self, onset, offset):
+        """samples between onset and offset (in seconds)"""
+        a = min(max(int(round(onset*self.sample_rate)), 0), self.frames)
+        b = min(max(int(round(offset*self.sample_rate)), a), self.frames)
+        return self.samples[a:b]
+
+def to_float(samples):
+    """convert samples to float64 values within [-1, 1]"""
+    if samples.dtype.kind == 'f':
+        return samples.astype(np.float64)
+    elif samples.dtype.kind == 'u':
+        half = 2**(samples.dtype.itemsize*8 - 1)
+        return (samples.astype(np.float64) - half)/half
+
+    return samples.astype(np.float64)/2**(samples.dtype.itemsize*8 - 1)
+
+def from_float(samples, dtype):
+    """convert float samples within [-1, 1] to dtype"""
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'f':
+        return samples.astype(dtype)
+
+    half = 2**(dtype.itemsize*8 - 1)
+    samples = np.clip(np.round(samples*half), -half, half - 1)
+    return (samples + half if dtype.kind == 'u' else samples).astype(dtype)
+
+class WavWriter:
+    """WAV file written block by block; the header is completed on close"""
+
+    def __init__(self, destination, sample_rate, channels, dtype):
+        self.destination = destination
+        self.sample_rate = int(sample_rate)
+        self.channels = int(channels)
+        self.dtype = np.dtype(dtype).newbyteorder('<') if np.dtype(dtype).itemsize > 1 else np.dtype(dtype)
+        self.format_tag = WAVE_FORMAT_IEEE_FLOAT if self.dtype.kind == 'f' else WAVE_FORMAT_PCM
+        wav_dtype(self.format_tag, self.dtype.itemsize*8)
+
+        self.size = 0
+        self.file = open(destination, 'wb')
+        self.write_header()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def write_header(self):
+        block_align = self.channels*self.dtype.itemsize
+        self.file.write(struct.pack('<4sI4s', b'RIFF', 36 + self.size + (self.size & 1), b'WAVE'))
+        self.file.write(struct.pack('<4sIHHIIHH', b'fmt ', 16, self.format_tag, self.channels, self.sample_rate, self.sample_rate*block_align, block_align, self.dtype.itemsize*8))
+        self.file.write(struct.pack('<4sI', b'data', self.size))
+
+    def write(self, samples):
+        """append samples of shape (frames, channels) or (frames,)"""
+        samples = np.asarray(samples)
+        if samples.ndim == 1:
+            samples = samples[:, None]
+
+        data = np.ascontiguousarray(samples, dtype = self.dtype).tobytes()
+        self.file.write(data)
+        self.size += len(data)
+
+    def close(self):
+        if self.file is None:
+            return
+
+        if self.size & 1:
+            self.file.write(b'\0')
+
+        self.file.seek(0)
+        self.write_header()
+        self.file.close()
+        self.file = None
+
+def write_wav(destination, samples, sample_rate):
+    """write samples of shape (frames, channels) or (frames,) into a WAV file"""
+    samples = np.asarray(samples)
+    if samples.ndim == 1:
+        samples = samples[:, None]
+
+    with WavWriter(destination, sample_rate, samples.shape[1], samples.dtype) as writer:
+        writer.write(samples)
+
+def sliding_windows(x, width):
+    """read-only view of the windows of `width` consecutive samples of x,
+    of shape (len(x) - width + 1, width)"""
+    x = np.ascontiguousarray(x)
+    if len(x) < width:
+        return np.zeros((0, width), dtype = x.dtype)
+
+    return np.lib.stride_tricks.as_strided(
+        x, shape = (len(x) - width + 1, width), strides = (x.strides[0], x.strides[0]), writeable = False
+    )
+
+class PolyphaseResampler:
+    """resample signals by a rational factor with a polyphase windowed-sinc filter.
+
+    Output samples are computed block by block from the input samples they
+    depend on, so that any range of the output can be computed independently
+    from a memory-mapped input.
+
+    :param input_rate: sampling rate of the input
+    :param output_rate: sampling rate of the output
+    :param zero_crossings: half-length of the filter in zero crossings of the sinc
+    :param beta: parameter of the Kaiser window
+    """
+
+    def __init__(self, input_rate, output_rate, zero_crossings = 16, beta = 8.6):
+        g = gcd(int(input_rate), int(output_rate))
+        self.up = int(output_rate)//g
+        self.down = int(input_rate)//g
+
+        # low-pass filter at the lowest of both nyquist frequencies, at the upsampled rate
+        factor = max(self.up, self.down)
+        self.half = zero_crossings*factor
+        k = np.arange(-self.half, self.half + 1)
+        h = np.sinc(k/factor)/factor*np.kaiser(2*self.half + 1, beta)*self.up
+
+        # h is split into its `up` phases, each reversed to be applied as a dot product
+        self.taps = -(-len(h)//self.up)
+        h = np.concatenate([h, np.zeros(self.taps*self.up - len(h))])
+        self.phases = h.reshape(self.taps, self.up).T[:, ::-1].copy()
+
+    def output_frames(self, input_frames):
+        return -(-int(input_frames)*self.up//self.down)
+
+    def process(self, read, a, b):
+        """output samples a to b (excluded), where read(i, j) returns
+        the input samples i to j (as a float array, padded with zeros)"""
+        if self.up == self.down:
+            return read(a, b)
+
+        # output m is centered on the upsampled sample m*down, and depends on
+        # the input samples n-taps+1 to n, where n = (m*down + half)//up
+        m = np.arange(a, b)
+        t = m*self.down + self.half
+        n = t//self.up
+        lo = int(n[0]) - self.taps + 1 if len(m) else 0
+        x = read(lo, int(n[-1]) + 1 if len(m) else 0)
+        windows = sliding_windows(x, self.taps)
+
+        # outputs distant of `up` samples share the same phase
+        y = np.empty(len(m))
+        for r in range(min(self.up, len(m))):
+            start = int(n[r]) - self.taps + 1 - lo
+            count = len(range(r, len(m), self.up))
+            y[r::self.up] = windows[start:start + count*self.down:self.down] @ self.phases[t[r] % self.up]
+
+        return y
+
+CODECS = {
+    'pcm_u8': 'u1',
+    'pcm_s16le': '<i2',
+    'pcm_s32le': '<i4',
+    'pcm_f32le': '<f4',
+    'pcm_f64le': '<f8'
+}
+
+def split_seconds(split):
+    hours, minutes, seconds = [int(x) for x in split.split(':')]
+    return hours*3600 + minutes*60 + seconds
+
+@profiling.timed('convert.native')
+def convert_wav(source, destination, sampling, codec = 'pcm_s16le', split = None, block = 1000000):
+    """downmix and resample a WAV file into a mono WAV file without ffmpeg.
+
+    :param destination: output file, or pattern of the output files if split
+    (e.g. 'sound.%03d.wav')
+    :param sampling: output sampling rate
+    :param codec: output encoding, any of CODECS
+    :param split: duration of the pieces (HH:MM:SS)
+    :param block: amount of output samples computed at once
+    :return: list of (filename, onset, offset) tuples, with times in seconds
+    """
+    if codec not in CODECS:
+        raise ValueError("codec '{}' is not supported by the native engine, should be any of [{}]".format(codec, ",".join(CODECS)))
+
+    wav = WavFile(source)
+    resampler = PolyphaseResampler(wav.sample_rate, sampling)
+
+    def read(a, b):
+        x = np.zeros(b - a)
+        i, j = min(max(a, 0), wav.frames), min(max(b, 0), wav.frames)
+        if j > i:
+            x[i - a:j - a] = to_float(wav.samples[i:j]).mean(axis = 1)
+        return x
+
+    total = resampler.output_frames(wav.frames)
+    piece = split_seconds(split)*int(sampling) if split else total
+    pieces = []
+
+    for index, start in enumerate(range(0, max(total, 1), max(piece, 1))):
+        stop = min(start + piece, total)
+        filename = destination % index if split else destination
+
+        with WavWriter(filename, sampling, 1, CODECS[codec]) as writer:
+            for a in range(start, stop, block):
+                writer.write(from_float(resampler.process(read, a, min(a + block, stop)), CODECS[codec]))
+
+        pieces.append((filename, start/sampling, stop/sampling))
+
+    profiling.count('convert.native.samples', total)
+    return pieces
+
+class ConvertedRecording:
+    """a recording converted with a given profile, possibly split
+    into several pieces, seen as a single stream of samples
+
+    :param files: converted files, in chronological order
+    :param onsets: onset of each piece in seconds since the beginning of the
+    original recording, as recorded at conversion; if None, pieces are
+    assumed to follow each other
+    """
+
+    def __init__(self, files, onsets = None):
+        self.files = list(files)
+        self.pieces = [WavFile(f) for f in self.files]
+        if not self.pieces:
+            raise ValueError('no converted file')
+
+        if len(set((p.sample_rate, p.channels, p.dtype) for p in self.pieces)) > 1:
+            raise ValueError('pieces of a split recording should share the same encoding')
+
+        self.sample_rate = self.pieces[0].sample_rate
+        self.channels = self.pieces[0].channels
+        self.dtype = self.pieces[0].dtype
+
+        # first sample of each piece within the whole recording
+        if onsets is None:
+            self.starts = np.cumsum([0] + [p.frames for p in self.pieces])
+        else:
+            starts = np.round(np.asarray(onsets, dtype = float)*self.sample_rate).astype(np.int64)
+            self.starts = np.append(starts, starts[-1] + self.pieces[-1].frames)
+
+    @property
+    def duration(self):
+        return self.starts[-1]/self.sample_rate
+
+    def read(self, onset, offset):
+        """samples between onset and offset (in seconds since the beginning of
+        the original recording), spanning several pieces if needed"""
+        return self.read_samples(int(round(onset*self.sample_rate)), int(round(offset*self.sample_rate)))
+
+    def read_samples(self, a, b):
+        """samples a to b (excluded) of the whole recording"""
+        a = min(max(a, 0), self.starts[-1])
+        b = min(max(b, a), self.starts[-1])
+
+        first = max(np.searchsorted(self.starts, a, side = 'right') - 1, 0)
+        last = max(np.searchsorted(self.starts, b, side = 'left') - 1, first)
+
+        # samples of a piece past the start of the next one are ignored
+        chunks = [
+            self.pieces[i].samples[max(a - self.starts[i], 0):min(b, self.starts[i+1]) - self.starts[i]]
+            for i in range(first, min(last + 1, len(self.pieces)))
+        ]
+
+        if not chunks:
+            return np.zeros((0, self.channels), dtype = self.dtype)
+
+        return chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+
+    def locate(self, t):
+        """piece containing the time t (in seconds since the beginning of the
+        original recording), as its file and the time t within this file"""
+        i = min(max(np.searchsorted(self.starts, t*self.sample_rate, side = 'right') - 1, 0), len(self.pieces) - 1)
+        return self.files[i], t - self.starts[i]/self.sample_rate
+
+class ConvertedRecordings:
+    """recordings converted with a profile (see ChildProject.convert_recordings)
+
+    :param project: ChildProject instance
+    :param profile: name of the profile
+    """
+
+    def __init__(self, project, profile):
+        self.path = os.path.join(project.path, 'converted_recordings', profile)
+
+        table = pd.read_csv(os.path.join(self.path, 'recordings.csv'))
+        table = table[table['success'].astype(str).str.lower() == 'true']
+
+        # pieces are sorted by onset if known (see convert_recordings), or else
+        # by name, since split pieces are numbered with a zero-padded index
+        if 'onset' not in table.columns:
+            table = table.assign(onset = np.nan)
+
+        self.files = {}
+        self.onsets = {}
+        for original, converted in table.groupby('original_filename'):
+            onsets = pd.to_numeric(converted['onset'], errors = 'coerce')
+            if onsets.notnull().all():
+                converted = converted.assign(onset = onsets).sort_values('onset')
+                self.onsets[original] = converted['onset'].tolist()
+            else:
+                converted = converted.sort_values('converted_filename')
+                self.onsets[original] = None
+
+            self.files[original] = converted['converted_filename'].astype(str).tolist()
+
+    def open(self, recording_filename):
+        if recording_filename not in self.files:
+            raise ValueError("no converted file for recording '{}'".format(recording_filename))
+
+        return ConvertedRecording(
+            [os.path.join(self.path, f) for f in self.files[recording_filename]],
+            self.onsets[recording_filename]
+        )
+
+def clip_filename(recording_filename, onset, offset):
+    return "{}_{}_{}.wav".format(
+        os.path.splitext(recording_filename)[0].replace('/', '_'),
+        int(round(onset*1000)),
+        int(round(offset*1000))
+    )
+
+@profiling.timed('clips.recording')
+def extract_recording_clips(recordings, destination, clips):
+    clips = clips.copy()
+    clips['success'] = False
+    clips['error'] = ''
+
+    try:
+        recording = recordings.open(clips['recording_filename'].iloc[0])
+    except Exception as e:
+        clips['error'] = str(e)
+        return clips
+
+    success, errors = [], []
+    for clip in clips.to_dict(orient = 'records'):
+        if not clip['onset'] < clip['offset']:
+            error = "onset should be lower than offset"
+        elif clip['onset'] >= recording.duration:
+            error = "clip starts after the end of the recording ({:.3f} s)".format(recording.duration)
+        else:
+            error = ''
+            write_wav(os.path.join(destination, clip['clip_filename']), recording.read(clip['onset'], clip['offset']), recording.sample_rate)
+            profiling.count('clips.files')
+
+        success.append(not error)
+        errors.append(error)
+
+    clips['success'] = success
+    clips['error'] = errors
+    return clips
+
+@profiling.timed('clips')
+def extract_clips(project, profile, clips, destination, executor = None):
+    """extract clips from the recordings converted with a given profile,
+    by slicing the memory-mapped WAV files. Each converted recording is opened
+    once, and clips of different recordings are extracted in parallel.
+
+    :param project: ChildProject instance
+    :param profile: name of the profile (subfolder of converted_recordings)
+    :param clips: dataframe with 'recording_filename', 'onset' and 'offset' (in seconds) columns,
+    and optionally 'clip_filename'
+    :param destination: output directory
+    :return: clips, with 'clip_filename', 'success' and 'error' columns
+    """
+    if executor is None:
+        executor = Executor('thread')
+
+    recordings = ConvertedRecordings(project, profile)
+    os.makedirs(destination, exist_ok = True)
+
+    clips = clips.copy()
+    clips['onset'] = clips['onset'].astype(float)
+    clips['offset'] = clips['offset'].astype(float)
+
+    if 'clip_filename' not in clips.columns:
+        clips['clip_filename'] = [
+            clip_filename(r, a, b)
+            for r, a, b in zip(clips['recording_filename'], clips['onset'], clips['offset'])
+        ]
+
+    if clips.empty:
+        return clips.assign(success = pd.Series(dtype = bool), error = pd.Series(dtype = str))
+
+    results = executor.map(
+        partial(extract_recording_clips, recordings, destination),
+        [group for recording, group in clips.groupby('recording_filename', sort = False)]
+    )
+
+    return pd.concat(results).loc[clips.index]
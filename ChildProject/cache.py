@@ -0,0 +1,479 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import hashlib
+import json
+import numpy as np
+import os
+import pandas as pd
+import tempfile
+import threading
+import zipfile
+
+from . import profiling
+from .duplicates import file_md5, partial_md5
+from .utils import lock_file
+
+class SegmentsCache:
+    """thread-safe LRU cache of parsed segment files.
+
+    Entries are keyed on the annotation filename (or on a tuple starting
+    with it, e.g. along with the columns read) and checked against the
+    file's modification time, so that files rewritten on disk are reloaded.
+    Least recently used entries are evicted once the memory used by the
+    cached dataframes exceeds max_size (in bytes).
+    """
+
+    def __init__(self, max_size = 256*1024*1024):
+        self.max_size = int(max_size)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        # cached data is not shipped to worker processes
+        state = self.__dict__.copy()
+        state['entries'] = OrderedDict()
+        state['size'] = 0
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def get(self, key, path, load):
+        mtime = os.stat(path).st_mtime_ns
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == mtime:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            self.misses += 1
+
+        df = load(path)
+        size = int(df.memory_usage(deep = True).sum())
+
+        if size > self.max_size:
+            return df
+
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = (mtime, df, size)
+            self.size += size
+
+            while self.size > self.max_size:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+        return df
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+    def invalidate(self, keys = None, prefix = None):
+        with self.lock:
+            if keys is None and prefix is None:
+                self.entries.clear()
+                self.size = 0
+                return
+
+            keys = set(keys or [])
+            for key in list(self.entries.keys()):
+                filename = key[0] if isinstance(key, tuple) else key
+                if filename in keys or (prefix is not None and filename.startswith(prefix)):
+                    self._remove(key)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'size': self.size,
+                'max_size': self.max_size
+            }
+
+class ValidationCache:
+    """on-disk cache of validation results, one entry per table file.
+
+    Entries are keyed on the path of the file and on the definition of its
+    columns. They hold a fingerprint of the content of the file, a hash of
+    each row and the rules each row failed. When a file changes, only the
+    rows whose hash is unknown are checked again.
+
+    :param directory: where entries are stored, e.g. metadata/.validation
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok = True)
+
+        # fingerprints of files, also used to detect duplicate recordings (see save_fingerprints)
+        try:
+            with open(os.path.join(directory, 'fingerprints.json'), 'r') as f:
+                self.fingerprints = {tuple(item[:-1]): item[-1] for item in json.load(f)}
+        except (OSError, ValueError, TypeError, IndexError):
+            self.fingerprints = {}
+
+    def schema(self, table):
+        columns = [
+            (
+                c.name, c.required, c.regex, c.datetime, c.choices, c.unique,
+                getattr(c.function, '__module__', None), getattr(c.function, '__qualname__', None)
+            )
+            for c in table.columns
+        ]
+        return hashlib.md5(repr((table.name, columns)).encode()).hexdigest()
+
+    def fingerprint(self, filename):
+        """md5 of the content of the file, computed once per modification"""
+        stat = os.stat(filename)
+        key = (os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+
+        if key not in self.fingerprints:
+            self.fingerprints[key] = file_md5(filename)
+
+        return self.fingerprints[key]
+
+    def partial_fingerprint(self, filename, block = 64*1024):
+        """md5 of the first and last blocks of the file, computed once per modification"""
+        stat = os.stat(filename)
+        key = (os.path.abspath(filename), stat.st_mtime_ns, stat.st_size, block)
+
+        if key not in self.fingerprints:
+            self.fingerprints[key] = partial_md5(filename, block)
+
+        return self.fingerprints[key]
+
+    def save_fingerprints(self):
+        """save the fingerprints of the files which still exist, for later instances"""
+        fingerprints = {key: value for key, value in self.fingerprints.items() if os.path.exists(key[0])}
+        fd, tmp = tempfile.mkstemp(dir = self.directory, prefix = '.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump([list(key) + [value] for key, value in fingerprints.items()], f)
+        os.replace(tmp, os.path.join(self.directory, 'fingerprints.json'))
+
+    def entry_path(self, table):
+        key = hashlib.md5(os.path.abspath(table.filename).encode()).hexdigest()
+        return os.path.join(self.directory, key + '.npz')
+
+    def load(self, table):
+        # entries are plain arrays, read without pickle since the cache may live in the dataset
+        try:
+            with np.load(self.entry_path(table), allow_pickle = False) as f:
+                entry = {
+                    'schema': str(f['schema']),
+                    'fingerprint': str(f['fingerprint']),
+                    'columns': [str(column) for column in f['columns']],
+                    'hashes': f['hashes'],
+                    'failures': f['failures'],
+                    'valid': bool(f['valid']),
+                    'warnings': [str(warning) for warning in f['warnings']]
+                }
+        except (OSError, EOFError, ValueError, KeyError, zipfile.BadZipFile):
+            return None
+
+        return entry if entry['schema'] == self.schema(table) else None
+
+    def save(self, table, entry):
+        destination = self.entry_path(table)
+        fd, tmp = tempfile.mkstemp(dir = self.directory, prefix = '.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f,
+                schema = np.array(entry['schema']),
+                fingerprint = np.array(entry['fingerprint']),
+                columns = np.array(entry['columns'], dtype = str),
+                hashes = np.asarray(entry['hashes'], dtype = np.uint64),
+                failures = np.asarray(entry['failures'], dtype = np.uint8),
+                valid = np.array(entry['valid']),
+                warnings = np.array(entry.get('warnings', []), dtype = str)
+            )
+        os.replace(tmp, destination)
+
+    def is_valid(self, table):
+        """True if the file of the table (which does not need to be read) is
+        unchanged since it was last validated without any error"""
+        entry = self.load(table)
+        return entry is not None and entry.get('valid', False) and entry['fingerprint'] == self.fingerprint(table.filename)
+
+    def warnings(self, table):
+        """warnings of the table when it was last validated"""
+        entry = self.load(table)
+        return entry['warnings'] if entry is not None else []
+
+    def set_valid(self, table, valid, warnings = []):
+        entry = self.load(table)
+        if entry is not None and (entry.get('valid') != valid or entry['warnings'] != list(warnings)):
+            entry['valid'] = valid
+            entry['warnings'] = list(warnings)
+            self.save(table, entry)
+
+    def row_failures(self, table):
+        """failures of each row of the table (see IndexTable.check_rows),
+        reusing the results of the rows which did not change"""
+        fingerprint = self.fingerprint(table.filename)
+        columns = list(table.df.columns)
+        n_rules = len(table.rules())
+
+        entry = self.load(table)
+        if entry is not None and entry['columns'] != columns:
+            entry = None
+
+        if entry is not None and entry['fingerprint'] == fingerprint:
+            profiling.count('validation.cache.rows', len(table.df))
+            return np.unpackbits(entry['failures'], axis = 1, count = n_rules).astype(bool)
+
+        hashes = pd.util.hash_pandas_object(table.df, index = False).values
+        failures = np.zeros((len(table.df), n_rules), dtype = bool)
+
+        if entry is not None:
+            known_hashes, first = np.unique(entry['hashes'], return_index = True)
+            known = np.unpackbits(entry['failures'], axis = 1, count = n_rules).astype(bool)[first]
+
+            rows = pd.Index(known_hashes).get_indexer(hashes)
+            found = rows >= 0
+            failures[found] = known[rows[found]]
+        else:
+            found = np.zeros(len(table.df), dtype = bool)
+
+        profiling.count('validation.cache.rows', int(found.sum()))
+        if not found.all():
+            failures[~found] = table.check_rows(table.df[~found])
+
+        self.save(table, {
+            'schema': self.schema(table),
+            'fingerprint': fingerprint,
+            'columns': columns,
+            'hashes': hashes,
+            'failures': np.packbits(failures, axis = 1),
+            'valid': False,
+            'warnings': []
+        })
+
+        return failures
+
+class ConversionCache:
+    """on-disk cache of converted recordings, which are converted on first access.
+
+    Converted files are stored into a directory per profile (and per settings
+    of the profile). Once the files exceed `budget` bytes, the least recently
+    accessed recordings are evicted. Entries are locked while they are
+    converted, and while they are used within use(), so that concurrent
+    processes sharing the directory neither convert a recording twice nor
+    evict a recording in use. Lock files (in the .locks directory of each
+    profile) are empty and kept after their recording is evicted, since
+    removing them could let two processes hold the lock of the same entry;
+    there is at most one per recording and profile.
+
+    :param project: ChildProject instance
+    :param directory: where converted recordings are stored
+    :param budget: maximum size of the converted files in bytes (None = unlimited)
+    """
+
+    def __init__(self, project, directory, budget = None):
+        self.project = project
+        self.directory = directory
+        self.budget = budget
+        self.in_use = {}
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok = True)
+
+        if self.project.recordings is None:
+            self.project.read()
+
+    def profile_path(self, profile):
+        settings = (profile.format, profile.codec, profile.sampling, profile.split, profile.extra_flags)
+        return os.path.join(self.directory, "{}-{}".format(profile.name, hashlib.md5(repr(settings).encode()).hexdigest()[:8]))
+
+    def entry_paths(self, recording_filename, profile):
+        """paths of the entry and of the lock of a recording"""
+        key = hashlib.md5(recording_filename.encode()).hexdigest()
+        path = self.profile_path(profile)
+        return os.path.join(path, '.entries', key + '.json'), os.path.join(path, '.locks', key)
+
+    def load(self, entry_path):
+        try:
+            with open(entry_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, entry_path, entry):
+        fd, tmp = tempfile.mkstemp(dir = os.path.dirname(entry_path), prefix = '.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp, entry_path)
+
+    def lookup(self, recording_filename, profile):
+        """cached entry of the recording, or None; marks the entry as recently used"""
+        entry_path, lock_path = self.entry_paths(recording_filename, profile)
+        entry = self.load(entry_path)
+
+        if entry is not None:
+            try:
+                os.utime(entry_path)
+            except FileNotFoundError:
+                # evicted by another process since it was loaded
+                return None
+
+            profiling.count('conversion_cache.hits')
+
+        return entry
+
+    def convert(self, recording_filename, profile):
+        from .projects import convert_recording
+
+        recordings = self.project.recordings
+        rows = recordings[recordings['filename'] == recording_filename].to_dict(orient = 'records')
+        if not rows:
+            raise ValueError("recording '{}' is not in the recordings index".format(recording_filename))
+
+        path = self.profile_path(profile)
+        converted = convert_recording(self.project.path, profile, False, rows[0], destination = path)
+        failed = [c for c in converted if not c['success']]
+        if failed or not converted:
+            raise Exception("could not convert '{}': {}".format(recording_filename, failed[0]['error'] if failed else ''))
+
+        files = [c['converted_filename'] for c in converted]
+        profiling.count('conversion_cache.misses')
+
+        return {
+            'recording_filename': recording_filename,
+            'files': files,
+            'onsets': [c.get('onset') for c in converted] if profile.split else None,
+            'size': sum(os.path.getsize(os.path.join(path, f)) for f in files)
+        }
+
+    def get(self, recording_filename, profile):
+        """paths of the converted files of a recording (several if the profile
+        splits recordings), which is converted first if it is not cached.
+
+        Other processes sharing the cache may evict these files at any time
+        once they are returned; use use() to keep them while they are read."""
+        entry_path, lock_path = self.entry_paths(recording_filename, profile)
+        entry = self.lookup(recording_filename, profile)
+
+        if entry is None:
+            for directory in [os.path.dirname(entry_path), os.path.dirname(lock_path)]:
+                os.makedirs(directory, exist_ok = True)
+
+            with self.pinned(entry_path), lock_file(lock_path):
+                # another process may have converted the recording in the meantime
+                entry = self.lookup(recording_filename, profile)
+                if entry is None:
+                    entry = self.convert(recording_filename, profile)
+                    self.save(entry_path, entry)
+
+            self.evict(keep = entry_path)
+
+        path = self.profile_path(profile)
+        return [os.path.join(path, f) for f in entry['files']]
+
+    @contextmanager
+    def pinned(self, entry_path):
+        """protect an entry from evictions by this process.
+        Other processes are kept away by the lock of the entry, but locks
+        do not apply within the process which holds them."""
+        with self.lock:
+            self.in_use[entry_path] = self.in_use.get(entry_path, 0) + 1
+
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.in_use[entry_path] -= 1
+                if not self.in_use[entry_path]:
+                    del self.in_use[entry_path]
+
+    @contextmanager
+    def use(self, recording_filename, profile):
+        """paths of the converted files of a recording, which will not be
+        evicted for the duration of the context"""
+        entry_path, lock_path = self.entry_paths(recording_filename, profile)
+
+        with self.pinned(entry_path):
+            while True:
+                files = self.get(recording_filename, profile)
+                with lock_file(lock_path, shared = True):
+                    # the entry may have been evicted before it was locked
+                    if self.lookup(recording_filename, profile) is not None:
+                        yield files
+                        return
+
+    def open(self, recording_filename, profile):
+        """converted recording (see ChildProject.audio.ConvertedRecording)"""
+        from .audio import ConvertedRecording
+
+        files = self.get(recording_filename, profile)
+        entry = self.lookup(recording_filename, profile)
+        return ConvertedRecording(files, entry['onsets'] if entry is not None else None)
+
+    def entries(self):
+        """(entry path, last access time, size) of every cached recording"""
+        entries = []
+        for profile in os.listdir(self.directory):
+            directory = os.path.join(self.directory, profile, '.entries')
+            if not os.path.isdir(directory):
+                continue
+
+            for name in os.listdir(directory):
+                if not name.endswith('.json'):
+                    continue
+
+                entry_path = os.path.join(directory, name)
+                entry = self.load(entry_path)
+                try:
+                    entries.append((entry_path, os.path.getmtime(entry_path), entry['size']))
+                except (OSError, TypeError):
+                    continue
+
+        return entries
+
+    def size(self):
+        return sum(size for entry_path, atime, size in self.entries())
+
+    @profiling.timed('conversion_cache.evict')
+    def evict(self, keep = None):
+        """remove the least recently used recordings until the cache fits in the budget"""
+        if self.budget is None:
+            return
+
+        with lock_file(os.path.join(self.directory, '.lock')):
+            entries = sorted(self.entries(), key = lambda entry: entry[1])
+            total = sum(size for entry_path, atime, size in entries)
+
+            for entry_path, atime, size in entries:
+                if total <= self.budget:
+                    break
+
+                profile_path = os.path.dirname(os.path.dirname(entry_path))
+                lock_path = os.path.join(profile_path, '.locks', os.path.splitext(os.path.basename(entry_path))[0])
+
+                # entries pinned by this process are checked under self.lock, and the
+                # lock of the entry fails if another process is converting or using it
+                with self.lock:
+                    if entry_path == keep or entry_path in self.in_use:
+                        continue
+
+                    try:
+                        with lock_file(lock_path, blocking = False):
+                            entry = self.load(entry_path)
+                            os.remove(entry_path)
+                            for f in (entry['files'] if entry is not None else []):
+                                if os.path.exists(os.path.join(profile_path, f)):
+                                    os.remove(os.path.join(profile_path, f))
+                    except OSError:
+                        continue
+
+                total -= size
+                profiling.count('conversion_cache.evictions')
@@ -1,35 +1,116 @@
 #!/usr/bin/env python3
-from ChildProject.projects import ChildProject, RecordingProfile    
-from ChildProject.annotations import AnnotationManager
+# heavy modules (pandas, numpy, pympi) are only imported
+# by the commands that need them, to keep the startup fast.
+from ChildProject import profiling
+from ChildProject.parallel import Executor
 
 import argparse
 import os
-import pandas as pd
 import sys
 
+def arg(*name_or_flags, **kwargs):
+    return (list(name_or_flags), kwargs)
+
+global_args = [
+    arg('--profile', help = "print the time spent in each phase of the command", action = 'store_true'),
+    arg('--profile-output', dest = 'profile_output', help = "save a JSON trace of the command (implies --profile)", default = None)
+]
+
 parser = argparse.ArgumentParser()
+for a in global_args:
+    parser.add_argument(*a[0], **a[1])
 subparsers = parser.add_subparsers()
 
-def arg(*name_or_flags, **kwargs):
-    return (list(name_or_flags), kwargs)
+commands = {}
 
 def subcommand(args=[], parent = subparsers):
+    """register a command. args is either a list of arguments or a callable
+    returning that list, which is then only evaluated when the command is invoked."""
     def decorator(func):
-        parser = parent.add_parser(func.__name__.replace('_', '-'), description=func.__doc__)
-        for arg in args:
-            parser.add_argument(*arg[0], **arg[1])
+        name = func.__name__.replace('_', '-')
+        parser = parent.add_parser(name, description=func.__doc__, help=func.__doc__)
         parser.set_defaults(func=func)
+        commands[name] = (parser, args)
+        return func
     return decorator
 
+def invoked_command(argv):
+    """name of the command invoked by argv (without the program name), i.e. its
+    first positional argument once the global options are parsed, or None"""
+    preparser = argparse.ArgumentParser(add_help = False)
+    for a in global_args:
+        preparser.add_argument(*a[0], **a[1])
+    preparser.add_argument('command', nargs = '?', default = None)
+
+    known, unknown = preparser.parse_known_args(argv)
+    return known.command if known.command in commands else None
+
+def build_subcommand(name):
+    parser, args = commands[name]
+    if callable(args):
+        args = args()
+
+    for arg in args:
+        parser.add_argument(*arg[0], **arg[1])
+
+def executor_args(backend):
+    return [
+        arg('--jobs', '--threads', dest = 'jobs', help = "amount of parallel workers (0 = uses all available cores)", required = False, default = 0, type = int),
+        arg('--backend', help = "parallel execution backend (default: {})".format(backend), choices = Executor.BACKENDS, required = False, default = backend),
+        arg('--chunksize', help = "amount of tasks sent at once to each worker process (process backend only, and ignored with --prefetch; by default, about 4 chunks per worker)", required = False, default = None, type = int)
+    ]
+
+def get_executor(args):
+    return Executor(backend = args.backend, jobs = args.jobs, chunksize = args.chunksize)
+
+def prefetch_args():
+    return [
+        arg('--prefetch', help = "retrieve annexed inputs with datalad while the previous ones are processed", required = False, default = False, action = 'store_true'),
+        arg('--prefetch-ahead', dest = 'prefetch_ahead', help = "amount of inputs retrieved ahead (0 = twice the amount of workers)", required = False, default = 0, type = int),
+        arg('--prefetch-jobs', dest = 'prefetch_jobs', help = "amount of concurrent retrievals", required = False, default = 2, type = int),
+        arg('--drop', help = "drop the content of the inputs retrieved by --prefetch once they have been processed", required = False, default = False, action = 'store_true')
+    ]
+
+def shard_args():
+    return [
+        arg('--shard', help = "only process the i-th of N shares of the tasks, given as i/N (e.g. 2/4), to split the job among several processes or hosts", required = False, default = None),
+        arg('--queue', help = "directory shared by the processes of the job, in which tasks are claimed one at a time so that they are dynamically shared", required = False, default = None),
+        arg('--claim-timeout', dest = 'claim_timeout', help = "seconds after which unfinished tasks claimed by a process which stopped responding (e.g. crashed) are taken over by others", required = False, default = 300, type = float)
+    ]
+
+def get_shard(args):
+    if not args.shard and not args.queue:
+        return None
+
+    from ChildProject.parallel import Shard
+    return Shard.parse(args.shard or '1/1', claims = args.queue, timeout = args.claim_timeout)
+
+def get_prefetcher(args):
+    if not args.prefetch:
+        return None
+
+    from ChildProject.parallel import Prefetcher
+    return Prefetcher(drop = args.drop, ahead = args.prefetch_ahead, jobs = args.prefetch_jobs)
+
 @subcommand([
     arg("source", help = "project path"),
-    arg('--ignore-files', dest='ignore_files', required = False, default = False, action = 'store_true')
+    arg('--ignore-files', dest='ignore_files', required = False, default = False, action = 'store_true'),
+    arg('--max-per-rule', dest='max_per_rule', help = "maximum amount of messages printed per rule (0 = unlimited)", required = False, default = 20, type = int),
+    arg('--report', help = "save every error and warning into this file (.csv or .jsonl)", required = False, default = None),
+    arg('--cache-dir', dest='cache_dir', help = "cache validation results into this directory (e.g. metadata/.validation) to only check what changed since the previous run", required = False, default = None),
+    arg('--duplicates', help = "warn about recordings which have the same content", required = False, default = False, action = 'store_true')
 ])
 def validate(args):
     """validate the consistency of the dataset returning detailed errors and warnings"""
+    from ChildProject.projects import ChildProject
+    from ChildProject.diagnostics import Diagnostics
+    from ChildProject.cache import ValidationCache
 
     project = ChildProject(args.source)
-    errors, warnings = project.validate_input_data(args.ignore_files)
+    cache = ValidationCache(args.cache_dir) if args.cache_dir else None
+
+    with Diagnostics(max_per_rule = args.max_per_rule or None, report = args.report) as diagnostics:
+        errors, warnings = project.validate_input_data(args.ignore_files, diagnostics = diagnostics, cache = cache, duplicates = args.duplicates)
 
     for error in errors:
         print("error: {}".format(error), file = sys.stderr)
@@ -38,19 +119,29 @@ def validate(args):
         print("warning: {}".format(warning))
 
     if len(errors) > 0:
-        print("validation failed, {} error(s) occured".format(len(errors)), file = sys.stderr)
+        print("validation failed, {} error(s) occured".format(diagnostics.count('error')), file = sys.stderr)
         sys.exit(1)
 
-@subcommand([
-    arg("source", help = "project path"),
-    arg("--annotations", help = "path to input annotations index (csv)", default = "")
-] + [
-    arg("--{}".format(col.name), help = col.description, type = str, default = None)
-    for col in AnnotationManager.INDEX_COLUMNS
-    if not col.generated
-])
+def import_annotations_args():
+    from ChildProject.annotations import AnnotationManager
+
+    return [
+        arg("source", help = "project path"),
+        arg("--annotations", help = "path to input annotations index (csv)", default = ""),
+        arg("--validate-imported", dest = "validate_imported", help = "validate only the annotations imported by this command rather than the whole project", action = 'store_true'),
+        arg("--cache-dir", dest = "cache_dir", help = "cache validation results into this directory (e.g. metadata/.validation) to skip the annotations which did not change", default = None)
+    ] + [
+        arg("--{}".format(col.name), help = col.description, type = str, default = None)
+        for col in AnnotationManager.INDEX_COLUMNS
+        if not col.generated
+    ] + executor_args('process') + prefetch_args() + shard_args()
+
+@subcommand(import_annotations_args)
 def import_annotations(args):
     """convert and import a set of annotations"""
+    from ChildProject.projects import ChildProject
+    from ChildProject.annotations import AnnotationManager
+    import pandas as pd
 
     project = ChildProject(args.source)
     errors, warnings = project.validate_input_data()
@@ -64,12 +155,19 @@ def import_annotations(args):
     else:
         annotations = pd.DataFrame([{col.name: getattr(args, col.name) for col in AnnotationManager.INDEX_COLUMNS if not col.generated}])
 
+    executor = get_executor(args)
+
     am = AnnotationManager(project)
-    am.import_annotations(annotations)
+    imported = am.import_annotations(annotations, executor = executor, prefetcher = get_prefetcher(args), shard = get_shard(args))
 
-    errors, warnings = am.validate()
+    cache = None
+    if args.cache_dir:
+        from ChildProject.cache import ValidationCache
+        cache = ValidationCache(args.cache_dir)
 
-    if len(am.errors) > 0:
+    errors, warnings = am.validate(imported if args.validate_imported else None, executor = executor, cache = cache)
+
+    if len(am.errors) > 0 or len(errors) > 0 or len(warnings) > 0:
         print("importation completed with {} errors and {} warnings".format(len(am.errors)+len(errors), len(warnings)), file = sys.stderr)
         print("\n".join(am.errors), file = sys.stderr)
         print("\n".join(errors), file = sys.stderr)
@@ -106,29 +204,38 @@ def import_data(args):
     datalad.api.run_procedure(spec = cmd, dataset = ds)
 
 
-default_profile = RecordingProfile("default")    
-@subcommand([
-    arg("source", help = "project path"),
-    arg("--name", help = "profile name", required = True),
-    arg("--format", help = "audio format (e.g. {})".format(default_profile.format), required = True),
-    arg("--codec", help = "audio codec (e.g. {})".format(default_profile.codec), required = True),
-    arg("--sampling", help = "sampling frequency (e.g. {})".format(default_profile.sampling), required = True),
-    arg("--split", help = "split duration (e.g. 15:00:00)", required = False, default = None),
-    arg('--skip-existing', dest='skip_existing', required = False, default = False, action='store_true'),
-    arg('--threads', help = "amount of threads running conversions in parallel (0 = uses all available cores)", required = False, default = 0, type = int)
-])
+def convert_args():
+    from ChildProject.projects import RecordingProfile
+    default_profile = RecordingProfile("default")
+
+    return [
+        arg("source", help = "project path"),
+        arg("--name", help = "profile name", required = True),
+        arg("--format", help = "audio format (e.g. {})".format(default_profile.format), required = True),
+        arg("--codec", help = "audio codec (e.g. {})".format(default_profile.codec), required = True),
+        arg("--sampling", help = "sampling frequency (e.g. {})".format(default_profile.sampling), required = True),
+        arg("--split", help = "split duration (e.g. 15:00:00)", required = False, default = None),
+        arg("--engine", help = "'native' converts PCM WAV recordings into WAV files without ffmpeg, 'auto' does so whenever possible", choices = RecordingProfile.ENGINES, required = False, default = default_profile.engine),
+        arg('--skip-existing', dest='skip_existing', required = False, default = False, action='store_true')
+    ] + executor_args('process') + prefetch_args() + shard_args()
+
+@subcommand(convert_args)
 def convert(args):
     """convert recordings to a given format"""
+    from ChildProject.projects import ChildProject, RecordingProfile
+
     profile = RecordingProfile(
         name = args.name,
         format = args.format,
         codec = args.codec,
         sampling = args.sampling,
-        split = args.split
+        split = args.split,
+        engine = args.engine
     )
 
     project = ChildProject(args.source)
-    results = project.convert_recordings(profile, skip_existing = args.skip_existing, threads = args.threads)
+    results = project.convert_recordings(profile, skip_existing = args.skip_existing,
+        executor = get_executor(args), prefetcher = get_prefetcher(args), shard = get_shard(args))
 
     for error in project.errors:
         print("error: {}".format(error), file = sys.stderr)
@@ -148,6 +255,9 @@ def convert(args):
     arg("--stats", help = "stats to retrieve (comma-separated)", required = False, default = "")
 ])
 def stats(args):
+    """print statistics about the dataset"""
+    from ChildProject.projects import ChildProject
+
     project = ChildProject(args.source)
 
     errors, warnings = project.validate_input_data()
@@ -166,9 +276,10 @@ def stats(args):
 @subcommand([
     arg("source", help = "source data path"),
     arg("--force", help = "overwrite if column exists", action = 'store_true')
-])
+] + executor_args('thread'))
 def compute_durations(args):
     """creates a 'duration' column into metadata/recordings"""
+    from ChildProject.projects import ChildProject
     project = ChildProject(args.source)
 
     errors, warnings = project.validate_input_data()
@@ -184,11 +295,135 @@ def compute_durations(args):
         
         project.recordings.drop(columns = ['duration'], inplace = True)
 
-    durations = project.compute_recordings_duration().dropna()
+    durations = project.compute_recordings_duration(executor = get_executor(args)).dropna()
 
     recordings = project.recordings.merge(durations[durations['filename'] != 'NA'], how = 'left', left_on = 'filename', right_on = 'filename')
     recordings.to_csv(os.path.join(project.path, 'metadata/recordings.csv'), index = False)
 
+@subcommand([
+    arg("source", help = "project path"),
+    arg("--recording-profile", dest = "recording_profile", help = "name of the profile the recordings were converted with", required = True),
+    arg("--clips", help = "clips to extract (csv with recording_filename, onset and offset columns, in seconds; and optionally clip_filename)", required = True),
+    arg("--destination", help = "output directory", required = True)
+] + executor_args('thread'))
+def extract_clips(args):
+    """extract clips from converted recordings"""
+    from ChildProject.projects import ChildProject
+    from ChildProject.audio import extract_clips
+    import pandas as pd
+
+    project = ChildProject(args.source)
+    clips = extract_clips(project, args.recording_profile, pd.read_csv(args.clips), args.destination, executor = get_executor(args))
+
+    failed = clips[~clips['success']]
+    for clip in failed.to_dict(orient = 'records'):
+        print("error: {} [{}, {}]: {}".format(clip['recording_filename'], clip['onset'], clip['offset'], clip['error']), file = sys.stderr)
+
+    print("{} clip(s) extracted to '{}'".format(len(clips) - len(failed), args.destination))
+
+    if len(failed) > 0:
+        print("{} clip(s) could not be extracted".format(len(failed)), file = sys.stderr)
+        sys.exit(1)
+
+@subcommand([
+    arg("source", help = "project path"),
+    arg("--method", help = "sampling method", choices = ['periodic', 'random', 'high-volubility'], required = True),
+    arg("--length", help = "length of the windows, in seconds", type = float, required = True),
+    arg("--destination", help = "output csv", required = True),
+    arg("--recordings", help = "recordings to sample from (comma-separated; default: all)", default = None),
+    arg("--period", help = "periodic: interval between the beginning of two windows, in seconds", type = float, default = None),
+    arg("--offset", help = "periodic: beginning of the first window, in seconds", type = float, default = 0),
+    arg("--count", help = "random, high-volubility: amount of windows per recording", type = int, default = None),
+    arg("--seed", help = "random: random seed", type = int, default = None),
+    arg("--source-set", dest = "source_set", help = "high-volubility: annotation set used to measure volubility (e.g. vtc)", default = None),
+    arg("--speakers", help = "high-volubility: speaker types to measure (comma-separated)", default = 'CHI'),
+    arg("--step", help = "high-volubility: interval between two candidate windows, in seconds (default: length/10)", type = float, default = None),
+    arg("--resolution", help = "high-volubility: time resolution, in seconds", type = float, default = 1),
+    arg("--strata", help = "high-volubility: amount of equal portions of each recording to pick windows from evenly", type = int, default = 1),
+    arg("--set", dest = "annotation_set", help = "if specified, the output is also an annotations input for this set (see import-annotations)", default = None),
+    arg("--format", help = "format of the annotations to import (with --set)", default = 'eaf')
+] + executor_args('process'))
+def sample(args):
+    """choose windows of the recordings to annotate"""
+    from ChildProject.projects import ChildProject
+    from ChildProject.samplers import PeriodicSampler, RandomSampler, HighVolubilitySampler
+
+    project = ChildProject(args.source)
+    project.read()
+
+    recordings = args.recordings.split(',') if args.recordings else None
+
+    required = {'periodic': ['period'], 'random': ['count'], 'high-volubility': ['count', 'source_set']}[args.method]
+    missing = [name for name in required if getattr(args, name) is None]
+    if missing:
+        print("--{} is required by the {} method".format(missing[0].replace('_', '-'), args.method), file = sys.stderr)
+        sys.exit(1)
+
+    if args.method == 'periodic':
+        sampler = PeriodicSampler(project, args.length, args.period, offset = args.offset, recordings = recordings)
+        windows = sampler.sample()
+    elif args.method == 'random':
+        sampler = RandomSampler(project, args.length, args.count, seed = args.seed, recordings = recordings)
+        windows = sampler.sample()
+    else:
+        from ChildProject.annotations import AnnotationManager
+
+        sampler = HighVolubilitySampler(
+            project, AnnotationManager(project), args.source_set, args.length, args.count,
+            speakers = args.speakers.split(','), step = args.step, resolution = args.resolution,
+            strata = args.strata, recordings = recordings
+        )
+        windows = sampler.sample(executor = get_executor(args))
+
+    if args.annotation_set:
+        windows = sampler.annotations_input(windows, args.annotation_set, format = args.format)
+
+    windows.to_csv(args.destination, index = False)
+    print("{} window(s) sampled from {} recording(s)".format(len(windows), windows['recording_filename'].nunique()))
+
+@subcommand([
+    arg("source", help = "project path"),
+    arg("--host", help = "address to listen on", default = "127.0.0.1"),
+    arg("--port", help = "port to listen on", type = int, default = 8000),
+    arg("--socket", help = "listen on this unix socket instead of host:port", default = None),
+    arg("--cache-size", dest = "cache_size", help = "memory budget for cached segments, in MB", type = int, default = 1024)
+])
+def serve(args):
+    """keep the project loaded and answer queries over HTTP (/stats, /annotations, /segments, /vc_stats)"""
+    from ChildProject.server import create_server
+
+    server = create_server(args.source, host = args.host, port = args.port, socket = args.socket, cache_size = args.cache_size*1024*1024)
+    print("serving '{}' on {}".format(args.source, args.socket if args.socket else "http://{}:{}".format(*server.server_address[:2])), file = sys.stderr)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+
 def main():
+    # only the invoked command gets its arguments built
+    command = invoked_command(sys.argv[1:])
+    if command is not None:
+        build_subcommand(command)
+
     args = parser.parse_args()
-    args.func(args)
+    if not hasattr(args, 'func'):
+        parser.print_help()
+        sys.exit(1)
+
+    if not (args.profile or args.profile_output):
+        args.func(args)
+        return
+
+    profiling.enable()
+    try:
+        with profiling.span('total'):
+            args.func(args)
+    finally:
+        profiling.report()
+        if args.profile_output:
+            profiling.dump(args.profile_output)
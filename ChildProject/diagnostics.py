@@ -0,0 +1,112 @@
+from collections import namedtuple
+import csv
+import json
+import os
+
+Diagnostic = namedtuple('Diagnostic', ['level', 'table', 'column', 'rule', 'line', 'value', 'message'])
+
+class Diagnostics:
+    """collects validation diagnostics (errors and warnings).
+
+    Each diagnostic belongs to a rule, identified by its level, table, column
+    and name (e.g. 'choices'). At most `max_per_rule` diagnostics of each rule
+    are kept in memory, the others are only counted. If `report` is set, every
+    diagnostic is also streamed to this file (.csv or .jsonl).
+
+    :param max_per_rule: maximum amount of diagnostics kept per rule (None = unlimited)
+    :param report: path of the report
+    """
+
+    FIELDS = list(Diagnostic._fields)
+
+    def __init__(self, max_per_rule = None, report = None):
+        self.max_per_rule = max_per_rule
+        self.report = report
+        self.kept = []
+        self.counts = {}
+        self._file = None
+        self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def add(self, level, table, column, rule, line = None, value = None, message = ''):
+        self.add_many(level, table, column, rule, [line], [value], lambda line, value: message)
+
+    def add_many(self, level, table, column, rule, lines, values, message):
+        """record a diagnostic for each line; message(line, value) is only
+        invoked for the diagnostics that are kept or reported"""
+        key = (level, table, column, rule)
+        n = len(lines)
+        if n == 0:
+            return
+
+        count = self.counts.get(key, 0)
+        keep = n if self.max_per_rule is None else max(min(n, self.max_per_rule - count), 0)
+
+        for i in range(n if self.report else keep):
+            diagnostic = Diagnostic(level, table, column, rule, lines[i], values[i], message(lines[i], values[i]))
+            if i < keep:
+                self.kept.append(diagnostic)
+            if self.report:
+                self.write(diagnostic)
+
+        self.counts[key] = count + n
+
+    def write(self, diagnostic):
+        if self._file is None:
+            self._file = open(self.report, 'w+', newline = '')
+            if os.path.splitext(self.report)[1] != '.jsonl':
+                self._writer = csv.writer(self._file)
+                self._writer.writerow(self.FIELDS)
+
+        if self._writer:
+            self._writer.writerow(['' if v is None else v for v in diagnostic])
+        else:
+            self._file.write(json.dumps(diagnostic._asdict(), default = lambda o: o.item() if hasattr(o, 'item') else str(o)) + '\n')
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._writer = None
+
+    def summary(self):
+        """amount of diagnostics per rule, as a list of dicts"""
+        return [
+            {'level': level, 'table': table, 'column': column, 'rule': rule, 'count': count}
+            for (level, table, column, rule), count in self.counts.items()
+        ]
+
+    def count(self, level):
+        """total amount of diagnostics of a given level, including those not kept"""
+        return sum(count for key, count in self.counts.items() if key[0] == level)
+
+    def messages(self, level, table = None):
+        """kept messages of a given level, followed by a line per rule which
+        exceeded max_per_rule"""
+        messages = [
+            d.message for d in self.kept
+            if d.level == level and (table is None or d.table == table)
+        ]
+
+        for (rule_level, rule_table, column, rule), count in self.counts.items():
+            if rule_level != level or (table is not None and rule_table != table):
+                continue
+
+            if self.max_per_rule is not None and count > self.max_per_rule:
+                messages.append("rule '{}' failed on {} lines for column '{}' of {} table, only the first {} are shown".format(
+                    rule, count, column, rule_table, self.max_per_rule
+                ))
+
+        return messages
+
+    def errors(self, table = None):
+        return self.messages('error', table)
+
+    def warnings(self, table = None):
+        return self.messages('warning', table)
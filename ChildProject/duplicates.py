@@ -0,0 +1,134 @@
+from collections import defaultdict
+from functools import partial
+import hashlib
+import os
+
+from . import profiling
+from .parallel import Executor
+from .utils import annex_key, file_size
+
+def file_md5(filename):
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1024*1024), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+def partial_md5(filename, block = 64*1024):
+    """md5 of the first and last blocks of a file"""
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as f:
+        md5.update(f.read(block))
+        f.seek(0, os.SEEK_END)
+        if f.tell() > block:
+            f.seek(max(f.tell() - block, block))
+            md5.update(f.read(block))
+    return md5.hexdigest()
+
+def annex_checksum(path):
+    """checksum of the content of an annexed file read from its key
+    (e.g. 'md5:d41d8cd9...' for MD5E keys), or None if the key has none"""
+    key = annex_key(path)
+    if key is None:
+        return None
+
+    backend = key.split('-', 1)[0]
+    if '--' not in key or backend.rstrip('E') not in ['MD5', 'SHA1', 'SHA256', 'SHA512', 'BLAKE2B256']:
+        return None
+
+    checksum = key.split('--', 1)[1]
+    if backend.endswith('E'):
+        checksum = checksum.split('.', 1)[0]
+
+    return "{}:{}".format(backend.rstrip('E').lower(), checksum)
+
+def try_hash(func, path):
+    """(hash, None) if func could hash the file, (None, error message) otherwise"""
+    try:
+        return func(path), None
+    except OSError as e:
+        return None, str(e)
+
+@profiling.timed('duplicates')
+def find_duplicates(paths, executor = None, cache = None, block = 64*1024, errors = None):
+    """groups of files with the same content.
+
+    Files are grouped by size, then by the hash of their first and last
+    blocks, and only the files which still collide are fully hashed (md5).
+    Annexed files are identified by the checksum of their key, even if their
+    content is not present locally; those with MD5 keys (the default backend
+    of datalad) can thus be matched with any other file.
+
+    :param executor: Executor hashing the files (threads by default)
+    :param cache: ValidationCache in which fingerprints are kept, so that only
+    the files which changed are hashed again
+    :param block: size of the blocks hashed first
+    :param errors: dictionary in which the files which could not be read are
+    stored along with the error, instead of aborting the scan; these files are
+    left out of the groups
+    :return: list of groups of paths, each sorted
+    """
+    if executor is None:
+        executor = Executor('thread')
+
+    if errors is None:
+        errors = {}
+
+    def hash_files(func, paths):
+        hashes = {}
+        for path, (value, error) in zip(paths, executor.map(partial(try_hash, func), paths)):
+            if error is None:
+                hashes[path] = value
+            else:
+                errors[path] = error
+        return hashes
+
+    by_size = defaultdict(list)
+    for path in paths:
+        size = file_size(path)
+        if size is not None:
+            by_size[size].append(path)
+
+    candidates = [group for group in by_size.values() if len(group) > 1]
+    checksums = {path: annex_checksum(path) for group in candidates for path in group}
+    local = [
+        [path for path in group if checksums[path] is None and os.path.exists(path)]
+        for group in candidates
+    ]
+    profiling.count('duplicates.candidates', sum(len(group) for group in candidates))
+
+    # only local files of the same size as another local file need a partial hash
+    pending = [path for group in local if len(group) > 1 for path in group]
+    partial_hashes = hash_files(
+        partial(cache.partial_fingerprint if cache is not None else partial_md5, block = block),
+        pending
+    )
+
+    # local files need a full hash if they share their partial hash with another
+    # local file, or if they may match an annexed file of the same size
+    pending = []
+    for group, local_group in zip(candidates, local):
+        annexed = any(checksums[path] is not None for path in group)
+        by_partial = defaultdict(list)
+        for path in local_group:
+            if path not in errors:
+                by_partial[partial_hashes.get(path)].append(path)
+
+        for subgroup in by_partial.values():
+            if len(subgroup) > 1 or annexed:
+                pending += subgroup
+
+    full_hashes = hash_files(cache.fingerprint if cache is not None else file_md5, pending)
+    profiling.count('duplicates.hashed', len(full_hashes))
+
+    groups = defaultdict(list)
+    for size, group in by_size.items():
+        for path in group:
+            if path in errors:
+                continue
+
+            checksum = 'md5:' + full_hashes[path] if path in full_hashes else checksums.get(path)
+            if checksum is not None:
+                groups[(size, checksum)].append(path)
+
+    return sorted(sorted(group) for group in groups.values() if len(group) > 1)
@@ -0,0 +1,129 @@
+from functools import partial
+import numpy as np
+import pandas as pd
+
+from . import profiling
+from .audio import ConvertedRecordings, to_float
+from .parallel import Executor
+from .raster import rasterize
+
+FEATURES = ['rms_db', 'peak_db', 'snr_db']
+
+def frame_levels(recording, frame_samples, block_frames = 6000):
+    """mean energy and peak amplitude of consecutive frames of frame_samples
+    samples, reading the recording sequentially, block_frames frames at a time"""
+    n = -(-int(recording.starts[-1]) // frame_samples)
+    energy = np.zeros(n)
+    peak = np.zeros(n)
+
+    for first in range(0, n, block_frames):
+        last = min(first + block_frames, n)
+        samples = to_float(recording.read_samples(first*frame_samples, last*frame_samples)).mean(axis = 1)
+
+        # the last frame of the recording may be incomplete
+        frames = np.zeros((last - first)*frame_samples)
+        frames[:len(samples)] = samples
+        frames = frames.reshape(last - first, frame_samples)
+
+        counts = np.full(last - first, frame_samples)
+        counts[-1] = len(samples) - (last - first - 1)*frame_samples
+
+        energy[first:last] = (frames**2).sum(axis = 1)/counts
+        peak[first:last] = np.abs(frames).max(axis = 1)
+
+    return energy, peak
+
+def segment_features(energy, peak, onsets, offsets, resolution, context):
+    """rms and peak level (dBFS) of each segment, and its signal-to-noise ratio (dB)
+    against the frames not covered by any segment within context seconds around it"""
+    n = len(energy)
+    a = np.clip(np.floor(onsets/resolution).astype(np.int64), 0, n)
+    b = np.clip(np.ceil(offsets/resolution).astype(np.int64), a, n)
+
+    speech = rasterize(onsets, offsets, np.full(len(onsets), 'speech'), ['speech'], 0, n, resolution)[0]
+    silent = 1 - speech
+
+    cumulated = lambda x: np.concatenate([[0], np.cumsum(x)])
+    segment_energy = cumulated(energy)
+    noise_energy = cumulated(energy*silent)
+    noise_frames = cumulated(silent)
+
+    ctx = int(round(context/resolution))
+    ca, cb = np.clip(a - ctx, 0, n), np.clip(b + ctx, 0, n)
+
+    empty = b <= a
+    bounds = np.stack([a, b], axis = 1).ravel()
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        mean_energy = (segment_energy[b] - segment_energy[a])/(b - a)
+        noise = (noise_energy[cb] - noise_energy[ca])/(noise_frames[cb] - noise_frames[ca])
+
+        rms_db = 10*np.log10(mean_energy)
+        peak_db = 20*np.log10(np.maximum.reduceat(np.append(peak, 0), bounds)[::2]) if n else np.zeros(len(a))
+        snr_db = 10*np.log10(mean_energy/noise)
+
+    rms_db[empty] = peak_db[empty] = snr_db[empty] = np.nan
+    return rms_db, peak_db, snr_db
+
+@profiling.timed('features.recording')
+def recording_features(recordings, resolution, context, block_frames, task):
+    recording_filename, onsets, offsets = task
+
+    recording = recordings.open(recording_filename)
+    frame_samples = max(int(round(resolution*recording.sample_rate)), 1)
+    resolution = frame_samples/recording.sample_rate
+
+    energy, peak = frame_levels(recording, frame_samples, block_frames)
+    return segment_features(energy, peak, onsets, offsets, resolution, context)
+
+@profiling.timed('features')
+def attach_features(project, profile, segments, resolution = 0.01, context = 5, block_frames = 6000, executor = None):
+    """add acoustic features to segments, computed from the recordings converted with a given profile:
+
+    - rms_db: rms level of the segment (dBFS)
+    - peak_db: peak level of the segment (dBFS)
+    - snr_db: energy of the segment relative to the energy of the surrounding
+      frames (within `context` seconds) that are not covered by any of the segments
+
+    Each recording is read once, sequentially and block by block, and recordings
+    are processed in parallel. segments must have 'recording_filename', 'time_seek',
+    'segment_onset' and 'segment_offset' columns, e.g. AnnotationManager.get_segments(annotations,
+    index_columns = ['recording_filename', 'time_seek']).
+
+    :param profile: name of the profile (subfolder of converted_recordings)
+    :param resolution: duration of the frames in seconds
+    :param block_frames: amount of frames read at once
+    """
+    if executor is None:
+        executor = Executor('process')
+
+    recordings = ConvertedRecordings(project, profile)
+
+    missing = set(segments['recording_filename'].unique()) - set(recordings.files.keys())
+    if missing:
+        raise ValueError("recordings [{}] have not been converted with profile '{}'".format(",".join(sorted(map(str, missing))), profile))
+
+    onsets = segments['time_seek'].values.astype(float) + segments['segment_onset'].values.astype(float)
+    offsets = segments['time_seek'].values.astype(float) + segments['segment_offset'].values.astype(float)
+
+    segments = segments.copy()
+    if segments.empty:
+        return segments.assign(**{feature: pd.Series(dtype = float) for feature in FEATURES})
+
+    codes, names = pd.factorize(segments['recording_filename'])
+    order = np.argsort(codes, kind = 'stable')
+    groups = np.split(order, np.cumsum(np.bincount(codes, minlength = len(names)))[:-1])
+
+    results = executor.map(
+        partial(recording_features, recordings, resolution, context, block_frames),
+        [(names[i], onsets[rows], offsets[rows]) for i, rows in enumerate(groups)]
+    )
+
+    features = np.full((len(FEATURES), len(segments)), np.nan)
+    for rows, result in zip(groups, results):
+        features[:, rows] = result
+
+    for i, feature in enumerate(FEATURES):
+        segments[feature] = features[i]
+
+    return segments
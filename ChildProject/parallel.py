@@ -0,0 +1,371 @@
+from collections import Counter
+from contextlib import contextmanager
+from functools import partial
+import hashlib
+import math
+import os
+import socket
+import threading
+import time
+
+from . import profiling
+from .utils import lock_file
+
+class Executor:
+    """execution layer shared by every parallel operation.
+
+    - 'serial' runs tasks one after another in the calling thread
+    - 'thread' is suited to I/O bound tasks (reading files, spawning subprocesses)
+    - 'process' is suited to CPU bound tasks written in python (parsing)
+
+    :param jobs: amount of workers (0 = uses all available cores)
+    :param chunksize: amount of tasks sent at once to each worker process by map()
+    (the thread backend ignores it). By default, tasks are split into about
+    4 chunks per worker, as multiprocessing.Pool.map does
+    :param progress: callable invoked as progress(done, total) after each task
+    """
+
+    BACKENDS = ['serial', 'thread', 'process']
+
+    def __init__(self, backend = 'process', jobs = 0, chunksize = None, progress = None):
+        if backend not in self.BACKENDS:
+            raise ValueError("backend should be any of [{}], got '{}'".format(",".join(self.BACKENDS), backend))
+
+        self.backend = backend
+        self.jobs = int(jobs)
+        self.chunksize = max(1, int(chunksize)) if chunksize else None
+        self.progress = progress
+
+    def workers(self):
+        return self.jobs if self.jobs > 0 else os.cpu_count()
+
+    def default_chunksize(self, total):
+        return max(1, math.ceil(total/(4*min(self.workers(), total))))
+
+    def map(self, func, iterable):
+        items = list(iterable)
+        total = len(items)
+        results = []
+
+        if self.backend == 'serial' or self.workers() == 1 or total <= 1:
+            for item in items:
+                results.append(func(item))
+                self._notify(len(results), total)
+
+            return results
+
+        # spans recorded by worker processes are sent back with each result
+        collect = self.backend == 'process' and profiling.enabled
+        if collect:
+            func = partial(profiling.collect, func)
+
+        # imported here to keep the command line interface fast to start
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+        pool_class = ThreadPoolExecutor if self.backend == 'thread' else ProcessPoolExecutor
+        with pool_class(max_workers = min(self.workers(), total)) as pool:
+            for result in pool.map(func, items, chunksize = self.chunksize or self.default_chunksize(total)):
+                if collect:
+                    result, records = result
+                    profiling.merge(*records)
+
+                results.append(result)
+                self._notify(len(results), total)
+
+        return results
+
+    @contextmanager
+    def pool(self, total):
+        """pool of workers to which tasks are submitted one at a time with submit(),
+        for the duration of the context (None if tasks run in the calling thread)"""
+        if self.backend == 'serial' or self.workers() == 1 or total <= 1:
+            yield None
+            return
+
+        # imported here to keep the command line interface fast to start
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+        pool_class = ThreadPoolExecutor if self.backend == 'thread' else ProcessPoolExecutor
+        with pool_class(max_workers = min(self.workers(), total)) as pool:
+            yield pool
+
+    def submit(self, pool, func, item):
+        """future of func(item), run by a pool returned by pool(); use result()
+        to retrieve its result"""
+        if pool is None:
+            from concurrent.futures import Future
+
+            future = Future()
+            try:
+                future.set_result(func(item))
+            except Exception as e:
+                future.set_exception(e)
+
+            return future
+
+        # spans recorded by worker processes are sent back with the result
+        collect = self.backend == 'process' and profiling.enabled
+        future = pool.submit(profiling.collect, func, item) if collect else pool.submit(func, item)
+        future.collected = collect
+        return future
+
+    def result(self, future):
+        """result of a task submitted with submit()"""
+        result = future.result()
+        if getattr(future, 'collected', False):
+            result, records = result
+            profiling.merge(*records)
+
+        return result
+
+    def _notify(self, done, total):
+        if callable(self.progress):
+            self.progress(done, total)
+
+class Prefetcher:
+    """retrieves the content of annexed inputs in the background, ahead of
+    their processing, so that retrieval and processing overlap.
+
+    The inputs of up to `ahead` tasks beyond those being processed are fetched
+    by `jobs` threads, and each task is submitted to the executor as soon as its
+    inputs are retrieved. Only annexed files whose content is absent are fetched,
+    and if `drop` is True, their content is dropped again once the tasks which
+    need them succeeded, so that the content of a bounded amount of tasks is
+    present at once.
+
+    :param fetch: callable retrieving a list of files (datalad get by default)
+    :param drop: True to drop the content fetched after each successful task,
+    or a callable dropping a list of files (datalad drop is used if True)
+    :param ahead: amount of tasks fetched ahead (0 = twice the amount of workers)
+    :param jobs: amount of concurrent retrievals
+    """
+
+    def __init__(self, fetch = None, drop = False, ahead = 0, jobs = 2):
+        from .utils import datalad_get, datalad_drop
+
+        self.fetch = fetch if fetch is not None else datalad_get
+        self.drop = datalad_drop if drop is True else (drop or None)
+        self.ahead = int(ahead)
+        self.jobs = max(1, int(jobs))
+
+    def get(self, paths):
+        """fetch the absent files among paths, and return those which were fetched"""
+        from .utils import annex_key
+
+        absent = [p for p in paths if annex_key(p) is not None and not os.path.exists(p)]
+        if not absent:
+            return []
+
+        with profiling.span('prefetch.get'):
+            try:
+                self.fetch(absent)
+            except Exception:
+                # the task will fail on its own and report the missing input
+                profiling.count('prefetch.errors')
+                return []
+
+        profiling.count('prefetch.files', len(absent))
+        return absent
+
+    def map(self, executor, func, iterable, inputs, succeeded = None):
+        """executor.map(func, iterable) with prefetching.
+
+        :param inputs: callable returning the list of files required by a task
+        :param succeeded: callable telling whether a task succeeded from its result,
+        which conditions the drop of its inputs (every task succeeds by default)
+        """
+        items = list(iterable)
+        total = len(items)
+        workers = 1 if executor.backend == 'serial' else min(executor.workers(), max(total, 1))
+        ahead = self.ahead if self.ahead > 0 else 2*workers
+        results = [None]*total
+
+        # imported here to keep the command line interface fast to start
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+        fetching = {}
+        running = {}
+        users = Counter()
+        fetched = set()
+        kept = set()
+        submitted = done = 0
+
+        with ThreadPoolExecutor(max_workers = self.jobs) as fetcher, executor.pool(total) as pool:
+            while done < total:
+                # at most `ahead` tasks are retrieved beyond those being processed
+                while submitted < total and len(fetching) + len(running) < workers + ahead:
+                    paths = inputs(items[submitted])
+                    users.update(paths)
+                    fetching[fetcher.submit(self.get, paths)] = (submitted, paths)
+                    submitted += 1
+
+                with profiling.span('prefetch.wait'):
+                    completed, _ = wait(list(fetching) + list(running), return_when = FIRST_COMPLETED)
+
+                for future in completed:
+                    if future in fetching:
+                        i, paths = fetching.pop(future)
+                        fetched.update(future.result())
+                        running[executor.submit(pool, func, items[i])] = (i, paths)
+                        continue
+
+                    i, paths = running.pop(future)
+                    results[i] = executor.result(future)
+                    done += 1
+                    executor._notify(done, total)
+
+                    users.subtract(paths)
+                    if succeeded is not None and not succeeded(results[i]):
+                        kept.update(paths)
+
+                    if self.drop:
+                        # inputs shared by several tasks are dropped once none of them needs them
+                        dropped = [
+                            path for path in dict.fromkeys(paths)
+                            if path in fetched and path not in kept and users[path] <= 0
+                        ]
+                        fetched.difference_update(dropped)
+                        if dropped:
+                            self.drop(dropped)
+
+        return results
+
+class Shard:
+    """share the tasks of a job among several independent processes,
+    possibly running on different hosts of a cluster with a shared filesystem.
+
+    Without `claims`, tasks are statically partitioned: shard `index` (1 to `count`)
+    processes the tasks whose key falls into its partition. With `claims`, a
+    directory shared by the processes, tasks are distributed dynamically: each
+    process claims tasks one at a time by creating a claim file, starting with
+    its own partition and then taking over the tasks left by the others.
+    The process running a task updates the modification time of its claim
+    every timeout/5 seconds; claims of unfinished tasks which have not been
+    updated for `timeout` seconds (e.g. because their process crashed) are
+    taken over by other processes. Claims are kept once the job is complete,
+    so the directory should be specific to the job (or emptied to run it again).
+
+    :param index: index of the shard, between 1 and count
+    :param count: amount of shards
+    :param claims: directory of the claim files
+    :param timeout: seconds after which the claim of an unfinished task expires
+    if it is not updated (None = never). Hosts sharing the directory should have
+    synchronized clocks.
+    """
+
+    def __init__(self, index = 1, count = 1, claims = None, timeout = 300):
+        self.index = int(index)
+        self.count = int(count)
+        self.claims = claims
+        self.timeout = None if timeout is None else float(timeout)
+
+        if self.count < 1 or not 1 <= self.index <= self.count:
+            raise ValueError("shard should be specified as i/N with 1 <= i <= N, got '{}/{}'".format(index, count))
+
+        if self.claims:
+            os.makedirs(self.claims, exist_ok = True)
+
+    @classmethod
+    def parse(cls, spec, claims = None, timeout = 300):
+        """shard from an 'i/N' specification (e.g. '2/4')"""
+        try:
+            index, count = [int(x) for x in str(spec).split('/')]
+        except ValueError:
+            raise ValueError("shard should be specified as i/N (e.g. 2/4), got '{}'".format(spec))
+
+        return cls(index, count, claims, timeout)
+
+    def owns(self, key):
+        return int(hashlib.md5(str(key).encode()).hexdigest(), 16) % self.count == self.index - 1
+
+    def tasks(self, items, key):
+        """items to be run by this shard with run(), where key(item) identifies each task
+        (key should be picklable for the process backend, e.g. operator.itemgetter)"""
+        items = list(items)
+        own = [item for item in items if self.owns(key(item))]
+
+        if not self.claims:
+            return own
+
+        return own + [item for item in items if not self.owns(key(item))]
+
+    def claim_path(self, key):
+        return os.path.join(self.claims, hashlib.md5(str(key).encode()).hexdigest())
+
+    def expired(self, path):
+        """True if the claim at path is that of an unfinished task
+        which has not been updated for more than timeout seconds"""
+        if self.timeout is None:
+            return False
+
+        try:
+            with open(path) as fp:
+                done = fp.read().splitlines()[-1:] == ['done']
+            return not done and time.time() - os.path.getmtime(path) > self.timeout
+        except OSError:
+            return False
+
+    def claim(self, key):
+        """True if the task was claimed by this process, False if it had already been claimed"""
+        if not self.claims:
+            return True
+
+        path = self.claim_path(key)
+        if self.expired(path):
+            # the claim is checked again under the lock, so that a claim
+            # renewed in the meantime is never removed
+            with lock_file(os.path.join(self.claims, '.lock')):
+                if self.expired(path):
+                    os.remove(path)
+                    profiling.count('shard.reclaimed')
+
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+
+        with os.fdopen(fd, 'w') as fp:
+            fp.write("{}\n{}:{}\n".format(key, socket.gethostname(), os.getpid()))
+
+        return True
+
+    @contextmanager
+    def heartbeat(self, key):
+        """keep the claim of a task alive while it runs, and mark it as done
+        if it completes (the claim of a task which failed eventually expires)"""
+        if not self.claims:
+            yield
+            return
+
+        path = self.claim_path(key)
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.timeout/5):
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+
+        thread = threading.Thread(target = beat, daemon = True) if self.timeout else None
+        if thread is not None:
+            thread.start()
+
+        try:
+            yield
+        finally:
+            stop.set()
+            if thread is not None:
+                thread.join()
+
+        with open(path, 'a') as fp:
+            fp.write("done\n")
+
+    def run(self, key, func, item):
+        """func(item) if the task could be claimed, None otherwise"""
+        if not self.claim(key(item)):
+            profiling.count('shard.skipped')
+            return None
+
+        with self.heartbeat(key(item)):
+            return func(item)
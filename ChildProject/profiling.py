@@ -0,0 +1,164 @@
+"""lightweight timing spans and counters.
+
+Profiling is disabled by default, in which case span() returns a shared
+no-op context manager and count() returns immediately.
+
+    from . import profiling
+
+    with profiling.span('convert.file'):
+        ...
+    profiling.count('convert.bytes', size)
+
+    @profiling.timed('import.file')
+    def import_annotation(...):
+        ...
+"""
+from collections import defaultdict
+from functools import wraps
+import os
+import sys
+import threading
+import time
+
+enabled = False
+
+_lock = threading.Lock()
+_spans = []
+_counters = defaultdict(int)
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_null_span = _NullSpan()
+
+class _Span:
+    __slots__ = ['name', 'start']
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        end = time.perf_counter()
+        with _lock:
+            _spans.append((self.name, self.start, end - self.start, os.getpid(), threading.get_ident()))
+        return False
+
+def span(name):
+    if not enabled:
+        return _null_span
+
+    return _Span(name)
+
+def timed(name):
+    """decorator recording a span for each call of the decorated function"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+
+            with _Span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+    return decorator
+
+def count(name, n = 1):
+    if not enabled:
+        return
+
+    with _lock:
+        _counters[name] += n
+
+def enable():
+    global enabled
+    reset()
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def reset():
+    with _lock:
+        del _spans[:]
+        _counters.clear()
+
+def records():
+    with _lock:
+        return list(_spans), dict(_counters)
+
+def merge(spans, counters):
+    with _lock:
+        _spans.extend(spans)
+        for name in counters:
+            _counters[name] += counters[name]
+
+def collect(func, *args):
+    """run func(*args) with profiling enabled and return its result along
+    with the records it produced. Used to gather spans from worker processes."""
+    enable()
+    result = func(*args)
+    return result, records()
+
+def summary():
+    spans, counters = records()
+
+    phases = {}
+    for name, start, duration, pid, tid in spans:
+        phase = phases.setdefault(name, {'name': name, 'calls': 0, 'total': 0, 'max': 0})
+        phase['calls'] += 1
+        phase['total'] += duration
+        phase['max'] = max(phase['max'], duration)
+
+    phases = sorted(phases.values(), key = lambda phase: phase['name'])
+    for phase in phases:
+        phase['mean'] = phase['total']/phase['calls']
+
+    return phases, counters
+
+def report(file = sys.stderr):
+    phases, counters = summary()
+
+    print("{:<32} {:>8} {:>12} {:>12} {:>12}".format('phase', 'calls', 'total (s)', 'mean (s)', 'max (s)'), file = file)
+    for phase in phases:
+        print("{:<32} {:>8} {:>12.3f} {:>12.4f} {:>12.4f}".format(
+            phase['name'], phase['calls'], phase['total'], phase['mean'], phase['max']
+        ), file = file)
+
+    if counters:
+        print("", file = file)
+        print("{:<32} {:>12}".format('counter', 'value'), file = file)
+        for name in sorted(counters):
+            print("{:<32} {:>12}".format(name, counters[name]), file = file)
+
+def dump(destination):
+    """save spans as a chrome trace (chrome://tracing, https://ui.perfetto.dev)"""
+    import json
+
+    spans, counters = records()
+    origin = min([s[1] for s in spans]) if spans else 0
+
+    with open(destination, 'w') as f:
+        json.dump({
+            'traceEvents': [
+                {
+                    'name': name,
+                    'ph': 'X',
+                    'ts': (start - origin)*1e6,
+                    'dur': duration*1e6,
+                    'pid': pid,
+                    'tid': tid
+                }
+                for name, start, duration, pid, tid in spans
+            ],
+            'counters': counters
+        }, f)
@@ -1,7 +1,7 @@
+import csv
 import datetime
 from functools import partial, reduce
 import glob
-import multiprocessing as mp
 import numpy as np
 import operator
 import os
@@ -10,12 +10,26 @@ import re
 import shutil
 import subprocess
 
-from .tables import IndexTable, IndexColumn, is_boolean
-from .utils import get_audio_duration
+from . import profiling
+from .audio import CODECS, WavFile, convert_wav
+from .parallel import Executor
+from .diagnostics import Diagnostics
+from .duplicates import find_duplicates
+from .tables import IndexTable, IndexColumn, ForeignKey, is_boolean
+from .utils import get_audio_duration, file_exists, file_size, lock_file, lock_path, write_dataframe
 
 class RecordingProfile:
+    """conversion settings of the recordings.
+
+    :param engine: 'ffmpeg', 'native' to downmix and resample PCM WAV recordings
+    in-process into WAV files, or 'auto' to use the native engine whenever possible
+    and ffmpeg otherwise
+    """
+
+    ENGINES = ['ffmpeg', 'native', 'auto']
+
     def __init__(self, name, format = 'wav', codec = 'pcm_s16le', sampling = 16000,
-                 split = None, extra_flags = None):
+                 split = None, extra_flags = None, engine = 'ffmpeg'):
 
         self.name = str(name)
         self.format = format
@@ -23,6 +37,11 @@ class RecordingProfile:
         self.sampling = int(sampling)
         self.extra_flags = extra_flags
 
+        if engine not in self.ENGINES:
+            raise ValueError("engine should be any of [{}], got '{}'".format(",".join(self.ENGINES), engine))
+
+        self.engine = engine
+
         if split is not None:
             try:
                 split_time = datetime.datetime.strptime(split, '%H:%M:%S')
@@ -39,10 +58,29 @@ class RecordingProfile:
             {'key': 'codec', 'value': self.codec},
             {'key': 'sampling', 'value': self.sampling},
             {'key': 'split', 'value': self.split},
-            {'key': 'extra_flags', 'value': self.extra_flags}
+            {'key': 'extra_flags', 'value': self.extra_flags},
+            {'key': 'engine', 'value': self.engine}
         ]).to_csv(destination, index = False)
 
-def convert_recording(path, profile, skip_existing, row):
+def native_supported(profile, filename):
+    """True if the native engine can convert this file with this profile"""
+    if str(profile.format).lower() != 'wav' or profile.codec not in CODECS or profile.extra_flags:
+        return False
+
+    try:
+        WavFile(filename)
+    except Exception:
+        return False
+
+    return True
+
+@profiling.timed('convert.file')
+def convert_recording(path, profile, skip_existing, row, destination = None):
+    """convert a recording of the project at path.
+
+    :param destination: directory of the converted recordings, converted_recordings/<profile name> by default
+    :return: list of dicts describing each converted file (see ChildProject.convert_recordings)
+    """
     if row['filename'] == 'NA':
             return []
 
@@ -52,10 +90,11 @@ def convert_recording(path, profile, skip_existing, row):
         row['filename']
     )
 
+    if destination is None:
+        destination = os.path.join(path, 'converted_recordings', profile.name)
+
     destination_file = os.path.join(
-        path,
-        'converted_recordings',
-        profile.name,
+        destination,
         os.path.splitext(row['filename'])[0] + '.%03d.' + profile.format if profile.split
         else os.path.splitext(row['filename'])[0] + '.' + profile.format
     )
@@ -65,14 +104,51 @@ def convert_recording(path, profile, skip_existing, row):
         exist_ok = True
     )
 
+    # list of the pieces of split recordings, with their onset and offset
+    segment_list = os.path.join(
+        os.path.dirname(destination_file),
+        '.' + os.path.basename(os.path.splitext(row['filename'])[0]) + '.segments.csv'
+    )
+
     skip = skip_existing and os.path.exists(destination_file)
     success = skip
 
+    engine = profile.engine
+    if engine == 'auto':
+        engine = 'native' if native_supported(profile, original_file) else 'ffmpeg'
+
+    if not skip and engine == 'native':
+        try:
+            pieces = convert_wav(original_file, destination_file, profile.sampling, profile.codec, profile.split)
+        except Exception as e:
+            return [{
+                'original_filename': row['filename'],
+                'converted_filename': "",
+                'success': False,
+                'error': str(e)
+            }]
+
+        if profiling.enabled:
+            profiling.count('convert.files')
+            profiling.count('convert.bytes', os.path.getsize(original_file))
+
+        return [{
+            'original_filename': row['filename'],
+            'converted_filename': os.path.join(os.path.dirname(row['filename']), os.path.basename(cf)),
+            'onset': onset,
+            'offset': offset,
+            'success': True
+        } for cf, onset, offset in pieces]
+
     if not skip:
         split_args = []
         if profile.split:
             split_args.append('-segment_time')
             split_args.append(profile.split)
+            split_args.append('-segment_list')
+            split_args.append(segment_list)
+            split_args.append('-segment_list_type')
+            split_args.append('csv')
             split_args.append('-f')
             split_args.append('segment')
 
@@ -96,6 +172,10 @@ def convert_recording(path, profile, skip_existing, row):
 
         success = proc.returncode == 0
 
+        if success and profiling.enabled:
+            profiling.count('convert.files')
+            profiling.count('convert.bytes', os.path.getsize(original_file))
+
     if not success:
         return [{
             'original_filename': row['filename'],
@@ -103,20 +183,43 @@ def convert_recording(path, profile, skip_existing, row):
             'success': False,
             'error': stderr
         }]
-    else:
-        if profile.split:
-            converted_files = [
-                os.path.basename(cf)
-                for cf in glob.glob(os.path.join(path, 'converted_recordings', profile.name, os.path.splitext(row['filename'])[0] + '.*.' + profile.format))
-            ]
-        else:
-            converted_files = [os.path.splitext(row['filename'])[0] + '.' + profile.format]
+    elif profile.split:
+        if not os.path.exists(segment_list):
+            return [{
+                'original_filename': row['filename'],
+                'converted_filename': "",
+                'success': False,
+                'error': "missing list of the pieces of the split recording '{}'".format(segment_list)
+            }]
+
+        converted_files = read_segment_list(segment_list, os.path.dirname(row['filename']))
+        os.remove(segment_list)
 
+        return [{
+            'original_filename': row['filename'],
+            'converted_filename': cf,
+            'onset': onset,
+            'offset': offset,
+            'success': True
+        } for cf, onset, offset in converted_files]
+
+    # unsplit recordings are a single piece spanning the whole recording
     return [{
         'original_filename': row['filename'],
-        'converted_filename': cf,
+        'converted_filename': os.path.splitext(row['filename'])[0] + '.' + profile.format,
+        'onset': 0,
+        'offset': get_audio_duration(destination_file),
         'success': True
-    } for cf in converted_files]
+    }]
+
+def read_segment_list(filename, directory = ''):
+    """pieces of a split recording from the csv segment list written by ffmpeg,
+    as (filename, onset, offset) tuples with times in seconds"""
+    with open(filename, newline = '') as f:
+        return [
+            (os.path.join(directory, os.path.basename(piece)), float(onset), float(offset))
+            for piece, onset, offset in csv.reader(f)
+        ]
 
 class ChildProject:
     REQUIRED_DIRECTORIES = [
@@ -168,6 +271,8 @@ class ChildProject:
         IndexColumn(name = 'notes', description = 'free-style notes about individual recordings (avoid tabs and newlines)')
     ]
 
+    RECORDINGS_CHILD = ForeignKey('child_id', 'children')
+
     PROJECT_FOLDERS = [
         'raw_annotations',
         'annotations',
@@ -184,6 +289,7 @@ class ChildProject:
         self.children = None
         self.recordings = None
     
+    @profiling.timed('project.read')
     def read(self):
         self.ct = IndexTable('children', os.path.join(self.path, 'metadata/children'), self.CHILDREN_COLUMNS)
         self.rt = IndexTable('recordings', os.path.join(self.path, 'metadata/recordings'), self.RECORDINGS_COLUMNS)
@@ -191,9 +297,23 @@ class ChildProject:
         self.children = self.ct.read(lookup_extensions = ['.csv', '.xls', '.xlsx'])
         self.recordings = self.rt.read(lookup_extensions = ['.csv', '.xls', '.xlsx'])
 
-    def validate_input_data(self, ignore_files = False):
-        self.errors = []
-        self.warnings = []
+    def tables(self):
+        """dataframes of the tables of the project, by name (see Constraint.check)"""
+        return {'children': self.children, 'recordings': self.recordings}
+
+    @profiling.timed('project.validate')
+    def validate_input_data(self, ignore_files = False, diagnostics = None, cache = None, duplicates = False):
+        """validate the metadata and the recordings of the project.
+
+        :param diagnostics: Diagnostics instance to record the diagnostics into,
+        e.g. in order to cap them per rule or to stream them to a report
+        :param cache: ValidationCache, to only check the rows of the tables which changed
+        (and to only hash the recordings which changed if duplicates is True)
+        :param duplicates: if True, warn about recordings which have the same content
+        :return: errors and warnings, also stored into self.errors and self.warnings
+        """
+        if diagnostics is None:
+            diagnostics = Diagnostics()
 
         path = self.path
 
@@ -201,36 +321,45 @@ class ChildProject:
 
         for rd in self.REQUIRED_DIRECTORIES:
             if rd not in directories:
-                self.errors.append("missing directory {}.".format(rd))
+                diagnostics.add('error', None, None, 'missing_directory', value = rd, message = "missing directory {}.".format(rd))
 
         # check tables
         self.read()
-        
-        errors, warnings = self.ct.validate()
-        self.errors += errors
-        self.warnings += warnings
+        self.ct.validate(diagnostics, cache = cache)
+        self.rt.validate(diagnostics, cache = cache)
 
-        errors, warnings = self.rt.validate()
-        self.errors += errors
-        self.warnings += warnings
+        if not ignore_files:
+            self.validate_files(diagnostics, duplicates = duplicates, cache = cache)
 
-        if ignore_files:
-            return self.errors, self.warnings
+        self.errors, self.warnings = diagnostics.errors(), diagnostics.warnings()
+        return self.errors, self.warnings
 
-        for index, row in self.recordings.iterrows():
-            # make sure that recordings exist
-            for column_name in self.recordings.columns:
-                column_attr = next((c for c in self.RECORDINGS_COLUMNS if c.name == column_name), None)
+    def validate_files(self, diagnostics, duplicates = False, cache = None):
+        path = self.path
 
-                if column_attr is None:
+        with profiling.span('project.validate.files'):
+            # make sure that recordings exist
+            for column in self.RECORDINGS_COLUMNS:
+                if not column.filename or column.name not in self.recordings.columns:
                     continue
 
-                if column_attr.filename and row[column_name] != 'NA' and not os.path.exists(os.path.join(path, 'recordings', str(row[column_name]))):
-                    self.errors.append("cannot find recording '{}'".format(str(row[column_name])))
-
-            # child id refers to an existing child in the children table
-            if row['child_id'] not in self.children['child_id'].tolist():
-                self.errors.append("child_id '{}' in recordings on line {} cannot be found in the children table.".format(row['child_id'], index))
+                # annexed files are accepted even if their content has not been fetched
+                values = self.recordings[column.name]
+                exists = {f: file_exists(os.path.join(path, 'recordings', str(f))) for f in values.unique()}
+                missing = (values != 'NA') & ~values.map(exists).astype(bool)
+
+                diagnostics.add_many('error', 'recordings', column.name, 'missing_file',
+                    values.index[missing].tolist(), values[missing].tolist(),
+                    lambda line, value: "cannot find recording '{}'".format(str(value))
+                )
+
+        # child id refers to an existing child in the children table
+        with profiling.span('project.validate.references'):
+            violations = self.RECORDINGS_CHILD.check(self.recordings, self.tables())['child_id']
+            diagnostics.add_many('error', 'recordings', 'child_id', 'reference',
+                violations.index.tolist(), violations.tolist(),
+                lambda line, value: "child_id '{}' in recordings on line {} cannot be found in the children table.".format(value, line)
+            )
 
         # detect un-indexed recordings and throw warnings
         files = [
@@ -239,22 +368,57 @@ class ChildProject:
             if c.filename and c.name in self.recordings.columns
         ]
 
-        indexed_files = [
+        indexed_files = set([
             os.path.abspath(os.path.join(path, 'recordings', str(f)))
             for f in pd.core.common.flatten(files)
-        ]
+        ])
 
-        recordings_files = glob.glob(os.path.join(path, 'recordings', '**/*.*'), recursive = True)
+        with profiling.span('project.scan'):
+            recordings_files = glob.glob(os.path.join(path, 'recordings', '**/*.*'), recursive = True)
 
-        for rf in recordings_files:
-            if len(os.path.splitext(rf)) > 1 and os.path.splitext(rf)[1] in ['.csv', '.xls', '.xlsx']:
-                continue
+        unindexed = [
+            rf for rf in recordings_files
+            if os.path.splitext(rf)[1] not in ['.csv', '.xls', '.xlsx']
+            and os.path.abspath(rf) not in indexed_files
+        ]
 
-            ap = os.path.abspath(rf)
-            if ap not in indexed_files:
-                self.warnings.append("file '{}' not indexed.".format(rf))
+        diagnostics.add_many('warning', 'recordings', None, 'unindexed_file',
+            [None]*len(unindexed), unindexed,
+            lambda line, value: "file '{}' not indexed.".format(value)
+        )
 
-        return self.errors, self.warnings
+        if not duplicates:
+            return
+
+        # files with the same content, whether they are indexed or not
+        lines = {
+            os.path.abspath(os.path.join(path, 'recordings', str(f))): line
+            for line, f in self.recordings['filename'].items()
+        }
+
+        with profiling.span('project.validate.duplicates'):
+            unreadable = {}
+            groups = find_duplicates([
+                rf for rf in recordings_files
+                if os.path.splitext(rf)[1] not in ['.csv', '.xls', '.xlsx']
+            ], cache = cache, errors = unreadable)
+
+            if cache is not None:
+                cache.save_fingerprints()
+
+        diagnostics.add_many('warning', 'recordings', 'filename', 'duplicate',
+            [min([lines[os.path.abspath(f)] for f in group if os.path.abspath(f) in lines], default = None) for group in groups],
+            [','.join(os.path.relpath(f, os.path.join(path, 'recordings')) for f in group) for group in groups],
+            lambda line, value: "recordings '{}' have the same content".format("', '".join(value.split(',')))
+        )
+
+        files = sorted(unreadable.keys())
+        unreadable = {os.path.relpath(f, os.path.join(path, 'recordings')): error for f, error in unreadable.items()}
+        diagnostics.add_many('warning', 'recordings', 'filename', 'unreadable',
+            [lines.get(os.path.abspath(f)) for f in files],
+            [os.path.relpath(f, os.path.join(path, 'recordings')) for f in files],
+            lambda line, value: "could not check whether recording '{}' has duplicates: {}".format(value, unreadable[value])
+        )
 
     def import_data(self, destination, follow_symlinks = True):
         errors, warnings = self.validate_input_data()
@@ -273,28 +437,79 @@ class ChildProject:
             )
 
     def get_stats(self):
+        """statistics about the project. Recordings that are annexed but whose content
+        is not present locally count as existing: their size is read from their
+        annex key, and their duration from the 'duration' column of the metadata
+        (see compute-durations)."""
         stats = {}
-        recordings = self.recordings.merge(self.compute_recordings_duration(), left_on = 'filename', right_on = 'filename')
-        recordings['exists'] = recordings['filename'].map(lambda f: os.path.exists(os.path.join(self.path, 'recordings', f)))
+        recordings = self.recordings[['filename']].copy()
+        paths = [os.path.join(self.path, 'recordings', str(f)) for f in recordings['filename']]
+
+        recordings['exists'] = [file_exists(p) for p in paths]
+        recordings['present'] = [os.path.exists(p) for p in paths]
+        recordings['size'] = [file_size(p) for p in paths]
+
+        if 'duration' in self.recordings.columns:
+            recordings['duration'] = pd.to_numeric(self.recordings['duration'], errors = 'coerce')
+        else:
+            recordings['duration'] = np.nan
+
+        # durations missing from the metadata are only computed from local content
+        missing = recordings['duration'].isnull() & recordings['present']
+        if missing.any():
+            recordings.loc[missing, 'duration'] = Executor('thread').map(
+                get_audio_duration,
+                [p for p, m in zip(paths, missing) if m]
+            )
 
         stats['total_recordings'] = recordings.shape[0]
         stats['total_existing_recordings'] = recordings[recordings['exists'] == True].shape[0]
+        stats['total_local_recordings'] = recordings[recordings['present'] == True].shape[0]
         stats['audio_duration'] = recordings['duration'].sum()
+        stats['audio_size'] = int(recordings['size'].sum())
         stats['total_children'] = self.children.shape[0]
 
         return stats
 
-    def compute_recordings_duration(self):
-        recordings = self.recordings[['filename']]
+    @profiling.timed('project.durations')
+    def compute_recordings_duration(self, executor = None):
+        if executor is None:
+            executor = Executor('thread')
 
-        recordings['duration'] = recordings['filename'].map(lambda f:
-            get_audio_duration(os.path.join(self.path, 'recordings', f))
-        )
+        recordings = self.recordings[['filename']].copy()
+        paths = [os.path.join(self.path, 'recordings', str(f)) for f in recordings['filename'].tolist()]
+
+        # the duration of annexed files whose content is not present is left undefined
+        local = [os.path.exists(p) or not file_exists(p) for p in paths]
+        durations = iter(executor.map(get_audio_duration, [p for p, l in zip(paths, local) if l]))
+        recordings['duration'] = [next(durations) if l else np.nan for l in local]
 
         return recordings
 
 
-    def convert_recordings(self, profile, skip_existing = False, threads = 0):
+    def merge_converted_recordings(self, profile, recordings):
+        """merge conversion results into the recordings index of a profile,
+        replacing the previous results for the same recordings"""
+        destination = os.path.join(self.path, 'converted_recordings', profile.name, 'recordings.csv')
+
+        lock = lock_path(self.path, 'recordings-{}.lock'.format(profile.name), os.path.join('converted_recordings', profile.name, '.recordings.lock'))
+        with lock_file(lock):
+            if os.path.exists(destination):
+                previous = pd.read_csv(destination)
+                if len(recordings):
+                    previous = previous[~previous['original_filename'].isin(recordings['original_filename'])]
+                recordings = pd.concat([previous, recordings], sort = False)
+
+            write_dataframe(recordings, destination, index = False)
+
+    @profiling.timed('convert')
+    def convert_recordings(self, profile, skip_existing = False, threads = 0, executor = None, prefetcher = None, shard = None):
+        """convert the recordings according to a profile.
+
+        :param prefetcher: Prefetcher retrieving annexed recordings while the previous ones are converted
+        :param shard: Shard, to only convert a share of the recordings. The results are then
+        merged into the recordings index of the profile, which other shards may also update
+        """
         if not isinstance(profile, RecordingProfile):
             raise ValueError('profile should be a RecordingProfile instance')
 
@@ -307,18 +522,35 @@ class ChildProject:
             exist_ok = True
         )
 
-        conversion_table = []
+        if executor is None:
+            executor = Executor('process', jobs = threads)
 
-        pool = mp.Pool(processes = threads if threads > 0 else mp.cpu_count())
-        conversion_table = pool.map(
-            partial(convert_recording, self.path, profile, skip_existing),
-            self.recordings.to_dict('records')
-        )
+        task = partial(convert_recording, self.path, profile, skip_existing)
+        rows = self.recordings.to_dict('records')
 
-        conversion_table = reduce(operator.concat, conversion_table)
+        if shard is not None:
+            rows = shard.tasks(rows, key = operator.itemgetter('filename'))
+            task = partial(shard.run, operator.itemgetter('filename'), task)
+
+        if prefetcher is None:
+            conversion_table = executor.map(task, rows)
+        else:
+            conversion_table = prefetcher.map(executor, task, rows,
+                inputs = lambda row: [] if row['filename'] == 'NA' else [os.path.join(self.path, 'recordings', row['filename'])],
+                succeeded = lambda converted: all(c['success'] for c in converted)
+            )
+
+        # tasks claimed by other shards return None
+        conversion_table = reduce(operator.concat, [c for c in conversion_table if c is not None], [])
         profile.recordings = pd.DataFrame(conversion_table)
 
-        profile.recordings.to_csv(os.path.join(self.path, 'converted_recordings', profile.name, 'recordings.csv'), index = False)
-        profile.to_csv(os.path.join(self.path, 'converted_recordings', profile.name, 'profile.csv'))
+        destination = os.path.join(self.path, 'converted_recordings', profile.name)
+        with profiling.span('convert.write_index'):
+            if shard is None:
+                profile.recordings.to_csv(os.path.join(destination, 'recordings.csv'), index = False)
+            else:
+                self.merge_converted_recordings(profile, profile.recordings)
+
+            profile.to_csv(os.path.join(destination, 'profile.csv'))
 
         return profile
@@ -0,0 +1,149 @@
+import hashlib
+import numpy as np
+import os
+import pandas as pd
+
+from . import profiling
+
+def frame_index(t, resolution):
+    return np.round(np.asarray(t, dtype = float)/resolution).astype(np.int64)
+
+def rasterize(onsets, offsets, labels, categories, first_frame, n_frames, resolution = 0.01):
+    """turn segments into an int8 array of shape (len(categories), n_frames),
+    equal to 1 where at least one segment of the category covers the frame.
+
+    Frame i covers [(first_frame+i)*resolution, (first_frame+i+1)*resolution).
+    Segments boundaries are rounded to the nearest frame.
+    """
+    codes = pd.Categorical(np.asarray(labels), categories = categories).codes
+    a = np.clip(frame_index(onsets, resolution) - first_frame, 0, n_frames)
+    b = np.clip(frame_index(offsets, resolution) - first_frame, 0, n_frames)
+
+    keep = (codes >= 0) & (b > a)
+    codes, a, b = codes[keep].astype(np.int64), a[keep], b[keep]
+
+    # +1 at each onset, -1 at each offset; frames are active where the running sum is positive
+    width = n_frames + 1
+    events = np.bincount(codes*width + a, minlength = len(categories)*width)\
+        - np.bincount(codes*width + b, minlength = len(categories)*width)
+
+    active = np.cumsum(events.reshape(len(categories), width), axis = 1)[:, :n_frames] > 0
+    return active.astype(np.int8)
+
+def to_bitmask(frames):
+    """pack an array of shape (categories, frames) into one integer per frame,
+    with bit i set if category i is active"""
+    dtype = np.uint8 if frames.shape[0] <= 8 else (np.uint16 if frames.shape[0] <= 16 else np.uint32)
+    weights = (np.ones(frames.shape[0], dtype = dtype) << np.arange(frames.shape[0], dtype = dtype))
+    return (frames.astype(dtype)*weights[:, None]).sum(axis = 0, dtype = dtype)
+
+class Rasterizer:
+    """rasterize the segments of an annotation set on a fixed time grid.
+
+    The grid is aligned on the beginning of the recording (frame i covers
+    [i*resolution, (i+1)*resolution) seconds since the beginning of the
+    recording), so that rasters of different sets can be compared frame
+    by frame. Segment times are shifted by `time_seek`, and only the
+    frames within [range_onset, range_offset] are marked as covered.
+
+    :param am: AnnotationManager
+    :param resolution: frame duration in seconds
+    :param column: segments column holding the labels
+    :param categories: list of labels, one row of the raster per label
+    (by default, the permitted values of the column, if it has a list of them)
+    :param cache_dir: if set, rasters of each annotation are saved as .npy files
+    in this directory and memory-mapped on subsequent calls
+    """
+
+    def __init__(self, am, resolution = 0.01, column = 'speaker_type', categories = None, cache_dir = None):
+        self.am = am
+        self.resolution = float(resolution)
+        self.column = column
+
+        if categories is None:
+            choices = next((c.choices for c in am.SEGMENTS_COLUMNS if c.name == column), None)
+            if not isinstance(choices, list):
+                raise ValueError("column '{}' has no list of permitted values, categories must be specified".format(column))
+
+            categories = [c for c in choices if c != 'NA']
+
+        self.categories = list(categories)
+        self.cache_dir = cache_dir
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok = True)
+
+    def annotation_frames(self, annotation):
+        """first frame and amount of frames covered by an annotation"""
+        first = int(frame_index(annotation['time_seek'] + annotation['range_onset'], self.resolution))
+        last = int(frame_index(annotation['time_seek'] + annotation['range_offset'], self.resolution))
+        return first, max(last - first, 0)
+
+    def cache_path(self, annotation):
+        path = os.path.join(self.am.project.path, 'annotations', annotation['annotation_filename'])
+        key = "{}_{}_{}_{}_{}".format(
+            annotation['annotation_filename'].replace('/', '_'),
+            os.stat(path).st_mtime_ns,
+            annotation['time_seek'], annotation['range_onset'], annotation['range_offset']
+        )
+        key += "_{}_{}_{}.npy".format(self.column, self.resolution, hashlib.md5(",".join(self.categories).encode()).hexdigest()[:8])
+        return os.path.join(self.cache_dir, key)
+
+    @profiling.timed('raster.annotation')
+    def rasterize_annotation(self, annotation):
+        """rasterize a single annotation over the range it covers.
+        returns the index of its first frame and the raster"""
+        first, n = self.annotation_frames(annotation)
+
+        if self.cache_dir:
+            cache = self.cache_path(annotation)
+            if os.path.exists(cache):
+                return first, np.load(cache, mmap_mode = 'r')
+
+        segments = self.am.load_segments(
+            annotation['annotation_filename'],
+            columns = ['segment_onset', 'segment_offset', self.column]
+        )
+
+        frames = rasterize(
+            segments['segment_onset'].values + annotation['time_seek'],
+            segments['segment_offset'].values + annotation['time_seek'],
+            segments[self.column].astype(str).values,
+            self.categories,
+            first, n,
+            self.resolution
+        )
+
+        if self.cache_dir:
+            np.save(cache, frames)
+
+        return first, frames
+
+    def rasterize(self, annotations, start, stop):
+        """rasterize annotations of a single recording between start and stop
+        (in seconds since the beginning of the recording).
+
+        returns the raster, of shape (categories, frames), and a boolean
+        array indicating which frames are covered by the annotations
+        """
+        annotations = annotations.dropna(subset = ['annotation_filename'])
+        if annotations['recording_filename'].nunique() > 1:
+            raise ValueError('annotations should belong to a single recording')
+
+        first = int(frame_index(start, self.resolution))
+        n = max(int(frame_index(stop, self.resolution)) - first, 0)
+
+        frames = np.zeros((len(self.categories), n), dtype = np.int8)
+        covered = np.zeros(n, dtype = bool)
+
+        for annotation in annotations.to_dict(orient = 'records'):
+            a_first, a_n = self.annotation_frames(annotation)
+            lo, hi = max(a_first, first), min(a_first + a_n, first + n)
+            if hi <= lo:
+                continue
+
+            a_first, a_frames = self.rasterize_annotation(annotation)
+            frames[:, lo-first:hi-first] |= a_frames[:, lo-a_first:hi-a_first]
+            covered[lo-first:hi-first] = True
+
+        return frames, covered
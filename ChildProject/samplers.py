@@ -0,0 +1,201 @@
+from abc import ABC, abstractmethod
+from functools import partial
+import numpy as np
+import os
+import pandas as pd
+
+from . import profiling
+from .parallel import Executor
+from .raster import Rasterizer
+
+def recordings_duration(project):
+    """duration of each recording in seconds, from the 'duration' column
+    of the recordings index if available (see compute-durations)"""
+    recordings = project.recordings[project.recordings['filename'] != 'NA']
+
+    if 'duration' in recordings.columns:
+        durations = pd.to_numeric(recordings['duration'], errors = 'coerce').values
+    else:
+        durations = project.compute_recordings_duration()['duration'].values
+
+    return pd.Series(durations, index = recordings['filename'].values).dropna()
+
+def windows_dataframe(recording_filename, onsets, length):
+    onsets = np.asarray(onsets, dtype = float)
+    return pd.DataFrame({
+        'recording_filename': recording_filename,
+        'onset': onsets,
+        'offset': onsets + length
+    })
+
+def format_time(t):
+    """seconds formatted as required by the annotations index (e.g. 3600 or 3600.500)"""
+    t = round(float(t), 3)
+    return str(int(t)) if t == int(t) else "{:.3f}".format(t)
+
+def pick_windows(scores, starts, length, count):
+    """greedily pick up to count non-overlapping windows with the highest scores"""
+    picked = []
+    for i in np.argsort(-scores, kind = 'stable'):
+        if len(picked) >= count:
+            break
+
+        if all(abs(starts[i] - starts[j]) >= length for j in picked):
+            picked.append(i)
+
+    return np.sort(np.array(picked, dtype = np.int64))
+
+class Sampler(ABC):
+    """choose windows of recordings to annotate.
+
+    sample() returns a dataframe with one row per window ('recording_filename',
+    'onset' and 'offset' in seconds since the beginning of the recording)
+    which can be passed to extract_clips, and annotations_input() turns it into
+    an input for AnnotationManager.import_annotations.
+    """
+
+    def __init__(self, project, length, recordings = None):
+        self.project = project
+        self.length = float(length)
+        self.recordings = recordings
+
+    def durations(self):
+        durations = recordings_duration(self.project)
+        if self.recordings is not None:
+            durations = durations[durations.index.isin(self.recordings)]
+        return durations
+
+    @abstractmethod
+    def sample(self):
+        pass
+
+    def annotations_input(self, windows, annotation_set, format = 'eaf'):
+        """annotations input (see import_annotations) for the windows, once annotated.
+        Annotations are expected to be relative to the beginning of each window
+        (as for the clips produced by extract_clips), which is thus the time_seek."""
+        windows = windows.copy()
+        windows['set'] = annotation_set
+        windows['time_seek'] = windows['onset'].map(format_time)
+        windows['range_onset'] = '0'
+        windows['range_offset'] = (windows['offset'] - windows['onset']).map(format_time)
+        windows['raw_filename'] = [
+            "{}/{}_{}_{}.{}".format(annotation_set, os.path.splitext(r)[0], int(round(a*1000)), int(round(b*1000)), format)
+            for r, a, b in zip(windows['recording_filename'], windows['onset'], windows['offset'])
+        ]
+        windows['format'] = format
+        return windows
+
+class PeriodicSampler(Sampler):
+    """one window every `period` seconds, starting at `offset`"""
+
+    def __init__(self, project, length, period, offset = 0, recordings = None):
+        super().__init__(project, length, recordings)
+        self.period = float(period)
+        self.offset = float(offset)
+
+    @profiling.timed('sample.periodic')
+    def sample(self):
+        durations = self.durations()
+        windows = [
+            windows_dataframe(recording, np.arange(self.offset, duration - self.length + 1e-9, self.period), self.length)
+            for recording, duration in durations.items()
+        ]
+        return pd.concat(windows, ignore_index = True) if windows else windows_dataframe([], [], self.length)
+
+class RandomSampler(Sampler):
+    """`count` non-overlapping windows drawn at random from each recording"""
+
+    def __init__(self, project, length, count, seed = None, recordings = None):
+        super().__init__(project, length, recordings)
+        self.count = int(count)
+        self.seed = seed
+
+    @profiling.timed('sample.random')
+    def sample(self):
+        rng = np.random.default_rng(self.seed)
+        windows = []
+
+        for recording, duration in self.durations().items():
+            # shifting the windows of each draw by the free space to their left
+            # makes them non-overlapping and uniformly spread
+            n = min(self.count, int(duration//self.length))
+            free = duration - n*self.length
+            onsets = np.sort(rng.uniform(0, free, n)) + np.arange(n)*self.length
+            windows.append(windows_dataframe(recording, onsets, self.length))
+
+        return pd.concat(windows, ignore_index = True) if windows else windows_dataframe([], [], self.length)
+
+@profiling.timed('sample.volubility.recording')
+def recording_volubility(rasterizer, length, step, count, strata, task):
+    recording, annotations, duration = task
+    frames, covered = rasterizer.rasterize(annotations, 0, duration)
+
+    active = frames.max(axis = 0) if len(frames) else np.zeros(len(covered), dtype = np.int8)
+    window = int(round(length/rasterizer.resolution))
+    hop = max(int(round(step/rasterizer.resolution)), 1)
+
+    if len(active) < window:
+        return windows_dataframe(recording, [], length).assign(volubility = [])
+
+    # sliding sums over every window start, from cumulated activity
+    cumulated = np.concatenate([[0], np.cumsum(active, dtype = np.int64)])
+    cumulated_covered = np.concatenate([[0], np.cumsum(covered, dtype = np.int64)])
+    starts = np.arange(0, len(active) - window + 1, hop)
+    scores = (cumulated[starts + window] - cumulated[starts])*rasterizer.resolution
+
+    # only windows entirely covered by the annotations are eligible
+    eligible = (cumulated_covered[starts + window] - cumulated_covered[starts]) == window
+    starts, scores = starts[eligible], scores[eligible]
+
+    picked = []
+    bounds = np.linspace(0, len(active), strata + 1)
+    for stratum in range(strata):
+        inside = np.flatnonzero((starts >= bounds[stratum]) & (starts + window <= bounds[stratum + 1]))
+        n = count//strata + (1 if stratum < count % strata else 0)
+        picked.append(inside[pick_windows(scores[inside], starts[inside], window, n)])
+
+    picked = np.concatenate(picked)
+    return windows_dataframe(recording, starts[picked]*rasterizer.resolution, length).assign(volubility = scores[picked])
+
+class HighVolubilitySampler(Sampler):
+    """the `count` non-overlapping windows of each recording with the most
+    speech from `speakers` according to an annotation set (e.g. vtc).
+
+    Speech is rasterized with a resolution of `resolution` seconds, and the
+    amount of speech in every window starting at a multiple of `step` seconds
+    is derived from the cumulated speech. With `strata` > 1, recordings are
+    divided into as many portions of equal length, and the windows are picked
+    evenly from each portion.
+    """
+
+    def __init__(self, project, am, annotation_set, length, count, speakers = ['CHI'],
+        step = None, resolution = 1, strata = 1, recordings = None):
+        super().__init__(project, length, recordings)
+        self.am = am
+        self.annotation_set = annotation_set
+        self.count = int(count)
+        self.speakers = list(speakers)
+        self.step = float(step) if step else self.length/10
+        self.resolution = float(resolution)
+        self.strata = max(int(strata), 1)
+
+    @profiling.timed('sample.volubility')
+    def sample(self, executor = None):
+        if executor is None:
+            executor = Executor('process')
+
+        annotations = self.am.annotations
+        annotations = annotations[annotations['set'] == self.annotation_set].dropna(subset = ['annotation_filename'])
+
+        durations = self.durations()
+        durations = durations[durations.index.isin(annotations['recording_filename'])]
+
+        rasterizer = Rasterizer(self.am, resolution = self.resolution, categories = self.speakers)
+        by_recording = dict(list(annotations.groupby('recording_filename')))
+
+        windows = executor.map(
+            partial(recording_volubility, rasterizer, self.length, self.step, self.count, self.strata),
+            [(recording, by_recording[recording], duration) for recording, duration in durations.items()]
+        )
+
+        return pd.concat(windows, ignore_index = True) if windows else windows_dataframe([], [], self.length).assign(volubility = [])
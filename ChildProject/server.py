@@ -0,0 +1,152 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import os
+from socketserver import ThreadingMixIn, UnixStreamServer
+import threading
+import traceback
+from urllib.parse import urlparse, parse_qs
+
+from .annotations import AnnotationManager
+from .projects import ChildProject
+
+def to_json(obj):
+    return json.dumps(obj, default = lambda o: o.item() if hasattr(o, 'item') else str(o))
+
+class ProjectServer:
+    """keeps a project and its annotations loaded in order to answer
+    repeated queries. Metadata is reloaded whenever the files in
+    metadata/ change on disk."""
+
+    def __init__(self, path, cache_size = 1024*1024*1024):
+        self.path = path
+        self.cache_size = cache_size
+        self.lock = threading.RLock()
+        self.signature = None
+        self.project = None
+        self.am = None
+        self._stats = None
+        self.refresh()
+
+    def metadata_signature(self):
+        metadata = os.path.join(self.path, 'metadata')
+        return sorted(
+            (f.name, f.stat().st_mtime_ns, f.stat().st_size)
+            for f in os.scandir(metadata)
+            if f.is_file()
+        )
+
+    def refresh(self):
+        signature = self.metadata_signature()
+        if signature == self.signature:
+            return
+
+        with self.lock:
+            if signature == self.signature:
+                return
+
+            project = ChildProject(self.path)
+            am = AnnotationManager(project, cache_size = self.cache_size)
+
+            # parsed segment files remain valid across reloads (they are keyed on mtime)
+            if self.am is not None:
+                am.segments_cache = self.am.segments_cache
+
+            self.project, self.am, self._stats = project, am, None
+            self.signature = signature
+
+    def stats(self, params):
+        with self.lock:
+            if self._stats is None:
+                self._stats = self.project.get_stats()
+            return self._stats
+
+    def manager(self):
+        """the current AnnotationManager. Queries hold on to the one they
+        started with, since a reload may replace it at any time."""
+        with self.lock:
+            return self.am
+
+    def select(self, am, params):
+        annotations = am.annotations
+        if 'set' in params:
+            annotations = annotations[annotations['set'].isin(params['set'])]
+        if 'recording_filename' in params:
+            annotations = annotations[annotations['recording_filename'].isin(params['recording_filename'])]
+        return annotations
+
+    def annotations(self, params):
+        return json.loads(self.select(self.manager(), params).to_json(orient = 'records'))
+
+    def segments(self, params):
+        am = self.manager()
+        single = lambda name: float(params[name][0]) if name in params else None
+        segments = am.get_segments(
+            self.select(am, params),
+            columns = params['columns'][0].split(',') if 'columns' in params else None,
+            speaker_types = params['speaker_types'][0].split(',') if 'speaker_types' in params else None,
+            onset = single('onset'),
+            offset = single('offset'),
+            index_columns = params['index_columns'][0].split(',') if 'index_columns' in params else None
+        )
+        return json.loads(segments.to_json(orient = 'records'))
+
+    def vc_stats(self, params):
+        am = self.manager()
+        segments = am.get_segments(self.select(am, params))
+        turntakingthresh = float(params['turntakingthresh'][0]) if 'turntakingthresh' in params else 1
+        stats = am.get_vc_stats(segments, turntakingthresh = turntakingthresh)
+        return json.loads(stats.reset_index().to_json(orient = 'records'))
+
+    ROUTES = {
+        '/stats': 'stats',
+        '/annotations': 'annotations',
+        '/segments': 'segments',
+        '/vc_stats': 'vc_stats'
+    }
+
+    def query(self, path, params):
+        self.refresh()
+        return getattr(self, self.ROUTES[path])(params)
+
+class RequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+
+        try:
+            if url.path not in ProjectServer.ROUTES:
+                status, body = 404, {'error': "unknown endpoint '{}', expected any of [{}]".format(url.path, ",".join(ProjectServer.ROUTES.keys()))}
+            else:
+                status, body = 200, self.server.project_server.query(url.path, parse_qs(url.query))
+        except Exception as e:
+            status, body = 400, {'error': str(e), 'traceback': traceback.format_exc()}
+
+        body = to_json(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+def create_server(path, host = '127.0.0.1', port = 8000, socket = None, cache_size = 1024*1024*1024):
+    """create a server answering queries about the project at path,
+    on localhost (host, port) or on a unix socket if socket is given."""
+    project_server = ProjectServer(path, cache_size = cache_size)
+
+    if socket:
+        if os.path.exists(socket):
+            os.remove(socket)
+        server = ThreadingUnixHTTPServer(socket, RequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), RequestHandler)
+
+    server.project_server = project_server
+    return server
@@ -4,6 +4,9 @@ import re
 import datetime
 import numpy as np
 
+from . import profiling
+from .diagnostics import Diagnostics
+
 def read_dataframe(filename):
     extension = os.path.splitext(filename)[1]
 
@@ -45,40 +48,132 @@ class IndexColumn:
         self.unique = unique
         self.generated = generated
 
+class Constraint:
+    """constraint between a table and the `reference` table it refers to"""
+
+    def check(self, df, tables):
+        """violations of the constraint by df, where tables maps
+        the names of tables (e.g. 'recordings') to their dataframe"""
+        if self.reference not in tables or tables[self.reference] is None:
+            raise ValueError("reference table '{}' is not available".format(self.reference))
+
+        return self.violations(df, tables[self.reference])
+
+class ForeignKey(Constraint):
+    """values of `columns` must be found among `reference_columns` of the `reference` table.
+
+    :param optional: if True, rows with undefined values ('NA' or null) are not checked
+    """
+
+    def __init__(self, columns, reference, reference_columns = None, optional = False):
+        self.columns = [columns] if isinstance(columns, str) else list(columns)
+        self.reference = reference
+        self.reference_columns = self.columns if reference_columns is None\
+            else ([reference_columns] if isinstance(reference_columns, str) else list(reference_columns))
+        self.optional = optional
+
+    def violations(self, df, reference_df):
+        """rows of df referring to no row of reference_df"""
+        if len(self.columns) == 1:
+            found = df[self.columns[0]].isin(reference_df[self.reference_columns[0]]).values
+        else:
+            found = pd.MultiIndex.from_frame(df[self.columns])\
+                .isin(pd.MultiIndex.from_frame(reference_df[self.reference_columns]))
+
+        if self.optional:
+            found |= (df[self.columns].isnull() | (df[self.columns].astype(str) == 'NA')).any(axis = 1).values
+
+        return df[~found]
+
+class RangeConstraint(Constraint):
+    """[shift+onset, shift+offset] must lie within [0, upper], where upper is
+    read from the row of the `reference` table matching `key`.
+    rows with no matching row or no upper bound are not checked.
+
+    e.g. the segments of an annotation must fit in the duration of the recording:
+    RangeConstraint('segment_onset', 'segment_offset', 'recordings', 'recording_filename', 'filename', 'duration', shift = 'time_seek')
+    """
+
+    def __init__(self, onset, offset, reference, key, reference_key, upper, shift = None, tolerance = 0):
+        self.onset = onset
+        self.offset = offset
+        self.reference = reference
+        self.key = key
+        self.reference_key = reference_key
+        self.upper = upper
+        self.shift = shift
+        self.tolerance = tolerance
+
+    def violations(self, df, reference_df):
+        """rows of df out of range, with the absolute 'onset', 'offset' and 'upper' bounds"""
+        if self.upper not in reference_df.columns:
+            return df.iloc[0:0].assign(onset = [], offset = [], upper = [])
+
+        upper = reference_df.drop_duplicates(self.reference_key).set_index(self.reference_key)[self.upper]
+        upper = pd.to_numeric(upper, errors = 'coerce')
+
+        bound = df[self.key].map(upper).values.astype(float)
+        shift = pd.to_numeric(df[self.shift], errors = 'coerce').values if self.shift else 0
+        onset = pd.to_numeric(df[self.onset], errors = 'coerce').values + shift
+        offset = pd.to_numeric(df[self.offset], errors = 'coerce').values + shift
+
+        with np.errstate(invalid = 'ignore'):
+            bad = ~np.isnan(bound) & ((onset < -self.tolerance) | (offset > bound + self.tolerance))
+
+        return df[bad].assign(onset = onset[bad], offset = offset[bad], upper = bound[bad])
+
 class IndexTable:
     def __init__(self, name, path = None, columns = []):
         self.name = name
         self.path = path
         self.columns = columns
         self.df = None
-    
+        self.filename = path
+
+    @profiling.timed('table.read')
     def read(self, lookup_extensions = None):
         if lookup_extensions is None:
+            self.filename = self.path
             self.df = read_dataframe(self.path)
             return self.df
         else:
             for extension in lookup_extensions:
                 if os.path.exists(self.path + extension):
+                    self.filename = self.path + extension
                     self.df = read_dataframe(self.path + extension)
                     return self.df
 
         raise Exception("could not find table '{}'".format(self.path))
 
-    def validate(self):
-        errors, warnings = [], []
+    @profiling.timed('table.validate')
+    def validate(self, diagnostics = None, cache = None):
+        """validate the table and return its errors and warnings.
+
+        :param diagnostics: Diagnostics instance to record the diagnostics into,
+        e.g. in order to cap them per rule or to stream them to a report
+        :param cache: ValidationCache, to only check the rows that changed since
+        the table was last validated
+        """
+        if diagnostics is None:
+            diagnostics = Diagnostics()
+
+        count = self.error_count(diagnostics)
+        kept = len(diagnostics.kept)
 
         for rc in self.columns:
             if not rc.required:
                 continue
 
             if rc.name not in self.df.columns:
-                errors.append("{} table is missing column '{}'".format(self.name, rc.name))
+                diagnostics.add('error', self.name, rc.name, 'missing_column',
+                    message = "{} table is missing column '{}'".format(self.name, rc.name))
+                continue
 
-            null = self.df[self.df[rc.name].isnull()].index.values.tolist()
-            if len(null) > 0:
-                errors.append(
-                    """{} table has undefined values
-                    for column '{}' in lines: {}""".format(self.name, rc.name, ','.join([str(n) for n in null])))
+            null = self.df[rc.name].isnull().values
+            diagnostics.add_many('error', self.name, rc.name, 'undefined',
+                self.df.index.values[null], [None]*int(null.sum()),
+                lambda line, value: "{} table has an undefined value for column '{}' on line {}".format(self.name, rc.name, line)
+            )
 
         unknown_columns = [
             c for c in self.df.columns
@@ -86,60 +181,24 @@ class IndexTable:
         ]
 
         if len(unknown_columns) > 0:
-            warnings.append("unknown column{} '{}' in {}, exepected columns are: {}".format(
+            diagnostics.add('warning', self.name, ','.join(unknown_columns), 'unknown_column', message = "unknown column{} '{}' in {}, exepected columns are: {}".format(
                 's' if len(unknown_columns) > 1 else '',
                 ','.join(unknown_columns),
                 self.name,
                 ','.join([c.name for c in self.columns])
             ))
 
-        for line_number, row in self.df.iterrows():
-            for column_name in self.df.columns:
-                column_attr = next((c for c in self.columns if c.name == column_name), None)
-
-                if column_attr is None:
-                    continue
-
-                if callable(column_attr.function):
-                    try:
-                        ok = column_attr.function(str(row[column_name])) == True
-                    except:
-                        ok = False
-
-                    if not ok:
-                        message = "'{}' does not pass callable test for column '{}' on line {}".format(row[column_name], column_name, line_number)
-                        if column_attr.required and str(row[column_name]) != 'NA':
-                                errors.append(message)
-                        elif column_attr.required or str(row[column_name]) != 'NA':
-                                warnings.append(message)
-
-                if column_attr.choices and str(row[column_name]) not in column_attr.choices:
-                    message = "'{}' is not a permitted value for column '{}' on line {}, should be any of [{}]".format(row[column_name], column_name, line_number, ",".join(column_attr.choices))
-                    if column_attr.required and str(row[column_name]) != 'NA':
-                            errors.append(message)
-                    elif column_attr.required or str(row[column_name]) != 'NA':
-                            warnings.append(message)
-
-
-                if column_attr.datetime:
-                    try:
-                        dt = datetime.datetime.strptime(row[column_name], column_attr.datetime)
-                    except:
-                        message = "'{}' is not a proper date/time for column '{}' (expected {}) on line {}".format(row[column_name], column_name, column_attr.datetime, line_number)
-                        if column_attr.required and str(row[column_name]) != 'NA':
-                            errors.append(message)
-                        elif column_attr.required or str(row[column_name]) != 'NA':
-                            warnings.append(message)
-                elif column_attr.regex:
-                    if not re.fullmatch(column_attr.regex, str(row[column_name])):
-                        message = "'{}' does not match the format required for '{}' on line {}, expected '{}'".format(row[column_name], column_name, line_number, column_attr.regex)
-                        if column_attr.required and str(row[column_name]) != 'NA':
-                            errors.append(message)
-                        elif column_attr.required or str(row[column_name]) != 'NA':
-                            warnings.append(message)
+        failures = cache.row_failures(self) if cache is not None and self.filename else self.check_rows(self.df)
+
+        for j, (column_attr, rule, level, check, message) in enumerate(self.rules()):
+            mask = failures[:, j]
+            diagnostics.add_many(level, self.name, column_attr.name, rule,
+                self.df.index.values[mask], self.df[column_attr.name].values[mask],
+                lambda line, value: message.format(value, column_attr.name, line)
+            )
 
         for c in self.columns:
-            if not c.unique:
+            if not c.unique or c.name not in self.df.columns:
                 continue
 
             grouped = self.df[self.df[c.name] != 'NA']
@@ -153,12 +212,105 @@ class IndexTable:
                 .sort_values('first')
 
             duplicates = grouped[grouped['count'] > 1]
-            for col, row in duplicates.iterrows():
-                errors.append("{} '{}' appears {} times in lines [{}], should appear once".format(
+            diagnostics.add_many('error', self.name, c.name, 'unique',
+                duplicates['first'].tolist(), duplicates.index.tolist(),
+                lambda line, value: "{} '{}' appears {} times in lines [{}], should appear once".format(
                     c.name,
-                    col,
-                    row['count'],
-                    row['lines']
-                ))
+                    value,
+                    duplicates.loc[value, 'count'],
+                    duplicates.loc[value, 'lines']
+                )
+            )
+
+        if cache is not None and self.filename:
+            # warnings are stored along with the entry, to be reported again when the file is skipped
+            warnings = [d.message for d in diagnostics.kept[kept:] if d.level == 'warning']
+            cache.set_valid(self, self.error_count(diagnostics) == count, warnings = warnings)
+
+        return diagnostics.errors(self.name), diagnostics.warnings(self.name)
+
+    def error_count(self, diagnostics):
+        return sum(n for key, n in diagnostics.counts.items() if key[0] == 'error')
+
+    def column_checks(self, column_attr):
+        """checks run on each value of a column, as (rule, check, message) tuples,
+        where check(value, string) is True if the value is valid"""
+        checks = []
+
+        if callable(column_attr.function):
+            def function(value, string):
+                try:
+                    return column_attr.function(string) == True
+                except:
+                    return False
+
+            checks.append(('function', function,
+                "'{}' does not pass callable test for column '{}' on line {}"))
+
+        if column_attr.choices:
+            checks.append(('choices', lambda value, string: string in column_attr.choices,
+                "'{}' is not a permitted value for column '{}' on line {}, should be any of [" + ",".join(column_attr.choices).replace('{', '{{').replace('}', '}}') + "]"))
+
+        if column_attr.datetime:
+            def parse(value, string):
+                try:
+                    datetime.datetime.strptime(value, column_attr.datetime)
+                    return True
+                except:
+                    return False
+
+            checks.append(('datetime', parse,
+                "'{}' is not a proper date/time for column '{}' (expected " + column_attr.datetime.replace('{', '{{').replace('}', '}}') + ") on line {}"))
+        elif column_attr.regex:
+            checks.append(('regex', lambda value, string: re.fullmatch(column_attr.regex, string) is not None,
+                "'{}' does not match the format required for '{}' on line {}, expected '" + column_attr.regex.replace('{', '{{').replace('}', '}}') + "'"))
+
+        return checks
+
+    def rules(self):
+        """row-level rules of the table, as (column, rule, level, check, message) tuples.
+        Invalid values of required columns are errors, except for 'NA' which is a warning;
+        invalid values of other columns are warnings, and 'NA' is accepted."""
+        rules = []
+        for column_name in self.df.columns:
+            column_attr = next((c for c in self.columns if c.name == column_name), None)
+
+            if column_attr is None:
+                continue
+
+            for rule, check, message in self.column_checks(column_attr):
+                for level in (['error', 'warning'] if column_attr.required else ['warning']):
+                    rules.append((column_attr, rule, level, check, message))
+
+        return rules
+
+    @profiling.timed('table.check_rows')
+    def check_rows(self, df):
+        """boolean array of shape (rows, rules) flagging the rows of df that
+        fail each rule (see rules()). Checks are run once per distinct value."""
+        rules = self.rules()
+        failures = np.zeros((len(df), len(rules)), dtype = bool)
+        columns = {}
+
+        for j, (column_attr, rule, level, check, message) in enumerate(rules):
+            if column_attr.name not in columns:
+                codes, uniques = pd.factorize(df[column_attr.name])
+
+                # undefined values are assigned the code -1, i.e. the last unique value
+                uniques = list(uniques) + [np.nan]
+                strings = [str(value) for value in uniques]
+                na = np.array([string == 'NA' for string in strings])[codes]
+                columns[column_attr.name] = (codes, uniques, strings, na, {})
+
+            codes, uniques, strings, na, invalid = columns[column_attr.name]
+            if rule not in invalid:
+                invalid[rule] = ~np.array([check(value, string) for value, string in zip(uniques, strings)], dtype = bool)[codes]
+
+            if level == 'error':
+                failures[:, j] = invalid[rule] & ~na
+            elif column_attr.required:
+                failures[:, j] = invalid[rule] & na
+            else:
+                failures[:, j] = invalid[rule] & ~na
 
-        return errors, warnings
\ No newline at end of file
+        return failures
@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+
+from . import profiling
+
+def recordings_timeline(project):
+    """start datetime of each recording and date of birth of the child,
+    indexed by filename. Recordings with an undefined filename ('NA')
+    or a filename shared with another recording are left out."""
+    recordings = project.recordings[['experiment', 'child_id', 'filename', 'date_iso', 'start_time']]
+    filenames = recordings['filename']
+    recordings = recordings[
+        ~filenames.isnull() & ~filenames.astype(str).isin(['NA', '']) & ~filenames.duplicated(keep = False)
+    ].astype(str)
+    children = project.children[['experiment', 'child_id', 'child_dob']].astype(str)
+
+    recordings = recordings.merge(children, how = 'left', on = ['experiment', 'child_id'])
+    recordings['recording_start'] = pd.to_datetime(
+        recordings['date_iso'].astype(str) + ' ' + recordings['start_time'].astype(str),
+        format = '%Y-%m-%d %H:%M',
+        errors = 'coerce'
+    )
+    recordings['child_dob'] = pd.to_datetime(recordings['child_dob'], format = '%Y-%m-%d', errors = 'coerce')
+
+    return recordings.set_index('filename')[['child_id', 'recording_start', 'child_dob']]
+
+@profiling.timed('timeline.attach')
+def attach_timeline(project, segments):
+    """add the clock time at which each segment starts ('segment_time')
+    and the age of the child in days at that time ('child_age').
+
+    segments must have 'recording_filename', 'time_seek' and 'segment_onset'
+    columns, e.g. AnnotationManager.get_segments(annotations,
+    index_columns = ['recording_filename', 'time_seek']).
+    Undefined start times (NA) result in undefined clock times and ages,
+    and so do recordings which cannot be identified by their filename.
+    """
+    recordings = recordings_timeline(project)
+    rows = recordings.index.get_indexer(segments['recording_filename'])
+    found = rows >= 0
+
+    start = recordings['recording_start'].values[np.where(found, rows, 0)]
+    start[~found] = np.datetime64('NaT')
+    dob = recordings['child_dob'].values[np.where(found, rows, 0)]
+    dob[~found] = np.datetime64('NaT')
+
+    offset = (segments['time_seek'].values.astype(float) + segments['segment_onset'].values.astype(float))*1e9
+    segments = segments.copy()
+    segments['segment_time'] = start + offset.astype('timedelta64[ns]')
+    segments['child_age'] = (segments['segment_time'].values - dob)/np.timedelta64(1, 'D')
+
+    return segments
+
+def binned_metrics(segments, bins, labels, column = 'speaker_type', by = None):
+    """vocalization count and cumulated duration for each bin and label.
+
+    :param bins: integer array with the bin of each segment (-1 to ignore a segment)
+    :param labels: names of the bins
+    :param by: optional column to group by (e.g. child_id or recording_filename)
+    """
+    categories, codes = np.unique(segments[column].astype(str).values, return_inverse = True)
+    groups, group_codes = (np.array([None]), np.zeros(len(segments), dtype = np.int64)) if by is None\
+        else pd.factorize(segments[by], sort = True)[::-1]
+
+    n = len(labels)
+    keep = (bins >= 0) & (group_codes >= 0)
+    key = ((group_codes*len(categories) + codes)*n + bins)[keep]
+    duration = (segments['segment_offset'] - segments['segment_onset']).values[keep]
+
+    size = len(groups)*len(categories)*n
+    counts = np.bincount(key, minlength = size)
+    durations = np.bincount(key, weights = duration, minlength = size)
+
+    index = pd.MultiIndex.from_product([groups, categories, labels], names = [by, column, 'bin'])
+    metrics = pd.DataFrame({'voc_count': counts, 'voc_duration': durations}, index = index)
+
+    if by is None:
+        metrics = metrics.droplevel(0)
+
+    return metrics
+
+@profiling.timed('timeline.hourly')
+def hourly_metrics(segments, column = 'speaker_type', by = None):
+    """vocalizations count and duration for each hour of the day,
+    according to the start of each segment (see attach_timeline)"""
+    time = segments['segment_time']
+    bins = np.where(time.isnull(), -1, time.dt.hour.fillna(-1)).astype(np.int64)
+    return binned_metrics(segments, bins, list(range(24)), column = column, by = by)
+
+@profiling.timed('timeline.age')
+def age_metrics(segments, edges, column = 'speaker_type', by = None):
+    """vocalizations count and duration per age bracket of the child.
+
+    :param edges: ages (in days) delimiting the brackets, e.g. [0, 180, 365, 730]
+    """
+    edges = np.asarray(edges, dtype = float)
+    age = segments['child_age'].values.astype(float)
+
+    bins = np.digitize(age, edges) - 1
+    bins[np.isnan(age) | (bins < 0) | (bins >= len(edges) - 1)] = -1
+
+    labels = ["[{:g}, {:g})".format(a, b) for a, b in zip(edges[:-1], edges[1:])]
+    return binned_metrics(segments, bins, labels, column = column, by = by)
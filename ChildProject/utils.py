@@ -1,4 +1,6 @@
+from contextlib import contextmanager
 import os
+import tempfile
 
 class Segment:
     def __init__(self, start, stop):
@@ -36,6 +38,46 @@ def intersect_ranges(xs, ys):
         except StopIteration:
             return
 
+def annex_key(path):
+    """git-annex key of an annexed file (a symlink into the annex),
+    whether its content is present or not; None for other files"""
+    if not os.path.islink(path):
+        return None
+
+    target = os.readlink(path)
+    if '/annex/objects/' not in target.replace(os.sep, '/'):
+        return None
+
+    return os.path.basename(target)
+
+def annex_key_size(key):
+    """size in bytes recorded in a git-annex key (e.g. MD5E-s1024--d41d8cd9.wav)"""
+    fields = key.split('--', 1)[0].split('-')
+    size = next((f[1:] for f in fields[1:] if f.startswith('s') and f[1:].isdigit()), None)
+    return int(size) if size is not None else None
+
+def file_exists(path):
+    """True if the file exists, or if it is annexed, even if its content has not been fetched"""
+    return os.path.exists(path) or annex_key(path) is not None
+
+def file_size(path):
+    """size of the file, read from its git-annex key if its content is not present"""
+    if os.path.exists(path):
+        return os.path.getsize(path)
+
+    key = annex_key(path)
+    return annex_key_size(key) if key is not None else None
+
+def datalad_get(paths):
+    """retrieve the content of annexed files with datalad"""
+    import datalad.api
+    datalad.api.get(path = list(paths), on_failure = 'ignore')
+
+def datalad_drop(paths):
+    """drop the local content of annexed files with datalad"""
+    import datalad.api
+    datalad.api.drop(path = list(paths), on_failure = 'ignore')
+
 def get_audio_duration(filename):
     import sox
     if not os.path.exists(filename):
@@ -47,4 +89,65 @@ def get_audio_duration(filename):
     except:
         pass
 
-    return duration
\ No newline at end of file
+    return duration
+
+def lock_path(dataset, name, fallback):
+    """path of the lock file `name` of a dataset. Locks are kept within the
+    git directory of the dataset, which is not versioned, so that they do not
+    show up among the files of the dataset; datasets which are not git
+    repositories use `fallback` (relative to the root of the dataset) instead."""
+    git = os.path.join(dataset, '.git')
+
+    # .git is a file pointing to the git directory in worktrees and submodules
+    if os.path.isfile(git):
+        with open(git) as fp:
+            line = fp.readline().strip()
+        if line.startswith('gitdir:'):
+            git = os.path.join(dataset, line[len('gitdir:'):].strip())
+
+    if not os.path.isdir(git):
+        return os.path.join(dataset, fallback)
+
+    directory = os.path.join(git, 'childproject')
+    os.makedirs(directory, exist_ok = True)
+    return os.path.join(directory, name)
+
+@contextmanager
+def lock_file(path, shared = False, blocking = True):
+    """advisory lock held on `path` for the duration of the context.
+    POSIX record locks are used so that the lock also holds on NFS shares.
+
+    :param blocking: if False, raises OSError rather than waiting if the lock is held by another process
+    """
+    import fcntl
+
+    with open(path, 'a+') as fp:
+        fcntl.lockf(fp, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB))
+        try:
+            yield
+        finally:
+            fcntl.lockf(fp, fcntl.LOCK_UN)
+
+def write_dataframe(df, destination, **kwargs):
+    """atomically write df as csv to destination (temporary file + rename),
+    so that readers never see a partially written table."""
+    fd, tmp = tempfile.mkstemp(
+        dir = os.path.dirname(os.path.abspath(destination)),
+        prefix = '.' + os.path.basename(destination),
+        suffix = '.tmp'
+    )
+
+    # mkstemp creates files readable by the owner only
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(tmp, 0o666 & ~umask)
+
+    try:
+        with os.fdopen(fd, 'w') as fp:
+            df.to_csv(fp, **kwargs)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp, destination)
+    except:
+        os.remove(tmp)
+        raise
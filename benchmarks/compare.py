@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""compare two benchmark results produced by run.py
+
+e.g.: python benchmarks/compare.py before.json after.json
+"""
+import argparse
+import json
+import pandas as pd
+
+def load(filename):
+    results = json.load(open(filename, 'r'))
+    return pd.DataFrame(results['results']).set_index(['scale', 'benchmark'])['seconds'], results['revision']
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'compare two benchmark results')
+    parser.add_argument('reference', help = 'reference results (JSON)')
+    parser.add_argument('candidate', help = 'candidate results (JSON)')
+    args = parser.parse_args()
+
+    reference, reference_revision = load(args.reference)
+    candidate, candidate_revision = load(args.candidate)
+
+    comparison = pd.DataFrame({
+        'reference': reference,
+        'candidate': candidate
+    })
+    comparison['speedup'] = comparison['reference']/comparison['candidate']
+
+    print("reference: {}\ncandidate: {}\n".format(reference_revision, candidate_revision))
+    print(comparison.to_string(float_format = '{:.3f}'.format))
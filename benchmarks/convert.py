@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""compare the throughput of the conversion engines (ffmpeg and native) on
+synthetic projects of many short PCM WAV recordings, and save the results
+as JSON (comparable with compare.py).
+
+e.g.: python benchmarks/convert.py --scales 10,100 --duration 60 --output convert.json
+"""
+import argparse
+import datetime
+import json
+import numpy as np
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ChildProject.projects import ChildProject, RecordingProfile
+from ChildProject.audio import write_wav
+from ChildProject.parallel import Executor
+from generate import generate_project
+from run import git_revision
+
+def write_recordings(path, duration, sampling, channels, seed = 0):
+    """replace the placeholder recordings of the project with noise"""
+    rng = np.random.RandomState(seed)
+    project = ChildProject(path)
+    project.read()
+
+    for filename in project.recordings['filename'].tolist():
+        samples = (rng.uniform(-0.5, 0.5, (int(duration*sampling), channels))*32767).astype(np.int16)
+        write_wav(os.path.join(path, 'recordings', filename), samples, sampling)
+
+    return project.recordings.shape[0]
+
+def run_scale(path, scale, args):
+    results = []
+    generate_project(path, children = scale, recordings_per_child = 1, duration = args.duration, vtc_segments = 1, human_windows = 0)
+    recordings = write_recordings(path, args.duration, args.input_sampling, args.channels)
+
+    executor = Executor(args.backend, jobs = args.jobs)
+    project = ChildProject(path)
+
+    for engine in args.engines.split(','):
+        if engine == 'ffmpeg' and shutil.which('ffmpeg') is None:
+            print("ffmpeg is not available, skipping", file = sys.stderr)
+            continue
+
+        profile = RecordingProfile(engine, sampling = args.sampling, split = args.split, engine = engine)
+
+        start = time.perf_counter()
+        profile = project.convert_recordings(profile, executor = executor)
+        seconds = time.perf_counter() - start
+
+        if not profile.recordings['success'].all():
+            print("some conversions failed with engine '{}'".format(engine), file = sys.stderr)
+
+        results.append({
+            'scale': scale,
+            'benchmark': 'convert_{}'.format(engine),
+            'seconds': seconds,
+            'recordings': recordings,
+            'audio_seconds_per_second': recordings*args.duration/seconds
+        })
+        print("{:>8} {:<24} {:.3f}s ({:.0f}x real time)".format(scale, results[-1]['benchmark'], seconds, results[-1]['audio_seconds_per_second']), file = sys.stderr)
+
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'compare the throughput of the conversion engines')
+    parser.add_argument('--scales', help = 'comma-separated amounts of recordings', default = '10,100')
+    parser.add_argument('--duration', help = 'duration of each recording in seconds', type = float, default = 60)
+    parser.add_argument('--input-sampling', dest = 'input_sampling', help = 'sampling rate of the recordings', type = int, default = 44100)
+    parser.add_argument('--channels', help = 'channels of the recordings', type = int, default = 2)
+    parser.add_argument('--sampling', help = 'sampling rate of the converted recordings', type = int, default = 16000)
+    parser.add_argument('--split', help = 'split duration (e.g. 00:00:30)', default = None)
+    parser.add_argument('--engines', help = 'comma-separated engines to compare', default = 'ffmpeg,native')
+    parser.add_argument('--jobs', type = int, default = 0)
+    parser.add_argument('--backend', choices = Executor.BACKENDS, default = 'process')
+    parser.add_argument('--output', help = 'output JSON file', default = 'convert.json')
+    args = parser.parse_args()
+
+    results = []
+    for scale in [int(s) for s in args.scales.split(',')]:
+        workdir = tempfile.mkdtemp()
+        try:
+            results += run_scale(os.path.join(workdir, 'project_{}'.format(scale)), scale, args)
+        finally:
+            shutil.rmtree(workdir)
+
+    json.dump({
+        'revision': git_revision(),
+        'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'parameters': vars(args),
+        'results': results
+    }, open(args.output, 'w+'), indent = 2)
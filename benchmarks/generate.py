@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""generate a synthetic project of arbitrary size.
+
+Recordings are tiny placeholder WAV files with valid headers, and their
+'duration' column describes the day-long recordings they stand for.
+Each recording gets a VTC annotation (rttm) covering the whole recording,
+and human annotations (eaf, TextGrid) covering a few short windows.
+"""
+import argparse
+import datetime
+import numpy as np
+import os
+import pandas as pd
+import pympi
+import wave
+
+VTC_SPEAKERS = ['KCHI', 'CHI', 'FEM', 'MAL', 'SPEECH']
+HUMAN_TIERS = ['CHI', 'FA1', 'MA1', 'UC1']
+
+def write_placeholder_wav(path, sampling = 16000, duration = 0.1):
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sampling)
+        wav.writeframes(np.zeros(int(sampling*duration), dtype = np.int16).tobytes())
+
+def random_segments(rng, n, start, stop, min_duration = 0.2, max_duration = 3):
+    onsets = np.sort(rng.uniform(start, stop, n))
+    durations = rng.uniform(min_duration, max_duration, n)
+    return onsets, np.minimum(onsets + durations, stop)
+
+def non_overlapping_segments(rng, n, start, stop):
+    # n segments evenly spread over [start, stop], each within its own slot
+    bounds = np.linspace(start, stop, n + 1)
+    slot = bounds[1:] - bounds[:-1]
+    onsets = bounds[:-1] + rng.uniform(0, 0.5, n)*slot
+    offsets = onsets + rng.uniform(0.1, 0.5, n)*slot
+    return onsets, offsets
+
+def write_rttm(path, source, onsets, offsets, speakers):
+    with open(path, 'w') as f:
+        f.writelines(
+            "SPEAKER {} 1 {:.3f} {:.3f} <NA> <NA> {} <NA> <NA>\n".format(source, onset, offset - onset, speaker)
+            for onset, offset, speaker in zip(onsets, offsets, speakers)
+        )
+
+def write_eaf(path, rng, segments, start, stop):
+    eaf = pympi.Elan.Eaf()
+    for tier in HUMAN_TIERS:
+        eaf.add_tier(tier)
+        onsets, offsets = non_overlapping_segments(rng, segments, start, stop)
+        for onset, offset in zip(onsets, offsets):
+            eaf.add_annotation(tier, int(onset*1000), int(offset*1000), 'xxx')
+
+    eaf.to_file(path)
+
+def write_textgrid(path, rng, segments, start, stop):
+    textgrid = pympi.Praat.TextGrid(xmin = start, xmax = stop)
+    for tier in HUMAN_TIERS:
+        tier = textgrid.add_tier(tier)
+        onsets, offsets = non_overlapping_segments(rng, segments, start, stop)
+        for onset, offset in zip(onsets, offsets):
+            tier.add_interval(onset, offset, '1')
+
+    textgrid.to_file(path)
+
+def generate_project(path, children = 100, recordings_per_child = 2, duration = 16*3600,
+                     vtc_segments = 1000, human_windows = 2, window = 300, human_segments = 20, seed = 0):
+    """generate a project at path and return the annotations input dataframe"""
+    rng = np.random.RandomState(seed)
+
+    for folder in ['metadata', 'recordings', 'raw_annotations/vtc', 'raw_annotations/eaf', 'raw_annotations/textgrid', 'extra', 'annotations']:
+        os.makedirs(os.path.join(path, folder), exist_ok = True)
+
+    birth = datetime.date(2018, 1, 1)
+    pd.DataFrame([{
+        'experiment': 'synthetic',
+        'child_id': 'child{}'.format(i),
+        'child_dob': (birth + datetime.timedelta(days = int(rng.randint(0, 365)))).isoformat(),
+        'child_sex': 'f' if i % 2 else 'm'
+    } for i in range(children)]).to_csv(os.path.join(path, 'metadata/children.csv'), index = False)
+
+    recordings = []
+    for i in range(children):
+        for j in range(recordings_per_child):
+            recordings.append({
+                'experiment': 'synthetic',
+                'child_id': 'child{}'.format(i),
+                'date_iso': (birth + datetime.timedelta(days = 400 + 30*j)).isoformat(),
+                'start_time': '{}:{:02d}'.format(rng.randint(6, 10), rng.randint(0, 60)),
+                'recording_device_type': 'lena',
+                'filename': 'rec_{}_{}.wav'.format(i, j),
+                'duration': duration
+            })
+
+    recordings = pd.DataFrame(recordings)
+    recordings.to_csv(os.path.join(path, 'metadata/recordings.csv'), index = False)
+
+    annotations = []
+    for filename in recordings['filename'].tolist():
+        basename = os.path.splitext(filename)[0]
+        write_placeholder_wav(os.path.join(path, 'recordings', filename))
+
+        onsets, offsets = random_segments(rng, vtc_segments, 0, duration)
+        speakers = np.array(VTC_SPEAKERS)[rng.randint(0, len(VTC_SPEAKERS), vtc_segments)]
+        write_rttm(os.path.join(path, 'raw_annotations/vtc', basename + '.rttm'), basename, onsets, offsets, speakers)
+
+        annotations.append({
+            'set': 'vtc', 'recording_filename': filename, 'time_seek': 0,
+            'range_onset': 0, 'range_offset': duration,
+            'raw_filename': 'vtc/{}.rttm'.format(basename), 'format': 'vtc_rttm', 'filter': basename
+        })
+
+        starts = rng.choice(int(duration // window), human_windows, replace = False)*window
+        for k, start in enumerate(sorted(starts)):
+            write_eaf(os.path.join(path, 'raw_annotations/eaf', '{}_{}.eaf'.format(basename, k)), rng, human_segments, 0, window)
+            write_textgrid(os.path.join(path, 'raw_annotations/textgrid', '{}_{}.TextGrid'.format(basename, k)), rng, human_segments, 0, window)
+
+            for fmt, folder, extension in [('eaf', 'eaf', 'eaf'), ('TextGrid', 'textgrid', 'TextGrid')]:
+                annotations.append({
+                    'set': folder, 'recording_filename': filename, 'time_seek': int(start),
+                    'range_onset': 0, 'range_offset': window,
+                    'raw_filename': '{}/{}_{}.{}'.format(folder, basename, k, extension), 'format': fmt, 'filter': ''
+                })
+
+    annotations = pd.DataFrame(annotations)
+    annotations.to_csv(os.path.join(path, 'raw_annotations/input.csv'), index = False)
+
+    return annotations
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'generate a synthetic project')
+    parser.add_argument('destination', help = 'project path')
+    parser.add_argument('--children', type = int, default = 100)
+    parser.add_argument('--recordings-per-child', dest = 'recordings_per_child', type = int, default = 2)
+    parser.add_argument('--duration', help = 'duration of each recording in seconds', type = float, default = 16*3600)
+    parser.add_argument('--vtc-segments', dest = 'vtc_segments', help = 'VTC segments per recording', type = int, default = 1000)
+    parser.add_argument('--human-windows', dest = 'human_windows', help = 'human annotated windows per recording', type = int, default = 2)
+    parser.add_argument('--human-segments', dest = 'human_segments', help = 'segments per tier in each human annotated window', type = int, default = 20)
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args()
+
+    generate_project(
+        args.destination,
+        children = args.children,
+        recordings_per_child = args.recordings_per_child,
+        duration = args.duration,
+        vtc_segments = args.vtc_segments,
+        human_windows = args.human_windows,
+        human_segments = args.human_segments,
+        seed = args.seed
+    )
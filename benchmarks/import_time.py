@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""measure the startup time of the command line interface, and save the
+results as JSON. Fails if --max-seconds is exceeded.
+
+e.g.: python benchmarks/import_time.py --repeat 20 --output startup.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+CASES = {
+    'import_cmdline': "import ChildProject.cmdline",
+    'help': "import sys\nsys.argv = ['child-project', '--help']\nfrom ChildProject.cmdline import main\ntry:\n    main()\nexcept SystemExit:\n    pass",
+    'import_annotations': "import ChildProject.annotations",
+    'python': "pass"
+}
+
+def measure(code, repeat):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'), env.get('PYTHONPATH', '')])
+
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, '-c', code], env = env, stdout = subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+
+    return sorted(timings)[len(timings)//2]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'measure the startup time of the command line interface')
+    parser.add_argument('--repeat', type = int, default = 10)
+    parser.add_argument('--output', help = 'output JSON file', default = None)
+    parser.add_argument('--max-seconds', dest = 'max_seconds', help = "maximum median time of 'child-project --help'", type = float, default = None)
+    args = parser.parse_args()
+
+    results = {name: measure(code, args.repeat) for name, code in CASES.items()}
+
+    for name in results:
+        print("{:<24} {:.3f}s".format(name, results[name]))
+
+    if args.output:
+        json.dump({'repeat': args.repeat, 'median_seconds': results}, open(args.output, 'w+'), indent = 2)
+
+    if args.max_seconds is not None and results['help'] > args.max_seconds:
+        print("child-project --help took {:.3f}s, more than {:.3f}s".format(results['help'], args.max_seconds), file = sys.stderr)
+        sys.exit(1)
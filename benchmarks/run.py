@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""time the main entry points of the package on synthetic projects of
+increasing size, and save the results as JSON.
+
+e.g.: python benchmarks/run.py --scales 10,100,1000 --output results.json
+"""
+import argparse
+import datetime
+import json
+import os
+import pandas as pd
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ChildProject.projects import ChildProject
+from ChildProject.annotations import AnnotationManager
+from ChildProject.parallel import Executor
+from generate import generate_project
+
+def timed(results, scale, name, func):
+    start = time.perf_counter()
+    value = func()
+    results.append({
+        'scale': scale,
+        'benchmark': name,
+        'seconds': time.perf_counter() - start
+    })
+    print("{:>8} {:<24} {:.3f}s".format(scale, name, results[-1]['seconds']), file = sys.stderr)
+    return value
+
+def run_scale(path, scale, args):
+    results = []
+    generate_project(
+        path,
+        children = scale,
+        recordings_per_child = args.recordings_per_child,
+        vtc_segments = args.vtc_segments,
+        human_segments = args.human_segments
+    )
+
+    executor = Executor(args.backend, jobs = args.jobs)
+
+    project = ChildProject(path)
+    project.read()
+    timed(results, scale, 'tables_validate', lambda: (project.ct.validate(), project.rt.validate()))
+    timed(results, scale, 'validate_input_data', project.validate_input_data)
+
+    am = AnnotationManager(project)
+    input = pd.read_csv(os.path.join(path, 'raw_annotations/input.csv'))
+    timed(results, scale, 'import_annotations', lambda: am.import_annotations(input, executor = executor))
+    am.read()
+
+    timed(results, scale, 'annotations_validate', lambda: am.validate(executor = executor))
+
+    vtc = am.annotations[am.annotations['set'] == 'vtc']
+    segments = timed(results, scale, 'get_segments', lambda: am.get_segments(vtc, index_columns = ['recording_filename']))
+    am.segments_cache.invalidate()
+
+    timed(results, scale, 'intersection', lambda: am.intersection(
+        am.annotations[am.annotations['set'] == 'vtc'],
+        am.annotations[am.annotations['set'] == 'eaf']
+    ))
+
+    recording = segments['recording_filename'].iloc[0]
+    timed(results, scale, 'get_vc_stats', lambda: am.get_vc_stats(segments[segments['recording_filename'] == recording]))
+
+    for result in results:
+        result.update({
+            'children': scale,
+            'recordings': project.recordings.shape[0],
+            'segments': int(segments.shape[0])
+        })
+
+    return results
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd = os.path.dirname(os.path.abspath(__file__)),
+            stderr = subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'benchmark the package on synthetic projects')
+    parser.add_argument('--scales', help = 'comma-separated amounts of children', default = '10,100')
+    parser.add_argument('--recordings-per-child', dest = 'recordings_per_child', type = int, default = 2)
+    parser.add_argument('--vtc-segments', dest = 'vtc_segments', help = 'VTC segments per recording', type = int, default = 1000)
+    parser.add_argument('--human-segments', dest = 'human_segments', help = 'segments per tier in each human annotated window', type = int, default = 20)
+    parser.add_argument('--jobs', type = int, default = 0)
+    parser.add_argument('--backend', choices = Executor.BACKENDS, default = 'process')
+    parser.add_argument('--output', help = 'output JSON file', default = 'benchmarks.json')
+    parser.add_argument('--keep', help = 'keep generated projects in this directory', default = None)
+    args = parser.parse_args()
+
+    results = []
+    for scale in [int(s) for s in args.scales.split(',')]:
+        workdir = tempfile.mkdtemp() if args.keep is None else args.keep
+        path = os.path.join(workdir, 'project_{}'.format(scale))
+        try:
+            results += run_scale(path, scale, args)
+        finally:
+            if args.keep is None:
+                shutil.rmtree(workdir)
+
+    json.dump({
+        'revision': git_revision(),
+        'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'parameters': vars(args),
+        'results': results
+    }, open(args.output, 'w+'), indent = 2)
@@ -0,0 +1,20 @@
+from ChildProject.projects import ChildProject
+from ChildProject.annotations import AnnotationManager
+import pandas as pd
+import pytest
+import shutil
+
+@pytest.fixture(scope='function')
+def raw_project(tmp_path):
+    """copy of the example project, which tests may modify"""
+    path = str(tmp_path / 'project')
+    shutil.copytree('examples/valid_raw_data', path)
+    yield ChildProject(path)
+
+@pytest.fixture(scope='function')
+def annotated(raw_project):
+    """AnnotationManager of a copy of the example project, with every example annotation imported"""
+    am = AnnotationManager(raw_project)
+    am.import_annotations(pd.read_csv('examples/valid_raw_data/raw_annotations/input.csv'))
+    am.read()
+    yield am
@@ -0,0 +1,36 @@
+from ChildProject.agreement import Agreement, agreement_metrics, confusion_matrix
+from ChildProject.parallel import Executor
+import numpy as np
+import pandas as pd
+
+def test_metrics():
+    a = np.array([[1, 1, 0, 0], [0, 0, 1, 0]], dtype = np.int8)
+    b = np.array([[1, 0, 0, 0], [0, 1, 1, 0]], dtype = np.int8)
+
+    confusion = confusion_matrix(a, b)
+    np.testing.assert_array_equal(confusion, [[1, 1, 0], [0, 1, 0], [0, 0, 1]])
+
+    labels = ['CHI', 'FEM', 'none']
+    metrics, kappa = agreement_metrics(pd.DataFrame(confusion, index = labels, columns = labels))
+    np.testing.assert_allclose(metrics['precision'], [1, 0.5, 1])
+    np.testing.assert_allclose(metrics['recall'], [0.5, 1, 1])
+    assert np.isclose(kappa, (3/4 - (2*1 + 1*2 + 1*1)/16)/(1 - (2*1 + 1*2 + 1*1)/16))
+
+def test_agreement(annotated):
+    am = annotated
+    textgrid = am.annotations[am.annotations['set'] == 'textgrid']
+    eaf = am.annotations[am.annotations['set'] == 'eaf']
+
+    agreement = Agreement(am, resolution = 0.1)
+
+    confusion, pooled = agreement.compare(textgrid, textgrid, executor = Executor('serial'))
+    assert pooled.values.sum() > 0
+    assert (pooled.values == np.diag(np.diag(pooled.values))).all(), "a set should perfectly agree with itself"
+    metrics, kappa = agreement_metrics(pooled)
+    assert np.isclose(kappa, 1)
+
+    confusion, pooled = agreement.compare(textgrid, eaf, executor = Executor('process', jobs = 2))
+    assert list(confusion.keys()) == ['sound.wav']
+    pd.testing.assert_frame_equal(confusion['sound.wav'], pooled)
+    # the sets overlap over 10 seconds, i.e. 100 frames
+    assert pooled.values.sum() >= 100
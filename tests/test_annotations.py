@@ -1,8 +1,11 @@
 from ChildProject.projects import ChildProject, RecordingProfile
 from ChildProject.annotations import AnnotationManager
 from ChildProject.tables import IndexTable
+from ChildProject.cache import ValidationCache
+from ChildProject.parallel import Executor, Shard
 import pandas as pd
 import numpy as np
+import multiprocessing as mp
 import os
 import pytest
 import shutil
@@ -10,17 +13,9 @@ import subprocess
 import sys
 
 @pytest.fixture(scope='function')
-def project(request):
-    if not os.path.exists("output/annotations"):
-        project = ChildProject("examples/valid_raw_data")
-        project.import_data("output/annotations")
-
-    project = ChildProject("output/annotations")
-    yield project
-    
-    os.remove("output/annotations/metadata/annotations.csv")
-    shutil.rmtree("output/annotations/annotations")
-    os.mkdir("output/annotations/annotations")
+def project(tmp_path):
+    ChildProject("examples/valid_raw_data").import_data(str(tmp_path / 'annotations'))
+    yield ChildProject(str(tmp_path / 'annotations'))
 
 def test_import(project):
     am = AnnotationManager(project)
@@ -50,6 +45,200 @@ def test_import(project):
             check_less_precise = True
         )
 
+def test_validate(project):
+    am = AnnotationManager(project)
+    input_annotations = pd.read_csv('examples/valid_raw_data/raw_annotations/input.csv')
+
+    am.import_annotations(input_annotations[input_annotations['set'] == 'textgrid'])
+    imported = am.import_annotations(input_annotations[input_annotations['set'] == 'eaf'])
+
+    textgrid = am.annotations[am.annotations['set'] == 'textgrid']['annotation_filename'].iloc[0]
+    segments = pd.read_csv(os.path.join(project.path, 'annotations', textgrid))
+    segments['speaker_type'] = 'XXX'
+    segments.to_csv(os.path.join(project.path, 'annotations', textgrid), index = False)
+
+    errors, warnings = am.validate(imported)
+    assert len(errors) == 0, "only imported annotations should be validated"
+
+    errors, warnings = am.validate()
+    assert len(errors) > 0, "malformed annotations not detected"
+    assert all([error.startswith(textgrid + ': ') for error in errors]), "errors should refer to the file they were found in"
+
+def test_validate_cache(project, tmp_path, monkeypatch):
+    am = AnnotationManager(project)
+    input_annotations = pd.read_csv('examples/valid_raw_data/raw_annotations/input.csv')
+    am.import_annotations(input_annotations[input_annotations['set'].isin(['textgrid', 'eaf'])])
+    am.read()
+
+    cache = ValidationCache(str(tmp_path / 'cache'))
+    assert am.validate(cache = cache) == ([], [])
+
+    # valid files are not read again
+    with monkeypatch.context() as m:
+        m.setattr(IndexTable, 'read', None)
+        assert am.validate(cache = cache, executor = Executor('serial')) == ([], [])
+
+    textgrid = am.annotations[am.annotations['set'] == 'textgrid']['annotation_filename'].iloc[0]
+    segments = pd.read_csv(os.path.join(project.path, 'annotations', textgrid), keep_default_na = False)
+    speaker_type = segments.loc[0, 'speaker_type']
+    segments.loc[0, 'speaker_type'] = 'XXX'
+    segments.to_csv(os.path.join(project.path, 'annotations', textgrid), index = False)
+
+    errors, warnings = am.validate(cache = cache)
+    assert len(errors) > 0
+    assert (errors, warnings) == am.validate()
+
+    # warnings of files skipped thanks to the cache are reported again
+    segments.loc[0, 'speaker_type'] = speaker_type
+    segments['comment'] = 'x'
+    segments.to_csv(os.path.join(project.path, 'annotations', textgrid), index = False)
+
+    errors, warnings = am.validate(cache = cache)
+    assert len(errors) == 0 and len(warnings) == 1
+
+    with monkeypatch.context() as m:
+        m.setattr(IndexTable, 'read', None)
+        assert am.validate(cache = cache, executor = Executor('serial')) == (errors, warnings)
+
+def test_check_integrity(tmp_path):
+    path = str(tmp_path / 'project')
+    shutil.copytree('examples/valid_raw_data', path)
+
+    recordings = pd.read_csv(os.path.join(path, 'metadata/recordings.csv'))
+    recordings['duration'] = 100
+    recordings.to_csv(os.path.join(path, 'metadata/recordings.csv'), index = False)
+
+    am = AnnotationManager(ChildProject(path))
+    input_annotations = pd.read_csv('examples/valid_raw_data/raw_annotations/input.csv')
+    am.import_annotations(input_annotations[input_annotations['set'].isin(['textgrid', 'vtc_rttm'])])
+    am.read()
+
+    errors, warnings = am.check_integrity()
+    assert errors == ["annotation on line 3 covers [1980.000, 1990.000] which exceeds the range of recording 'sound.wav' [0, 100.000]"]
+
+    errors, warnings = am.validate(executor = Executor('serial'))
+    assert errors == [
+        "vtc_rttm/sound_0_1980.csv: 5 segment(s) exceed the range of recording 'sound.wav' [0, 100.000], e.g. [1982.193, 1982.492]",
+        "annotation on line 3 covers [1980.000, 1990.000] which exceeds the range of recording 'sound.wav' [0, 100.000]"
+    ]
+
+    annotations = am.annotations.copy()
+    annotations['recording_filename'] = ['sound.wav', 'missing.wav']
+    errors, warnings = am.check_integrity(annotations)
+    assert errors == ["recording_filename 'missing.wav' in annotations on line 3 cannot be found in the recordings table."]
+
+    # missing segment files are reported rather than raised
+    os.remove(os.path.join(path, 'annotations', am.annotations['annotation_filename'].iloc[1]))
+    errors, warnings = am.validate(executor = Executor('serial'))
+    assert len(errors) == 2 and errors[0].startswith(am.annotations['annotation_filename'].iloc[1] + ': ')
+
+def test_get_segments_filters(project):
+    am = AnnotationManager(project)
+    am.import_annotations(pd.read_csv('examples/valid_raw_data/raw_annotations/input.csv'))
+    am.read()
+
+    annotations = am.annotations[am.annotations['set'] == 'vtc_rttm']
+    segments = am.get_segments(annotations)
+    assert set(annotations.columns) <= set(segments.columns), "every index column is attached by default"
+    assert (segments['set'] == 'vtc_rttm').all()
+
+    truth = segments[
+        segments['speaker_type'].isin(['CHI', 'FEM']) &
+        (segments['segment_offset'] > 1982) &
+        (segments['segment_onset'] < 1988)
+    ]
+
+    filtered = am.get_segments(
+        annotations,
+        columns = ['segment_onset', 'segment_offset'],
+        speaker_types = ['CHI', 'FEM'],
+        onset = 1982,
+        offset = 1988,
+        index_columns = ['set']
+    )
+
+    assert filtered.columns.tolist() == ['segment_onset', 'segment_offset', 'annotation_filename', 'set']
+    assert (filtered['annotation_filename'].cat.codes == 0).all()
+    pd.testing.assert_frame_equal(
+        filtered[['segment_onset', 'segment_offset', 'set']].reset_index(drop = True),
+        truth[['segment_onset', 'segment_offset', 'set']].reset_index(drop = True)
+    )
+
+def test_segments_cache(project):
+    am = AnnotationManager(project)
+    am.import_annotations(pd.read_csv('examples/valid_raw_data/raw_annotations/input.csv'))
+    am.read()
+
+    annotations = am.annotations[am.annotations['set'].isin(['eaf', 'textgrid'])]
+    first = am.get_segments(annotations)
+    second = am.get_segments(annotations, columns = ['segment_onset', 'speaker_type'])
+    am.get_segments(annotations, columns = ['speaker_type', 'segment_onset'])
+
+    stats = am.segments_cache.stats()
+    assert stats['misses'] == 4 and stats['hits'] == 2, "unexpected cache statistics {}".format(stats)
+    pd.testing.assert_frame_equal(first[second.columns], second)
+
+    am.remove_set('eaf')
+    assert am.segments_cache.stats()['entries'] == 2, "removed set was not invalidated"
+
+    am = AnnotationManager(project, cache_size = 1)
+    am.get_segments(annotations[annotations['set'] == 'textgrid'])
+    assert am.segments_cache.stats()['entries'] == 0, "cache exceeds its memory budget"
+
+def import_row(path, row):
+    am = AnnotationManager(ChildProject(path))
+    am.import_annotations(pd.DataFrame([row]))
+
+def test_concurrent_import(project):
+    input_annotations = pd.read_csv('examples/valid_raw_data/raw_annotations/input.csv')
+
+    processes = [
+        mp.Process(target = import_row, args = (project.path, row))
+        for row in input_annotations.to_dict(orient = 'records')
+    ]
+
+    for p in processes:
+        p.start()
+
+    for p in processes:
+        p.join()
+
+    am = AnnotationManager(project)
+    assert sorted(am.annotations['set'].tolist()) == sorted(input_annotations['set'].tolist()), "concurrent importations overwrote each other"
+
+def test_lock_location(project):
+    # locks are kept out of the files of git datasets
+    os.mkdir(os.path.join(project.path, '.git'))
+    am = AnnotationManager(project)
+    am.import_annotations(pd.read_csv('examples/valid_raw_data/raw_annotations/input.csv').head(1))
+
+    assert am.lock_path == os.path.join(project.path, '.git', 'childproject', 'annotations.lock')
+    assert os.path.exists(am.lock_path)
+    assert not os.path.exists(os.path.join(project.path, 'metadata/.annotations.lock'))
+
+def import_shard(path, index, count, claims):
+    am = AnnotationManager(ChildProject(path))
+    input_annotations = pd.read_csv('examples/valid_raw_data/raw_annotations/input.csv')
+    am.import_annotations(input_annotations, executor = Executor('serial'), shard = Shard(index, count, claims))
+
+def test_sharded_import(project, tmp_path):
+    input_annotations = pd.read_csv('examples/valid_raw_data/raw_annotations/input.csv')
+
+    processes = [
+        mp.Process(target = import_shard, args = (project.path, index, 3, str(tmp_path / 'claims')))
+        for index in range(1, 4)
+    ]
+
+    for p in processes:
+        p.start()
+
+    for p in processes:
+        p.join()
+
+    am = AnnotationManager(project)
+    assert sorted(am.annotations['raw_filename'].tolist()) == sorted(input_annotations['raw_filename'].tolist()), "each annotation should be imported exactly once"
+    assert am.annotations['annotation_filename'].notnull().all()
+
 def test_intersect(project):
     am = AnnotationManager(project)
 
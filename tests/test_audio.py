@@ -0,0 +1,110 @@
+from ChildProject.projects import ChildProject
+from ChildProject.audio import WavFile, ConvertedRecording, write_wav, to_float, convert_wav, extract_clips, sliding_windows
+import numpy as np
+import os
+import pandas as pd
+import pytest
+import shutil
+import wave
+
+def read_wave(path):
+    with wave.open(path) as f:
+        return np.frombuffer(f.readframes(f.getnframes()), dtype = np.int16), f.getframerate()
+
+def test_wav_file(tmp_path):
+    samples, rate = read_wave('examples/valid_raw_data/recordings/sound.wav')
+
+    wav = WavFile('examples/valid_raw_data/recordings/sound.wav')
+    assert wav.sample_rate == rate
+    assert wav.frames == len(samples)
+    np.testing.assert_array_equal(wav.read(1, 2)[:, 0], samples[rate:2*rate])
+
+    write_wav(str(tmp_path / 'copy.wav'), wav.samples, wav.sample_rate)
+    copy, copy_rate = read_wave(str(tmp_path / 'copy.wav'))
+    assert copy_rate == rate
+    np.testing.assert_array_equal(copy, samples)
+
+def test_extract_clips(tmp_path):
+    path = str(tmp_path / 'project')
+    shutil.copytree('examples/valid_raw_data', path)
+    project = ChildProject(path)
+
+    samples, rate = read_wave('examples/valid_raw_data/recordings/sound.wav')
+
+    # split the recording into pieces of 1.5 seconds, as ffmpeg would
+    converted = os.path.join(path, 'converted_recordings', 'split')
+    os.makedirs(converted)
+
+    piece = int(1.5*rate)
+    pieces = []
+    for i in range(0, len(samples), piece):
+        pieces.append('sound.{:03d}.wav'.format(i//piece))
+        write_wav(os.path.join(converted, pieces[-1]), samples[i:i+piece], rate)
+
+    pd.DataFrame({
+        'original_filename': 'sound.wav',
+        'converted_filename': pieces[::-1],
+        'success': True
+    }).to_csv(os.path.join(converted, 'recordings.csv'), index = False)
+
+    clips = pd.DataFrame([
+        {'recording_filename': 'sound.wav', 'onset': 0.5, 'offset': 1},
+        {'recording_filename': 'sound.wav', 'onset': 1, 'offset': 3.75},
+        {'recording_filename': 'sound.wav', 'onset': 3, 'offset': 10},
+        {'recording_filename': 'sound.wav', 'onset': 10, 'offset': 11},
+        {'recording_filename': 'missing.wav', 'onset': 0, 'offset': 1}
+    ])
+
+    destination = str(tmp_path / 'clips')
+    clips = extract_clips(project, 'split', clips, destination)
+
+    assert clips['success'].tolist() == [True, True, True, False, False]
+    assert clips['clip_filename'].iloc[1] == 'sound_1000_3750.wav'
+
+    for clip in clips[clips['success']].to_dict(orient = 'records'):
+        extracted, extracted_rate = read_wave(os.path.join(destination, clip['clip_filename']))
+        assert extracted_rate == rate
+        np.testing.assert_array_equal(extracted, samples[int(clip['onset']*rate):int(clip['offset']*rate)])
+
+def test_split_onsets(tmp_path):
+    samples, rate = read_wave('examples/valid_raw_data/recordings/sound.wav')
+
+    # pieces of 1.5 seconds, whose last samples overlap with the next piece
+    piece = int(1.5*rate)
+    files, onsets = [], []
+    for i in range(0, len(samples), piece):
+        files.append(str(tmp_path / 'sound.{:03d}.wav'.format(i//piece)))
+        onsets.append(i/rate)
+        write_wav(files[-1], samples[i:i+piece+100], rate)
+
+    recording = ConvertedRecording(files, onsets)
+    assert recording.starts[-1] == len(samples)
+    np.testing.assert_array_equal(recording.read(1, 3.5)[:, 0], samples[rate:int(3.5*rate)])
+
+    assert recording.locate(0.5) == (files[0], 0.5)
+    assert recording.locate(3.25) == (files[2], 0.25)
+
+def test_convert_wav(tmp_path):
+    # 2 seconds of a 440 Hz stereo tone at 44.1 kHz
+    t = np.arange(2*44100)/44100
+    tone = 0.5*np.sin(2*np.pi*440*t)
+    write_wav(str(tmp_path / 'tone.wav'), (np.stack([tone, tone], axis = 1)*32767).astype(np.int16), 44100)
+
+    pieces = convert_wav(str(tmp_path / 'tone.wav'), str(tmp_path / 'tone.%03d.wav'), 16000, split = '00:00:01', block = 777)
+    assert [(os.path.basename(f), onset, offset) for f, onset, offset in pieces] == [('tone.000.wav', 0, 1), ('tone.001.wav', 1, 2)]
+
+    converted = ConvertedRecording([f for f, onset, offset in pieces], [onset for f, onset, offset in pieces])
+    assert converted.sample_rate == 16000 and converted.channels == 1
+
+    samples = to_float(converted.read(0.1, 1.9)[:, 0])
+    expected = 0.5*np.sin(2*np.pi*440*np.arange(int(0.1*16000), int(1.9*16000))/16000)
+    np.testing.assert_allclose(samples, expected, atol = 1e-3)
+
+    with pytest.raises(ValueError):
+        convert_wav(str(tmp_path / 'tone.wav'), str(tmp_path / 'tone.flac'), 16000, codec = 'flac')
+
+def test_sliding_windows():
+    x = np.arange(6, dtype = float)
+    np.testing.assert_array_equal(sliding_windows(x, 3), x[np.arange(4)[:, None] + np.arange(3)])
+    assert sliding_windows(x[::2], 2).tolist() == [[0, 2], [2, 4]]
+    assert sliding_windows(x[:2], 3).shape == (0, 3)
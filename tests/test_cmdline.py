@@ -0,0 +1,26 @@
+import subprocess
+import sys
+
+def imported_modules(code):
+    return subprocess.check_output([
+        sys.executable, '-c',
+        code + "\nimport sys\nprint(','.join(sys.modules.keys()))"
+    ]).decode().strip().split('\n')[-1].split(',')
+
+def test_lightweight_startup():
+    modules = imported_modules("import ChildProject.cmdline")
+    heavy = [m for m in ['pandas', 'numpy', 'pympi'] if m in modules]
+    assert not heavy, "importing the command line interface loads {}".format(','.join(heavy))
+
+    modules = imported_modules("import sys\nsys.argv = ['child-project', '--help']\nfrom ChildProject.cmdline import main\ntry:\n    main()\nexcept SystemExit:\n    pass")
+    heavy = [m for m in ['pandas', 'numpy', 'pympi'] if m in modules]
+    assert not heavy, "child-project --help loads {}".format(','.join(heavy))
+
+def test_invoked_command():
+    from ChildProject.cmdline import invoked_command
+
+    assert invoked_command(['validate', 'examples/valid_raw_data']) == 'validate'
+    assert invoked_command(['--profile-output', 'validate', 'stats', 'examples/valid_raw_data']) == 'stats', "option values are not commands"
+    assert invoked_command(['--profile', 'extract-clips', 'path', '--recording-profile', 'convert']) == 'extract-clips'
+    assert invoked_command(['--help']) is None
+    assert invoked_command(['path']) is None
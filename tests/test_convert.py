@@ -1,7 +1,12 @@
 from ChildProject.projects import ChildProject, RecordingProfile
+from ChildProject.audio import ConvertedRecordings, WavFile
+from ChildProject.cache import ConversionCache
+import multiprocessing as mp
 import numpy as np
 import os
 import pandas
+import pytest
+import shutil
 
 def test_convert():
     project = ChildProject("examples/valid_raw_data")
@@ -22,5 +27,140 @@ def test_convert():
         os.path.exists(os.path.join("output/convert/converted_recordings/test", f))
         for f in converted_recordings['converted_filename'].tolist()
     ]), "recording files are missing"
+    assert (converted_recordings['onset'] == 0).all()
+    assert np.allclose(converted_recordings['offset'], 4, atol = 0.05), "unsplit recordings should span the whole recording"
 
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason = 'ffmpeg is required')
+def test_split(tmp_path):
+    project = ChildProject("examples/valid_raw_data")
+    project.import_data(str(tmp_path / 'project'))
+    project = ChildProject(str(tmp_path / 'project'))
+    profile = project.convert_recordings(RecordingProfile(
+        name = 'split',
+        split = '00:00:01'
+    ))
+
+    converted_recordings = profile.recordings
+    assert converted_recordings['success'].all(), "not all recordings were successfully converted"
+    assert converted_recordings['converted_filename'].tolist() == ['sound.{:03d}.wav'.format(i) for i in range(4)]
+    assert np.allclose(converted_recordings['onset'], [0, 1, 2, 3], atol = 0.05), "pieces onsets do not match the split duration"
+    assert np.allclose(converted_recordings['offset'].values[:-1], converted_recordings['onset'].values[1:])
+    assert not any(f.endswith('.segments.csv') for f in os.listdir(str(tmp_path / 'project/converted_recordings/split'))), "segment lists were not cleaned up"
+
+def test_native(tmp_path):
+    project = ChildProject("examples/valid_raw_data")
+    project.import_data(str(tmp_path / 'project'))
+    project = ChildProject(str(tmp_path / 'project'))
+    profile = project.convert_recordings(RecordingProfile(
+        name = 'native',
+        split = '00:00:01',
+        engine = 'native'
+    ))
+
+    converted_recordings = profile.recordings
+    assert converted_recordings['success'].all(), "not all recordings were successfully converted"
+    assert converted_recordings['converted_filename'].tolist() == ['sound.{:03d}.wav'.format(i) for i in range(4)]
+    assert converted_recordings['onset'].tolist() == [0, 1, 2, 3]
+
+    original = WavFile(str(tmp_path / 'project/recordings/sound.wav'))
+    recording = ConvertedRecordings(project, 'native').open('sound.wav')
+    assert recording.sample_rate == 16000
+    assert recording.duration == original.duration
+
+    profile = project.convert_recordings(RecordingProfile(name = 'unsplit', engine = 'native'))
+    assert profile.recordings['onset'].tolist() == [0]
+    assert profile.recordings['offset'].tolist() == [original.duration]
+
+    with pytest.raises(ValueError):
+        RecordingProfile(name = 'invalid', engine = 'sox')
+
+def cached_project(tmp_path, recordings = 3):
+    path = str(tmp_path / 'project')
+    shutil.copytree('examples/valid_raw_data', path)
+
+    metadata = pandas.read_csv(os.path.join(path, 'metadata/recordings.csv'))
+    metadata = pandas.concat([metadata]*recordings, ignore_index = True)
+    metadata['filename'] = ['sound{}.wav'.format(i) for i in range(recordings)]
+    metadata.to_csv(os.path.join(path, 'metadata/recordings.csv'), index = False)
+
+    for filename in metadata['filename']:
+        shutil.copy(os.path.join(path, 'recordings/sound.wav'), os.path.join(path, 'recordings', filename))
+
+    project = ChildProject(path)
+    project.read()
+    return project
+
+def cache_get(path, directory):
+    project = ChildProject(path)
+    cache = ConversionCache(project, directory)
+    profile = RecordingProfile('native', engine = 'native')
+    return [cache.get(filename, profile) for filename in project.recordings['filename']]
+
+def test_conversion_cache(tmp_path):
+    project = cached_project(tmp_path)
+    profile = RecordingProfile('native', engine = 'native')
+
+    # each converted recording is 128044 bytes long, only two fit in the budget
+    cache = ConversionCache(project, str(tmp_path / 'cache'), budget = 300000)
+    first = cache.get('sound0.wav', profile)
+    assert len(first) == 1 and WavFile(first[0]).sample_rate == 16000
+
+    mtime = os.path.getmtime(first[0])
+    assert cache.get('sound0.wav', profile) == first
+    assert os.path.getmtime(first[0]) == mtime, "cached recordings should not be converted again"
+
+    with cache.use('sound1.wav', profile) as second:
+        cache.get('sound0.wav', profile)
+        cache.get('sound2.wav', profile)
+        assert os.path.exists(second[0]), "recordings in use should not be evicted"
+
+    assert not os.path.exists(first[0]), "the least recently used recording should be evicted"
+    assert cache.size() <= 300000
+
+    # another profile does not share the converted files
+    assert cache.open('sound2.wav', RecordingProfile('native', sampling = 8000, engine = 'native')).sample_rate == 8000
+
+    with pytest.raises(ValueError):
+        cache.get('missing.wav', profile)
+
+def test_conversion_cache_eviction_race(tmp_path, monkeypatch):
+    project = cached_project(tmp_path)
+    profile = RecordingProfile('native', engine = 'native')
+    cache = ConversionCache(project, str(tmp_path / 'cache'))
+    cache.get('sound0.wav', profile)
+
+    # the entry is evicted by another process right after it is loaded
+    load = cache.load
+    def evicted(entry_path):
+        entry = load(entry_path)
+        if os.path.exists(entry_path):
+            os.remove(entry_path)
+        return entry
+
+    monkeypatch.setattr(cache, 'load', evicted)
+    assert cache.lookup('sound0.wav', profile) is None
+
+    monkeypatch.undo()
+    files = cache.get('sound0.wav', profile)
+    assert os.path.exists(files[0]), "evicted recordings should be converted again"
+
+def test_concurrent_conversion_cache(tmp_path):
+    project = cached_project(tmp_path)
+    directory = str(tmp_path / 'cache')
+
+    processes = [
+        mp.Process(target = cache_get, args = (project.path, directory))
+        for i in range(4)
+    ]
+
+    for p in processes:
+        p.start()
+
+    for p in processes:
+        p.join()
+
+    assert all(p.exitcode == 0 for p in processes)
 
+    cache = ConversionCache(project, directory)
+    assert len(cache.entries()) == 3
+    assert all(WavFile(f[0]).frames == 4*16000 for f in cache_get(project.path, directory))
@@ -0,0 +1,44 @@
+from ChildProject.projects import ChildProject
+from ChildProject.audio import write_wav
+from ChildProject.features import attach_features
+from ChildProject.parallel import Executor
+import numpy as np
+import os
+import pandas as pd
+import shutil
+
+def test_attach_features(tmp_path):
+    path = str(tmp_path / 'project')
+    shutil.copytree('examples/valid_raw_data', path)
+    project = ChildProject(path)
+
+    # a 440 Hz tone between 1 and 2 seconds over a much quieter background
+    rate = 16000
+    t = np.arange(4*rate)/rate
+    signal = 0.01*np.sin(2*np.pi*50*t)
+    signal[rate:2*rate] = 0.5*np.sin(2*np.pi*440*t[rate:2*rate])
+
+    # split in two pieces
+    converted = os.path.join(path, 'converted_recordings', 'test')
+    os.makedirs(converted)
+    write_wav(os.path.join(converted, 'sound.000.wav'), (signal[:int(1.5*rate)]*32767).astype(np.int16), rate)
+    write_wav(os.path.join(converted, 'sound.001.wav'), (signal[int(1.5*rate):]*32767).astype(np.int16), rate)
+    pd.DataFrame({
+        'original_filename': 'sound.wav',
+        'converted_filename': ['sound.000.wav', 'sound.001.wav'],
+        'success': True
+    }).to_csv(os.path.join(converted, 'recordings.csv'), index = False)
+
+    segments = pd.DataFrame([
+        {'recording_filename': 'sound.wav', 'time_seek': 0, 'segment_onset': 1, 'segment_offset': 2},
+        {'recording_filename': 'sound.wav', 'time_seek': 1, 'segment_onset': 0, 'segment_offset': 1},
+        {'recording_filename': 'sound.wav', 'time_seek': 0, 'segment_onset': 3, 'segment_offset': 3}
+    ])
+
+    for executor in [Executor('serial'), Executor('process', jobs = 2)]:
+        features = attach_features(project, 'test', segments, block_frames = 7, executor = executor)
+
+        np.testing.assert_allclose(features['rms_db'].iloc[:2], 20*np.log10(0.5/np.sqrt(2)), atol = 0.01)
+        np.testing.assert_allclose(features['peak_db'].iloc[:2], 20*np.log10(0.5), atol = 0.01)
+        np.testing.assert_allclose(features['snr_db'].iloc[:2], 20*np.log10(0.5/0.01), atol = 0.1)
+        assert features.iloc[2][['rms_db', 'peak_db', 'snr_db']].isnull().all()
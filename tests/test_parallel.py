@@ -0,0 +1,181 @@
+from ChildProject.parallel import Executor, Prefetcher, Shard
+import multiprocessing as mp
+import os
+import pytest
+import shutil
+import threading
+
+def square(x):
+    return x*x
+
+def read_int(path):
+    with open(path) as f:
+        return int(f.read())
+
+def crash(x):
+    os._exit(1)
+
+def run_shard(claims, func, item):
+    Shard(1, 1, claims, timeout = 1).run(str, func, item)
+
+@pytest.mark.parametrize('backend', Executor.BACKENDS)
+def test_map(backend):
+    progress = []
+    executor = Executor(backend, jobs = 2, chunksize = 3, progress = lambda done, total: progress.append((done, total)))
+
+    assert executor.map(square, range(10)) == [x*x for x in range(10)], "results do not match inputs"
+    assert progress == [(i+1, 10) for i in range(10)], "progress was not reported for each task"
+
+def test_default_chunksize():
+    executor = Executor('process', jobs = 4)
+    assert executor.chunksize is None
+    assert executor.default_chunksize(100) == 7, "tasks should be split into 4 chunks per worker"
+    assert executor.default_chunksize(2) == 1
+    assert executor.map(square, range(10)) == [x*x for x in range(10)]
+
+def test_invalid_backend():
+    with pytest.raises(ValueError):
+        Executor('gpu')
+
+def annex(path, sibling):
+    """turn the file at path into a git-annex symlink whose content is
+    stored in the sibling directory, as after a datalad clone"""
+    key = 'MD5E-s{}--{}{}'.format(os.path.getsize(path), os.path.basename(path).replace('.', ''), os.path.splitext(path)[1])
+    os.makedirs(sibling, exist_ok = True)
+    shutil.move(path, os.path.join(sibling, key))
+    os.symlink(os.path.join('.git/annex/objects', key, key), path)
+    return key
+
+def fetch_from(sibling, log):
+    def fetch(paths):
+        for path in paths:
+            target = os.path.join(os.path.dirname(path), os.readlink(path))
+            os.makedirs(os.path.dirname(target), exist_ok = True)
+            shutil.copy(os.path.join(sibling, os.path.basename(target)), target)
+            log.append(('get', os.path.basename(path)))
+    return fetch
+
+def drop_content(log):
+    def drop(paths):
+        for path in paths:
+            os.remove(os.path.realpath(path))
+            log.append(('drop', os.path.basename(path)))
+    return drop
+
+def test_prefetch(tmp_path):
+    files = []
+    for i in range(5):
+        path = str(tmp_path / 'file{}.txt'.format(i))
+        with open(path, 'w+') as f:
+            f.write(str(i*i))
+        annex(path, str(tmp_path / 'sibling'))
+        files.append(path)
+
+    log = []
+    overlap = threading.Event()
+    def process(path):
+        # the next chunk is retrieved while the current one is processed
+        if os.path.basename(path) == 'file1.txt':
+            assert overlap.wait(10), "retrieval did not overlap with processing"
+
+        log.append(('process', os.path.basename(path)))
+        with open(path) as f:
+            return int(f.read())
+
+    def fetch(paths):
+        fetch_from(str(tmp_path / 'sibling'), log)(paths)
+        if ('get', 'file2.txt') in log:
+            overlap.set()
+
+    prefetcher = Prefetcher(fetch = fetch, drop = drop_content(log), ahead = 2, jobs = 1)
+    results = prefetcher.map(Executor('serial'), process, files, inputs = lambda path: [path], succeeded = lambda result: result != 9)
+
+    assert results == [i*i for i in range(5)]
+    assert all(os.path.exists(path) == (i == 3) for i, path in enumerate(files)), "only the content of successful tasks should be dropped"
+    assert log.index(('get', 'file4.txt')) > log.index(('drop', 'file0.txt')), "retrieval should not run more than one chunk ahead"
+
+@pytest.mark.parametrize('backend', ['thread', 'process'])
+def test_prefetch_pool(tmp_path, monkeypatch, backend):
+    import concurrent.futures
+
+    files = []
+    for i in range(6):
+        path = str(tmp_path / 'file{}.txt'.format(i))
+        with open(path, 'w+') as f:
+            f.write(str(i*i))
+        annex(path, str(tmp_path / 'sibling'))
+        files.append(path)
+
+    # a single pool of workers is used for the whole run
+    pools = []
+    pool_class = getattr(concurrent.futures, 'ProcessPoolExecutor' if backend == 'process' else 'ThreadPoolExecutor')
+    def counted(*args, **kwargs):
+        pools.append(kwargs.get('max_workers'))
+        return pool_class(*args, **kwargs)
+    monkeypatch.setattr(concurrent.futures, pool_class.__name__, counted)
+
+    log = []
+    progress = []
+    executor = Executor(backend, jobs = 2, progress = lambda done, total: progress.append((done, total)))
+    prefetcher = Prefetcher(fetch = fetch_from(str(tmp_path / 'sibling'), log), drop = drop_content(log), ahead = 1, jobs = 1)
+    results = prefetcher.map(executor, read_int, files, inputs = lambda path: [path])
+
+    assert results == [i*i for i in range(6)]
+    assert progress == [(i+1, 6) for i in range(6)]
+    # retrieval threads come from a second thread pool
+    assert len(pools) == (2 if backend == 'thread' else 1), "workers should be started once"
+    assert not any(os.path.exists(path) for path in files), "the content of every input should be dropped"
+    assert sorted(log) == sorted([('get', os.path.basename(path)) for path in files] + [('drop', os.path.basename(path)) for path in files])
+
+def test_shard(tmp_path):
+    keys = ['recording{}.wav'.format(i) for i in range(100)]
+    shards = [Shard.parse('{}/4'.format(i)).tasks(keys, key = str) for i in range(1, 5)]
+    assert sorted(sum(shards, [])) == sorted(keys), "shards should partition the tasks"
+
+    with pytest.raises(ValueError):
+        Shard.parse('0/4')
+
+    # with a queue, shards take over the tasks left by the others
+    claims = str(tmp_path / 'claims')
+    first = Shard(1, 2, claims)
+    own = Shard(1, 2).tasks(keys, key = str)
+    assert first.tasks(keys, key = str) == own + [k for k in keys if k not in own], "shards should start with their own tasks"
+
+    assert [first.run(str, square, i) for i in range(10)] == [i*i for i in range(10)]
+    second = Shard(2, 2, claims)
+    assert [second.run(str, square, i) for i in range(12)] == [None]*10 + [100, 121], "claimed tasks should not run twice"
+
+def test_shard_crash_recovery(tmp_path):
+    claims = str(tmp_path / 'claims')
+
+    # the process running the task crashes before it completes
+    process = mp.Process(target = run_shard, args = (claims, crash, 3))
+    process.start()
+    process.join()
+    assert process.exitcode == 1
+
+    shard = Shard(1, 1, claims, timeout = 1)
+    assert shard.run(str, square, 3) is None, "the claim should not expire before the timeout"
+
+    past = os.path.getmtime(shard.claim_path('3')) - 2
+    os.utime(shard.claim_path('3'), (past, past))
+    assert shard.run(str, square, 3) == 9, "expired claims should be taken over"
+
+    # completed tasks are never run again
+    os.utime(shard.claim_path('3'), (past, past))
+    assert shard.run(str, square, 3) is None
+
+    # claims are kept alive while their task runs
+    started, release = threading.Event(), threading.Event()
+    def slow(x):
+        started.set()
+        release.wait()
+        return x
+
+    thread = threading.Thread(target = Shard(1, 1, claims, timeout = 0.2).run, args = (str, slow, 4))
+    thread.start()
+    started.wait()
+    threading.Event().wait(0.5)
+    assert Shard(1, 1, claims, timeout = 0.2).run(str, square, 4) is None, "running tasks should not be taken over"
+    release.set()
+    thread.join()
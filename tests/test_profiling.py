@@ -0,0 +1,37 @@
+from ChildProject import profiling
+from ChildProject.parallel import Executor
+import json
+
+@profiling.timed('square')
+def square(x):
+    profiling.count('squares')
+    return x*x
+
+def test_disabled():
+    profiling.disable()
+    profiling.reset()
+
+    with profiling.span('phase'):
+        square(2)
+
+    phases, counters = profiling.summary()
+    assert phases == [] and counters == {}, "nothing should be recorded while profiling is disabled"
+
+def test_process_spans(tmp_path):
+    profiling.enable()
+    try:
+        with profiling.span('total'):
+            assert Executor('process', jobs = 2).map(square, range(4)) == [0, 1, 4, 9]
+    finally:
+        profiling.disable()
+
+    phases, counters = profiling.summary()
+    phases = {phase['name']: phase for phase in phases}
+
+    assert phases['total']['calls'] == 1
+    assert phases['square']['calls'] == 4, "spans from worker processes are missing"
+    assert counters['squares'] == 4, "counters from worker processes are missing"
+
+    profiling.dump(str(tmp_path / 'trace.json'))
+    trace = json.load(open(str(tmp_path / 'trace.json')))
+    assert len(trace['traceEvents']) == 5
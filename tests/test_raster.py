@@ -0,0 +1,49 @@
+from ChildProject.annotations import AnnotationManager
+from ChildProject.raster import rasterize, to_bitmask, Rasterizer
+import numpy as np
+import pandas as pd
+import pytest
+
+def test_rasterize():
+    frames = rasterize(
+        onsets = [0.1, 0.15, 0.5, 0.8],
+        offsets = [0.3, 0.2, 0.7, 0.9],
+        labels = ['CHI', 'CHI', 'FEM', 'XXX'],
+        categories = ['CHI', 'FEM'],
+        first_frame = 0,
+        n_frames = 10,
+        resolution = 0.1
+    )
+
+    np.testing.assert_array_equal(frames, np.array([
+        [0, 1, 1, 0, 0, 0, 0, 0, 0, 0],
+        [0, 0, 0, 0, 0, 1, 1, 0, 0, 0]
+    ], dtype = np.int8))
+
+    np.testing.assert_array_equal(to_bitmask(frames), [0, 1, 1, 0, 0, 2, 2, 0, 0, 0])
+
+def test_rasterizer(annotated, tmp_path):
+    am = annotated
+    annotations = am.annotations[am.annotations['set'] == 'vtc_rttm']
+    segments = am.get_segments(annotations)
+
+    for cache_dir in [None, str(tmp_path / 'cache'), str(tmp_path / 'cache')]:
+        rasterizer = Rasterizer(am, resolution = 0.01, cache_dir = cache_dir)
+        frames, covered = rasterizer.rasterize(annotations, 1970, 2000)
+
+        assert frames.shape == (len(rasterizer.categories), 3000)
+        assert covered.sum() == 1000, "only the annotated range [1980, 1990] should be covered"
+
+        chi = segments[segments['speaker_type'] == 'CHI']
+        expected = (np.round(chi['segment_offset']/0.01) - np.round(chi['segment_onset']/0.01)).sum()
+        assert frames[rasterizer.categories.index('CHI')].sum() == expected
+
+def test_rasterizer_categories(raw_project):
+    am = AnnotationManager(raw_project)
+
+    assert Rasterizer(am, column = 'vcm_type').categories == ['C', 'N', 'Y', 'L', 'J']
+    assert Rasterizer(am, column = 'speaker_id', categories = ['CHI', 'MOT']).categories == ['CHI', 'MOT']
+
+    for column in ['mwu_type', 'speaker_id', 'unknown']:
+        with pytest.raises(ValueError, match = 'categories must be specified'):
+            Rasterizer(am, column = column)
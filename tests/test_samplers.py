@@ -0,0 +1,74 @@
+from ChildProject.projects import ChildProject
+from ChildProject.annotations import AnnotationManager
+from ChildProject.parallel import Executor
+from ChildProject.samplers import Sampler, PeriodicSampler, RandomSampler, HighVolubilitySampler
+import numpy as np
+import os
+import pandas as pd
+import pytest
+
+def setup_project(project):
+    recordings = pd.read_csv(os.path.join(project.path, 'metadata/recordings.csv'))
+    recordings['duration'] = 3600
+    recordings.to_csv(os.path.join(project.path, 'metadata/recordings.csv'), index = False)
+
+    return ChildProject(project.path)
+
+def test_periodic(raw_project):
+    project = setup_project(raw_project)
+    project.read()
+
+    windows = PeriodicSampler(project, 60, 600, offset = 30).sample()
+    assert windows['onset'].tolist() == [30, 630, 1230, 1830, 2430, 3030]
+    assert (windows['offset'] - windows['onset'] == 60).all()
+
+def test_random(raw_project):
+    project = setup_project(raw_project)
+    project.read()
+
+    windows = RandomSampler(project, 60, 50, seed = 0).sample()
+    assert len(windows) == 50
+    assert (windows['onset'] >= 0).all() and (windows['offset'] <= 3600).all()
+    assert (windows['onset'].values[1:] >= windows['offset'].values[:-1]).all()
+
+    # no more windows than the recording can hold
+    assert len(RandomSampler(project, 600, 10).sample()) == 6
+
+def test_high_volubility(raw_project):
+    project = setup_project(raw_project)
+
+    # 1 second of child speech every 10 seconds, and every 2 seconds in [1000, 1100) and [2500, 2560)
+    onsets = np.concatenate([np.arange(0, 3600, 10), np.arange(1000, 1100, 2), np.arange(2500, 2560, 2)])
+    with open(os.path.join(project.path, 'raw_annotations/volubility.rttm'), 'w+') as f:
+        for onset in np.unique(onsets):
+            f.write("SPEAKER sound 1 {} 1 <NA> <NA> KCHI <NA> <NA>\n".format(onset))
+
+    am = AnnotationManager(project)
+    am.import_annotations(pd.DataFrame([{
+        'set': 'vtc', 'recording_filename': 'sound.wav', 'time_seek': 0, 'range_onset': 0, 'range_offset': 3600,
+        'raw_filename': 'volubility.rttm', 'format': 'vtc_rttm', 'filter': 'sound'
+    }]))
+    am.read()
+
+    sampler = HighVolubilitySampler(project, am, 'vtc', 100, 2, speakers = ['CHI'], step = 10)
+    windows = sampler.sample(executor = Executor('serial'))
+    assert windows['onset'].tolist() == [1000, 2460]
+    assert windows['volubility'].tolist() == [50, 34]
+
+    sampler = HighVolubilitySampler(project, am, 'vtc', 100, 2, speakers = ['CHI'], step = 10, strata = 2)
+    windows = sampler.sample(executor = Executor('serial'))
+    assert windows['onset'].tolist() == [1000, 2460]
+
+    sampler = HighVolubilitySampler(project, am, 'vtc', 100, 4, speakers = ['CHI'], step = 10, strata = 4)
+    windows = sampler.sample(executor = Executor('serial'))
+    assert len(windows) == 4
+    assert windows['onset'].tolist()[1:3] == [1000, 2460]
+
+    annotations = sampler.annotations_input(windows, 'annotator')
+    assert annotations['time_seek'].tolist() == windows['onset'].astype(int).astype(str).tolist()
+    assert (annotations['range_offset'] == '100').all()
+    assert annotations['raw_filename'].iloc[1] == 'annotator/sound_1000000_1100000.eaf'
+
+def test_abstract_sampler(raw_project):
+    with pytest.raises(TypeError):
+        Sampler(raw_project, 60)
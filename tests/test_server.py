@@ -0,0 +1,78 @@
+from ChildProject.server import create_server
+import http.client
+import json
+import os
+import pandas as pd
+import shutil
+import socket
+import threading
+import time
+import urllib.request
+
+def get(server, path):
+    with urllib.request.urlopen("http://{}:{}{}".format(*server.server_address[:2], path)) as response:
+        return json.loads(response.read().decode())
+
+def test_server(tmp_path):
+    path = str(tmp_path / 'project')
+    shutil.copytree('examples/valid_raw_data', path)
+
+    server = create_server(path, port = 0)
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+
+    try:
+        assert get(server, '/stats')['total_recordings'] == 1
+
+        am = server.project_server.am
+        am.import_annotations(pd.read_csv('examples/valid_raw_data/raw_annotations/input.csv'))
+
+        segments = get(server, '/segments?set=vtc_rttm&columns=segment_onset,speaker_type&speaker_types=CHI')
+        assert len(segments) > 0 and all([s['speaker_type'] == 'CHI' for s in segments])
+
+        vc = get(server, '/vc_stats?set=metrics&turntakingthresh=1')
+        assert set([row['speaker_type'] for row in vc]) >= set(['CHI', 'FEM'])
+
+        # changes on disk are picked up
+        recordings = pd.read_csv(os.path.join(path, 'metadata/recordings.csv'))
+        pd.concat([recordings, recordings.assign(filename = 'other.wav')]).to_csv(os.path.join(path, 'metadata/recordings.csv'), index = False)
+        assert get(server, '/stats')['total_recordings'] == 2
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        super().__init__('localhost')
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+def test_unix_socket(tmp_path):
+    path = str(tmp_path / 'project')
+    shutil.copytree('examples/valid_raw_data', path)
+
+    address = str(tmp_path / 'server.sock')
+    server = create_server(path, socket = address)
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+
+    try:
+        server.project_server.am.import_annotations(pd.read_csv('examples/valid_raw_data/raw_annotations/input.csv'))
+
+        connection = UnixConnection(address)
+        connection.request('GET', '/stats')
+        response = connection.getresponse()
+        assert response.status == 200
+        assert json.loads(response.read().decode())['total_recordings'] == 1
+
+        connection.request('GET', '/segments?set=vtc_rttm&columns=segment_onset')
+        response = connection.getresponse()
+        assert response.status == 200 and len(json.loads(response.read().decode())) > 0
+        connection.close()
+    finally:
+        server.shutdown()
+        server.server_close()
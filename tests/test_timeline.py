@@ -0,0 +1,54 @@
+from ChildProject.timeline import attach_timeline, hourly_metrics, age_metrics
+import numpy as np
+import pandas as pd
+
+def test_timeline(annotated):
+    am = annotated
+    segments = am.get_segments(
+        am.annotations[am.annotations['set'] == 'vtc_rttm'],
+        columns = ['segment_onset', 'segment_offset', 'speaker_type'],
+        index_columns = ['recording_filename', 'time_seek']
+    )
+    segments = attach_timeline(am.project, segments)
+
+    # recording starts on 2020-09-18 at 9:00, the child was born on 2018-01-01
+    expected = pd.Timestamp('2020-09-18 09:00') + pd.to_timedelta(segments['segment_onset'], unit = 's')
+    assert (segments['segment_time'] == expected).all()
+    np.testing.assert_allclose(
+        segments['child_age'],
+        (expected - pd.Timestamp('2018-01-01'))/pd.Timedelta(days = 1)
+    )
+
+    hourly = hourly_metrics(segments)
+    assert hourly['voc_count'].sum() == segments.shape[0]
+    assert hourly.xs(9, level = 'bin')['voc_count'].sum() == segments.shape[0], "all segments start between 9:00 and 10:00"
+    np.testing.assert_allclose(
+        hourly.xs('CHI', level = 'speaker_type')['voc_duration'].sum(),
+        (segments['segment_offset'] - segments['segment_onset'])[segments['speaker_type'] == 'CHI'].sum()
+    )
+
+    ages = age_metrics(segments, [0, 365, 730, 1095], by = 'recording_filename')
+    assert ages.xs('[730, 1095)', level = 'bin')['voc_count'].sum() == segments.shape[0]
+    assert ages.xs('[0, 365)', level = 'bin')['voc_count'].sum() == 0
+
+
+def test_timeline_undefined_filenames(raw_project):
+    project = raw_project
+    project.read()
+
+    recording = project.recordings.iloc[0]
+    project.recordings = pd.concat([project.recordings] + [
+        project.recordings.iloc[[0]].assign(filename = filename)
+        for filename in ['NA', 'NA', 'duplicate.wav', 'duplicate.wav']
+    ], ignore_index = True)
+
+    segments = pd.DataFrame({
+        'recording_filename': [recording['filename'], 'NA', 'duplicate.wav', 'unknown.wav'],
+        'time_seek': 0,
+        'segment_onset': 10.0
+    })
+    segments = attach_timeline(project, segments)
+
+    assert segments['segment_time'].iloc[0] == pd.Timestamp('2020-09-18 09:00:10')
+    assert segments['segment_time'].iloc[1:].isnull().all()
+    assert segments['child_age'].iloc[1:].isnull().all()
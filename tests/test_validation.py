@@ -1,4 +1,14 @@
 from ChildProject.projects import ChildProject
+from ChildProject.diagnostics import Diagnostics
+from ChildProject.cache import ValidationCache
+from ChildProject.duplicates import find_duplicates
+import ChildProject.cache as ChildProject_cache
+import ChildProject.duplicates as ChildProject_duplicates
+import hashlib
+from ChildProject.tables import IndexTable
+import os
+import pandas as pd
+import shutil
 
 def test_valid_project():
     project = ChildProject("examples/valid_raw_data")
@@ -24,3 +34,188 @@ def test_invalid_project():
     
     assert sorted(expected_errors) == sorted(errors), "errors do not match expected errors"
     assert sorted(expected_warnings) == sorted(warnings), "warnings do not match expected warnings"
+
+def test_missing_child(tmp_path):
+    path = str(tmp_path / 'project')
+    shutil.copytree('examples/valid_raw_data', path)
+
+    recordings = pd.read_csv(os.path.join(path, 'metadata/recordings.csv'))
+    recordings = pd.concat([recordings, recordings.assign(child_id = 2, filename = 'NA')])
+    recordings.to_csv(os.path.join(path, 'metadata/recordings.csv'), index = False)
+
+    errors, warnings = ChildProject(path).validate_input_data()
+    assert errors == ["child_id '2' in recordings on line 3 cannot be found in the children table."]
+
+def test_capped_diagnostics(tmp_path):
+    path = str(tmp_path / 'project')
+    shutil.copytree('examples/valid_raw_data', path)
+
+    recordings = pd.read_csv(os.path.join(path, 'metadata/recordings.csv'))
+    recordings = pd.concat([recordings]*50, ignore_index = True)
+    recordings['recording_device_type'] = 'USB'
+    recordings['filename'] = ['missing_{}.wav'.format(i) for i in range(50)]
+    recordings.to_csv(os.path.join(path, 'metadata/recordings.csv'), index = False)
+
+    report = str(tmp_path / 'report.csv')
+    with Diagnostics(max_per_rule = 2, report = report) as diagnostics:
+        errors, warnings = ChildProject(path).validate_input_data(diagnostics = diagnostics)
+
+    assert errors == [
+        "'USB' is not a permitted value for column 'recording_device_type' on line 2, should be any of [lena,usb,olympus,babylogger]",
+        "'USB' is not a permitted value for column 'recording_device_type' on line 3, should be any of [lena,usb,olympus,babylogger]",
+        "cannot find recording 'missing_0.wav'",
+        "cannot find recording 'missing_1.wav'",
+        "rule 'choices' failed on 50 lines for column 'recording_device_type' of recordings table, only the first 2 are shown",
+        "rule 'missing_file' failed on 50 lines for column 'filename' of recordings table, only the first 2 are shown"
+    ]
+    assert diagnostics.count('error') == 100
+
+    report = pd.read_csv(report)
+    assert len(report) == 102
+    assert report.groupby('rule').size().to_dict() == {'choices': 50, 'missing_file': 50, 'unindexed_file': 2}
+
+def test_capped_undefined(tmp_path):
+    path = str(tmp_path / 'project')
+    shutil.copytree('examples/valid_raw_data', path)
+
+    recordings = pd.read_csv(os.path.join(path, 'metadata/recordings.csv'))
+    recordings = pd.concat([recordings]*50, ignore_index = True)
+    recordings['date_iso'] = None
+    recordings.to_csv(os.path.join(path, 'metadata/recordings.csv'), index = False)
+
+    with Diagnostics(max_per_rule = 2) as diagnostics:
+        ChildProject(path).validate_input_data(diagnostics = diagnostics, ignore_files = True)
+
+    undefined = [d for d in diagnostics.kept if d.rule == 'undefined']
+    assert [d.message for d in undefined] == [
+        "recordings table has an undefined value for column 'date_iso' on line 2",
+        "recordings table has an undefined value for column 'date_iso' on line 3"
+    ]
+    assert diagnostics.counts[('error', 'recordings', 'date_iso', 'undefined')] == 50
+
+def test_validation_cache(tmp_path, monkeypatch):
+    path = str(tmp_path / 'project')
+    shutil.copytree('examples/valid_raw_data', path)
+
+    recordings = pd.read_csv(os.path.join(path, 'metadata/recordings.csv'))
+    recordings = pd.concat([recordings]*20, ignore_index = True)
+    recordings['filename'] = 'NA'
+    recordings.loc[3, 'recording_device_type'] = 'USB'
+    recordings.to_csv(os.path.join(path, 'metadata/recordings.csv'), index = False)
+
+    checked = []
+    check_rows = IndexTable.check_rows
+    def count_rows(self, df):
+        checked.append((self.name, len(df)))
+        return check_rows(self, df)
+    monkeypatch.setattr(IndexTable, 'check_rows', count_rows)
+
+    cache = ValidationCache(str(tmp_path / 'cache'))
+    expected = ChildProject(path).validate_input_data()
+    assert checked == [('children', 1), ('recordings', 20)]
+
+    del checked[:]
+    assert ChildProject(path).validate_input_data(cache = cache) == expected
+    assert ChildProject(path).validate_input_data(cache = cache) == expected
+    assert checked == [('children', 1), ('recordings', 20)]
+
+    # only modified rows are checked again
+    del checked[:]
+    recordings.loc[5, 'recording_device_type'] = 'USB'
+    recordings.loc[[0, 6], 'notes'] = 'changed'
+    recordings.to_csv(os.path.join(path, 'metadata/recordings.csv'), index = False)
+
+    errors, warnings = ChildProject(path).validate_input_data(cache = cache)
+    assert checked == [('recordings', 2)]
+    assert errors == ChildProject(path).validate_input_data()[0]
+    assert len(errors) == 2
+
+def test_annexed_recordings(tmp_path):
+    path = str(tmp_path / 'project')
+    shutil.copytree('examples/valid_raw_data', path)
+
+    # recording annexed by git-annex, whose content has not been fetched
+    key = 'MD5E-s32812--0123456789abcdef0123456789abcdef.wav'
+    os.remove(os.path.join(path, 'recordings/sound.wav'))
+    os.symlink(os.path.join('..', '.git/annex/objects/Xk/7q', key, key), os.path.join(path, 'recordings/sound.wav'))
+
+    recordings = pd.read_csv(os.path.join(path, 'metadata/recordings.csv'))
+    recordings['duration'] = 4
+    recordings.to_csv(os.path.join(path, 'metadata/recordings.csv'), index = False)
+
+    project = ChildProject(path)
+    errors, warnings = project.validate_input_data()
+    assert errors == []
+
+    stats = project.get_stats()
+    assert stats['total_existing_recordings'] == 1
+    assert stats['total_local_recordings'] == 0
+    assert stats['audio_size'] == 32812
+    assert stats['audio_duration'] == 4
+
+def test_duplicates(tmp_path, monkeypatch):
+    path = str(tmp_path / 'project')
+    shutil.copytree('examples/valid_raw_data', path)
+
+    recordings = pd.read_csv(os.path.join(path, 'metadata/recordings.csv'))
+    recordings = pd.concat([recordings]*2, ignore_index = True)
+    recordings['filename'] = ['sound.wav', 'copy.wav']
+    recordings.to_csv(os.path.join(path, 'metadata/recordings.csv'), index = False)
+
+    shutil.copy(os.path.join(path, 'recordings/sound.wav'), os.path.join(path, 'recordings/copy.wav'))
+    shutil.copy(os.path.join(path, 'recordings/sound.wav'), os.path.join(path, 'recordings/unindexed.wav'))
+
+    # same size and same head, but different tail
+    with open(os.path.join(path, 'recordings/sound.wav'), 'rb') as f:
+        content = bytearray(f.read())
+    content[-1] = (content[-1] + 1) % 256
+    with open(os.path.join(path, 'recordings/different.wav'), 'wb') as f:
+        f.write(content)
+
+    # annexed copy whose content has not been fetched
+    key = 'MD5E-s{}--{}.wav'.format(len(content), hashlib.md5(open(os.path.join(path, 'recordings/sound.wav'), 'rb').read()).hexdigest())
+    os.symlink(os.path.join('..', '.git/annex/objects/Xk/7q', key, key), os.path.join(path, 'recordings/annexed.wav'))
+
+    project = ChildProject(path)
+    errors, warnings = project.validate_input_data()
+    assert not any('same content' in warning for warning in warnings), "duplicates should only be checked on demand"
+
+    cache = ValidationCache(str(tmp_path / 'cache'))
+    with Diagnostics() as diagnostics:
+        errors, warnings = project.validate_input_data(diagnostics = diagnostics, cache = cache, duplicates = True)
+
+    duplicates = [d for d in diagnostics.kept if d.rule == 'duplicate']
+    assert len(duplicates) == 1
+    assert duplicates[0].value == 'annexed.wav,copy.wav,sound.wav,unindexed.wav'
+    assert duplicates[0].line == 2
+
+    # fingerprints are reused by subsequent scans
+    def hash(*args):
+        raise AssertionError("unchanged files should not be hashed again")
+
+    monkeypatch.setattr(ChildProject_cache, 'file_md5', hash)
+    monkeypatch.setattr(ChildProject_cache, 'partial_md5', hash)
+    assert find_duplicates(
+        [os.path.join(path, 'recordings', f) for f in ['copy.wav', 'sound.wav', 'different.wav']],
+        cache = ValidationCache(str(tmp_path / 'cache'))
+    ) == [[os.path.join(path, 'recordings', f) for f in ['copy.wav', 'sound.wav']]]
+
+    # files which cannot be read are reported rather than aborting the scan
+    def unreadable(filename, *args, **kwargs):
+        if filename.endswith('copy.wav'):
+            raise PermissionError("permission denied: '{}'".format(filename))
+        return hashlib.md5(open(filename, 'rb').read()).hexdigest()
+
+    monkeypatch.setattr(ChildProject_duplicates, 'file_md5', unreadable)
+    monkeypatch.setattr(ChildProject_duplicates, 'partial_md5', unreadable)
+    files = [os.path.join(path, 'recordings', f) for f in ['copy.wav', 'sound.wav', 'unindexed.wav']]
+    errors = {}
+    assert find_duplicates(files, errors = errors) == [files[1:]]
+    assert list(errors.keys()) == [files[0]]
+
+    with Diagnostics() as diagnostics:
+        errors, warnings = project.validate_input_data(diagnostics = diagnostics, duplicates = True)
+
+    unreadable = [d for d in diagnostics.kept if d.rule == 'unreadable']
+    assert [(d.line, d.value) for d in unreadable] == [(3, 'copy.wav')]
+    assert [d.value for d in diagnostics.kept if d.rule == 'duplicate'] == ['annexed.wav,sound.wav,unindexed.wav']